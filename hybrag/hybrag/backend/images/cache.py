@@ -0,0 +1,142 @@
+from __future__ import annotations
+from typing import Optional
+from collections import OrderedDict
+import os
+import sqlite3
+import threading
+import time
+
+
+class LRUCache:
+	"""Thread-safe in-process LRU keyed by string."""
+
+	def __init__(self, max_entries: int = 1024):
+		self.max_entries = max(0, int(max_entries))
+		self._data: OrderedDict = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, key: str):
+		with self._lock:
+			if key not in self._data:
+				return None
+			self._data.move_to_end(key)
+			return self._data[key]
+
+	def set(self, key: str, value) -> None:
+		if self.max_entries == 0:
+			return
+		with self._lock:
+			self._data[key] = value
+			self._data.move_to_end(key)
+			while len(self._data) > self.max_entries:
+				self._data.popitem(last=False)
+
+	def clear(self) -> None:
+		with self._lock:
+			self._data.clear()
+
+	def __len__(self) -> int:
+		return len(self._data)
+
+
+class SharedDiskCache:
+	"""Byte-valued cache in a SQLite file, shared by every process on the host
+	(gunicorn workers). Evicts least-recently-used rows once max_bytes is exceeded.
+	All failures are swallowed: a broken cache must never break the caller.
+	"""
+
+	def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024):
+		self.path = path
+		self.max_bytes = int(max_bytes)
+		self._local = threading.local()
+		self._writes = 0
+		d = os.path.dirname(path)
+		if d:
+			os.makedirs(d, exist_ok=True)
+
+	def _conn(self) -> sqlite3.Connection:
+		# One connection per thread and per process (connections must not cross a fork)
+		conn = getattr(self._local, 'conn', None)
+		if conn is not None and getattr(self._local, 'pid', None) == os.getpid():
+			return conn
+		conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+		conn.execute('PRAGMA journal_mode=WAL')
+		conn.execute('PRAGMA synchronous=NORMAL')
+		conn.execute(
+			'CREATE TABLE IF NOT EXISTS entries ('
+			'key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)'
+		)
+		conn.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed)')
+		# Counters are kept out of `entries` so LRU eviction can never reset them
+		conn.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+		self._local.conn = conn
+		self._local.pid = os.getpid()
+		return conn
+
+	def get(self, key: str) -> Optional[bytes]:
+		try:
+			conn = self._conn()
+			row = conn.execute('SELECT value FROM entries WHERE key = ?', (key,)).fetchone()
+			if row is None:
+				return None
+			conn.execute('UPDATE entries SET accessed = ? WHERE key = ?', (time.time(), key))
+			return bytes(row[0])
+		except Exception:
+			return None
+
+	def set(self, key: str, value: bytes) -> None:
+		try:
+			conn = self._conn()
+			conn.execute(
+				'INSERT OR REPLACE INTO entries (key, value, size, accessed) VALUES (?, ?, ?, ?)',
+				(key, sqlite3.Binary(value), len(value), time.time()),
+			)
+			self._writes += 1
+			# Size check is a full aggregate; amortize it over several writes
+			if self._writes % 32 == 1:
+				self._evict(conn)
+		except Exception:
+			pass
+
+	def delete(self, key: str) -> None:
+		try:
+			self._conn().execute('DELETE FROM entries WHERE key = ?', (key,))
+		except Exception:
+			pass
+
+	def counter(self, name: str) -> Optional[int]:
+		"""Current value of a shared counter (0 if never incremented; None if the file is unusable)."""
+		try:
+			row = self._conn().execute('SELECT value FROM counters WHERE name = ?', (name,)).fetchone()
+			return int(row[0]) if row else 0
+		except Exception:
+			return None
+
+	def incr(self, name: str) -> Optional[int]:
+		"""Atomically increment a shared counter and return the new value."""
+		try:
+			conn = self._conn()
+			conn.execute(
+				'INSERT INTO counters (name, value) VALUES (?, 1) '
+				'ON CONFLICT(name) DO UPDATE SET value = value + 1',
+				(name,),
+			)
+			return int(conn.execute('SELECT value FROM counters WHERE name = ?', (name,)).fetchone()[0])
+		except Exception:
+			return None
+
+	def _evict(self, conn: sqlite3.Connection) -> None:
+		total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+		if total <= self.max_bytes:
+			return
+		# Trim down to 90% so we do not evict again on the very next write
+		target = int(self.max_bytes * 0.9)
+		excess = total - target
+		rows = conn.execute('SELECT key, size FROM entries ORDER BY accessed ASC').fetchall()
+		doomed = []
+		for key, size in rows:
+			if excess <= 0:
+				break
+			doomed.append((key,))
+			excess -= int(size)
+		conn.executemany('DELETE FROM entries WHERE key = ?', doomed)
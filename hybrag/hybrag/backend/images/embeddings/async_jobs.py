@@ -0,0 +1,475 @@
+from __future__ import annotations
+from typing import Any, Callable, Dict, List, Optional
+from collections import OrderedDict
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
+import json
+import threading
+import time
+import uuid
+from .metrics import LatencyHistogram
+from .polling import AdaptivePollingPolicy, completion_histogram
+
+
+def parse_s3_uri(uri: str) -> tuple[str, str]:
+	if not uri.startswith('s3://'):
+		raise ValueError(f'Not an s3 uri: {uri}')
+	without = uri[len('s3://'):]
+	parts = without.split('/', 1)
+	if len(parts) != 2:
+		raise ValueError(f'Invalid s3 uri: {uri}')
+	return parts[0], parts[1]
+
+
+class BadResponseShape(RuntimeError):
+	pass
+
+
+class AsyncJob:
+	def __init__(self, payload: dict, parse: Callable[[Any], Any], timeout: float):
+		self.id = str(uuid.uuid4())
+		self.payload = payload
+		self.parse = parse
+		self.future: Future = Future()
+		self.submitted_at = time.time()
+		self.deadline = self.submitted_at + timeout
+		self.next_probe_at = self.submitted_at
+		self.probes = 0
+		self.input_key: Optional[str] = None
+		self.input_location: Optional[str] = None
+		self.out_bucket: Optional[str] = None
+		self.out_key: Optional[str] = None
+		# Set instead of out_key when the endpoint returned no OutputLocation
+		self.out_candidate_prefix: Optional[str] = None
+		self.failure_bucket: Optional[str] = None
+		self.failure_key: Optional[str] = None
+		# Output object actually read (its key is only known up front when out_key is set)
+		self.result_bucket: Optional[str] = None
+		self.result_key: Optional[str] = None
+		self.last_err: Optional[str] = None
+
+
+class AsyncEmbeddingJobManager:
+	"""Submits SageMaker async invocations and resolves them as futures.
+
+	Submission (input upload + invoke_endpoint_async) runs on a small thread pool;
+	one scheduler thread probes pending outputs when the polling policy says they
+	are due. Groups of due jobs that share an output prefix are discovered with
+	list_objects_v2 instead of one GET per job.
+
+	With cleanup on, a job's input, output and failure objects are deleted once
+	it resolves, so the output prefix (fixed by the endpoint config and shared by
+	every worker) only holds results still in flight and listings stay short.
+	Jobs that time out leave theirs for a bucket lifecycle rule, since the
+	endpoint may still write them.
+	"""
+
+	def __init__(
+		self,
+		runtime_client,
+		s3_client,
+		endpoint_name: str,
+		input_bucket: str,
+		input_prefix: str = 'siglip2-async-inputs/',
+		output_bucket: Optional[str] = None,
+		output_prefix: str = 'siglip2-async-outputs/',
+		timeout: float = 150,
+		accept: str = 'application/json',
+		decode: Optional[Callable[[bytes, Optional[str]], Any]] = None,
+		polling: Optional[AdaptivePollingPolicy] = None,
+		max_in_flight: int = 256,
+		submit_concurrency: int = 16,
+		list_threshold: int = 16,
+		cleanup: bool = True,
+	):
+		self.client = runtime_client
+		self.s3 = s3_client
+		self.endpoint_name = endpoint_name
+		self.input_bucket = input_bucket
+		self.input_prefix = input_prefix
+		self.output_bucket = output_bucket or input_bucket
+		self.output_prefix = output_prefix
+		self.timeout = float(timeout)
+		self.accept = accept
+		self.decode = decode or (lambda raw, _content_type: json.loads(raw))
+		self.completion_time = completion_histogram(endpoint_name)
+		self.polling = polling or AdaptivePollingPolicy(self.completion_time)
+		# Floor on probe spacing; raised when notifications make polling a fallback
+		self.min_poll_interval = 0.0
+		# Above this many pending jobs under one prefix, a listing is cheaper than per-job GETs
+		self.list_threshold = int(list_threshold)
+		self.cleanup = bool(cleanup)
+		self._slots = threading.BoundedSemaphore(max(1, int(max_in_flight)))
+		self._submit_pool = ThreadPoolExecutor(max_workers=max(1, int(submit_concurrency)), thread_name_prefix='async-embed-submit')
+		self._pending: Dict[str, AsyncJob] = {}
+		# s3:// input/output/failure location -> job, for notification lookups
+		self._by_location: Dict[str, AsyncJob] = {}
+		# Locations of jobs resolved in the last resolved_ttl seconds -> when; their
+		# notifications are still ours (the poller or the timeout got there first)
+		self._resolved: 'OrderedDict[str, float]' = OrderedDict()
+		self.resolved_ttl = 900.0
+		self.listener = None
+		self._cond = threading.Condition()
+		self._scheduler: Optional[threading.Thread] = None
+		self.s3_list_requests = 0
+		self.s3_get_requests = 0
+		self.completed = 0
+		self.failed = 0
+		self.latency = LatencyHistogram()
+		self.latency_by_source: Dict[str, LatencyHistogram] = {}
+		# Time between the output landing in S3 and us noticing it
+		self.discovery_lag = LatencyHistogram()
+
+	def attach_listener(self, listener, fallback_poll_interval: float = 15.0) -> None:
+		# Notifications resolve jobs; polling only catches missed or delayed messages
+		self.listener = listener
+		self.min_poll_interval = max(self.min_poll_interval, float(fallback_poll_interval))
+		listener.start()
+
+	def submit(self, payload: dict, parse: Optional[Callable[[Any], Any]] = None) -> Future:
+		# Blocks once max_in_flight jobs are outstanding
+		self._slots.acquire()
+		job = AsyncJob(payload, parse or (lambda data: data), self.timeout)
+		job.future.add_done_callback(lambda _f: self._slots.release())
+		self._submit_pool.submit(self._start, job)
+		return job.future
+
+	def submit_many(self, payloads: List[dict], parse: Optional[Callable[[Any], Any]] = None) -> List[Future]:
+		return [self.submit(p, parse) for p in payloads]
+
+	def pending_count(self) -> int:
+		with self._cond:
+			return len(self._pending)
+
+	def _start(self, job: AsyncJob) -> None:
+		try:
+			key = f"{self.input_prefix.rstrip('/')}/{job.id}.json"
+			self.s3.put_object(Bucket=self.input_bucket, Key=key, Body=json.dumps(job.payload).encode('utf-8'), ContentType='application/json')
+			job.input_key = key
+			in_loc = f"s3://{self.input_bucket}/{key}"
+			job.input_location = in_loc
+			# Claimed before invoking: a completion notification can arrive before the call returns
+			with self._cond:
+				self._by_location[in_loc] = job
+			resp = self._invoke_async(in_loc)
+			out_loc = resp.get('OutputLocation')
+			if out_loc:
+				job.out_bucket, job.out_key = parse_s3_uri(out_loc)
+			else:
+				# Some async setups rely on known output prefix; derive path from request key
+				job.out_bucket = self.output_bucket
+				job.out_candidate_prefix = f"{self.output_prefix.rstrip('/')}/{job.id}"
+			fail_loc = resp.get('FailureLocation')
+			if fail_loc:
+				job.failure_bucket, job.failure_key = parse_s3_uri(fail_loc)
+		except Exception as e:
+			with self._cond:
+				self._forget(job)
+			job.future.set_exception(e)
+			return
+		self._schedule(job)
+		with self._cond:
+			if job.future.done():
+				# Resolved by a notification while invoke_endpoint_async was in flight
+				self._forget(job)
+				return
+			self._pending[job.id] = job
+			for loc in self._locations(job):
+				self._by_location[loc] = job
+			self._ensure_scheduler()
+			self._cond.notify()
+
+	def _forget(self, job: AsyncJob) -> None:
+		# Caller holds self._cond
+		self._pending.pop(job.id, None)
+		now = time.time()
+		for loc in self._locations(job):
+			self._by_location.pop(loc, None)
+			self._resolved[loc] = now
+			self._resolved.move_to_end(loc)
+		while self._resolved and now - next(iter(self._resolved.values())) > self.resolved_ttl:
+			self._resolved.popitem(last=False)
+
+	@staticmethod
+	def _locations(job: AsyncJob) -> List[str]:
+		locs = [job.input_location] if job.input_location else []
+		if job.out_key:
+			locs.append(f"s3://{job.out_bucket}/{job.out_key}")
+		if job.failure_key:
+			locs.append(f"s3://{job.failure_bucket}/{job.failure_key}")
+		return locs
+
+	def _invoke_async(self, in_loc: str) -> dict:
+		resp = self.client.invoke_endpoint_async(
+			EndpointName=self.endpoint_name,
+			InputLocation=in_loc,
+			ContentType='application/json',
+			Accept=self.accept,
+		)
+		if resp.get('OutputLocation'):
+			return resp
+		# If the endpoint is cold or has 0 instances, briefly retry invoke until it accepts
+		start = time.time()
+		while time.time() - start < 60:
+			time.sleep(2)
+			try:
+				retry = self.client.invoke_endpoint_async(
+					EndpointName=self.endpoint_name,
+					InputLocation=in_loc,
+					ContentType='application/json',
+					Accept=self.accept,
+				)
+				if retry.get('OutputLocation'):
+					return retry
+			except Exception:
+				pass
+		return resp
+
+	def _ensure_scheduler(self) -> None:
+		if self._scheduler is None or not self._scheduler.is_alive():
+			self._scheduler = threading.Thread(target=self._run, name='async-embed-poller', daemon=True)
+			self._scheduler.start()
+
+	def _schedule(self, job: AsyncJob) -> None:
+		now = time.time()
+		delay = max(self.min_poll_interval, self.polling.next_delay(now - job.submitted_at))
+		job.next_probe_at = min(now + delay, job.deadline)
+
+	def _run(self) -> None:
+		while True:
+			with self._cond:
+				while not self._pending:
+					self._cond.wait()
+				for job in [j for j in self._pending.values() if j.future.done()]:
+					# Resolved by a notification between the check in _start and registration
+					self._forget(job)
+				if not self._pending:
+					continue
+				now = time.time()
+				due = [j for j in self._pending.values() if j.next_probe_at <= now]
+				if not due:
+					wake = min(j.next_probe_at for j in self._pending.values())
+					# New submissions notify; otherwise sleep until the earliest probe
+					self._cond.wait(timeout=max(0.01, wake - now))
+					continue
+			try:
+				self._poll_once(due)
+			except Exception:
+				pass
+			for job in due:
+				if not job.future.done():
+					job.probes += 1
+					self._schedule(job)
+
+	def _poll_once(self, jobs: List[AsyncJob]) -> None:
+		groups: Dict[tuple, List[AsyncJob]] = {}
+		for job in jobs:
+			key = job.out_key or job.out_candidate_prefix or ''
+			groups.setdefault((job.out_bucket, key.rsplit('/', 1)[0] + '/'), []).append(job)
+		for (bucket, prefix), group in groups.items():
+			if len(group) >= self.list_threshold:
+				self._poll_by_listing(bucket, prefix, group)
+			else:
+				for job in group:
+					self._poll_single(job)
+		self._poll_failures([j for j in jobs if j.failure_key and not j.future.done()])
+		# Jobs past their deadline got one last probe above
+		now = time.time()
+		for job in jobs:
+			if now >= job.deadline and not job.future.done():
+				self._resolve(job, error=RuntimeError(job.last_err or 'Timed out waiting for async output'), source='timeout')
+
+	def _poll_single(self, job: AsyncJob) -> None:
+		try:
+			if job.out_key:
+				self.s3_get_requests += 1
+				obj = self.s3.get_object(Bucket=job.out_bucket, Key=job.out_key)
+				self._complete(job, obj)
+				return
+			self.s3_list_requests += 1
+			lst = self.s3.list_objects_v2(Bucket=job.out_bucket, Prefix=job.out_candidate_prefix)
+			contents = lst.get('Contents') or []
+			if contents:
+				best = sorted(contents, key=lambda x: x.get('LastModified') or 0, reverse=True)[0]
+				self._fetch(job, best['Key'])
+		except self.s3.exceptions.NoSuchKey:  # type: ignore[attr-defined]
+			pass
+		except Exception as e:
+			job.last_err = str(e)
+
+	def _poll_by_listing(self, bucket: str, prefix: str, group: List[AsyncJob]) -> None:
+		by_key = {j.out_key: j for j in group if j.out_key}
+		by_prefix = [j for j in group if not j.out_key]
+		token = None
+		while by_key or by_prefix:
+			params = {"Bucket": bucket, "Prefix": prefix}
+			if token:
+				params["ContinuationToken"] = token
+			self.s3_list_requests += 1
+			res = self.s3.list_objects_v2(**params)
+			for obj in res.get('Contents') or []:
+				k = obj['Key']
+				job = by_key.pop(k, None)
+				if job is None:
+					for cand in by_prefix:
+						if k.startswith(cand.out_candidate_prefix or '\0'):
+							job = cand
+							by_prefix.remove(cand)
+							break
+				if job is not None:
+					self._fetch(job, k)
+			if not res.get('IsTruncated'):
+				break
+			token = res.get('NextContinuationToken')
+
+	def _poll_failures(self, jobs: List[AsyncJob]) -> None:
+		groups: Dict[tuple, List[AsyncJob]] = {}
+		for job in jobs:
+			groups.setdefault((job.failure_bucket, job.failure_key.rsplit('/', 1)[0] + '/'), []).append(job)
+		for (bucket, prefix), group in groups.items():
+			if len(group) >= self.list_threshold:
+				# One listing tells us which of the pending jobs have failed
+				by_key = {j.failure_key: j for j in group}
+				token = None
+				failed: List[AsyncJob] = []
+				while True:
+					params = {"Bucket": bucket, "Prefix": prefix}
+					if token:
+						params["ContinuationToken"] = token
+					self.s3_list_requests += 1
+					try:
+						res = self.s3.list_objects_v2(**params)
+					except Exception:
+						break
+					failed.extend(by_key[o['Key']] for o in res.get('Contents') or [] if o['Key'] in by_key)
+					if not res.get('IsTruncated'):
+						break
+					token = res.get('NextContinuationToken')
+				group = failed
+			for job in group:
+				self._fail_from_location(job)
+
+	def _fail_from_location(self, job: AsyncJob) -> None:
+		try:
+			self.s3_get_requests += 1
+			obj = self.s3.get_object(Bucket=job.failure_bucket, Key=job.failure_key)
+			reason = obj['Body'].read().decode('utf-8', 'replace')[:2000]
+			self._resolve(job, error=RuntimeError(f'Async inference failed: {reason}'), source='poll')
+		except self.s3.exceptions.NoSuchKey:  # type: ignore[attr-defined]
+			pass
+		except Exception:
+			pass
+
+	def handle_notification(self, note: Dict[str, Any]) -> bool:
+		"""Resolve the job a parsed SNS/SQS notification refers to. Returns False
+		when the job is not owned by this process; True (so the message is deleted)
+		also for a job of ours that was already resolved by polling or its timeout."""
+		job = None
+		with self._cond:
+			locs = [loc for loc in (note.get('output_location'), note.get('failure_location'), note.get('input_location')) if loc]
+			for loc in locs:
+				if loc in self._by_location:
+					job = self._by_location[loc]
+					break
+			if job is None:
+				return any(loc in self._resolved for loc in locs)
+		if note.get('ok'):
+			loc = note.get('output_location')
+			if loc:
+				bucket, key = parse_s3_uri(loc)
+			else:
+				bucket, key = job.out_bucket, job.out_key
+			if key:
+				self._fetch(job, key, bucket=bucket, source='notification')
+			# On a failed fetch the job stays pending and polling picks it up
+			return True
+		reason = note.get('failure_reason') or note.get('status') or 'unknown error'
+		self._resolve(job, error=RuntimeError(f'Async inference failed: {reason}'), source='notification')
+		return True
+
+	def _fetch(self, job: AsyncJob, key: str, bucket: Optional[str] = None, source: str = 'poll') -> None:
+		try:
+			self.s3_get_requests += 1
+			obj = self.s3.get_object(Bucket=bucket or job.out_bucket, Key=key)
+			job.result_bucket, job.result_key = bucket or job.out_bucket, key
+			self._complete(job, obj, source=source)
+		except Exception as e:
+			job.last_err = str(e)
+
+	def _complete(self, job: AsyncJob, obj: dict, source: str = 'poll') -> None:
+		# Outputs are written atomically, so an unparseable one will not get better on re-read
+		self._observe_completion(job, obj.get('LastModified'))
+		try:
+			result = job.parse(self.decode(obj['Body'].read(), obj.get('ContentType')))
+		except Exception as e:
+			self._resolve(job, error=RuntimeError(f'Bad async response: {e}'), source=source)
+			return
+		if result is None:
+			self._resolve(job, error=BadResponseShape('Bad async response shape'), source=source)
+			return
+		self._resolve(job, result=result, source=source)
+
+	def _observe_completion(self, job: AsyncJob, last_modified) -> None:
+		# The output's LastModified (1 s resolution) approximates when inference finished
+		if last_modified is None or not hasattr(last_modified, 'timestamp'):
+			return
+		finished = last_modified.timestamp()
+		if finished == int(finished):
+			# Whole-second timestamp: assume the midpoint of that second
+			finished = min(finished + 0.5, time.time())
+		self.completion_time.observe(max(0.0, finished - job.submitted_at))
+		self.discovery_lag.observe(max(0.0, time.time() - finished))
+
+	def _resolve(self, job: AsyncJob, result: Any = None, error: Optional[BaseException] = None, source: str = 'poll') -> None:
+		with self._cond:
+			self._forget(job)
+		if job.future.done():
+			return
+		elapsed = time.time() - job.submitted_at
+		self.latency.observe(elapsed)
+		with self._cond:
+			hist = self.latency_by_source.setdefault(source, LatencyHistogram())
+		hist.observe(elapsed)
+		try:
+			if error is not None:
+				job.future.set_exception(error)
+				self.failed += 1
+			else:
+				job.future.set_result(result)
+				self.completed += 1
+		except InvalidStateError:
+			# Already resolved by another path
+			return
+		if self.cleanup and source != 'timeout':
+			self._submit_pool.submit(self._delete_job_objects, job)
+
+	def _delete_job_objects(self, job: AsyncJob) -> None:
+		by_bucket: Dict[str, set] = {}
+		for bucket, key in (
+			(self.input_bucket, job.input_key),
+			(job.out_bucket, job.out_key),
+			(job.result_bucket, job.result_key),
+			(job.failure_bucket, job.failure_key),
+		):
+			if bucket and key:
+				by_bucket.setdefault(bucket, set()).add(key)
+		for bucket, keys in by_bucket.items():
+			try:
+				self.s3.delete_objects(Bucket=bucket, Delete={"Objects": [{"Key": k} for k in sorted(keys)], "Quiet": True})
+			except Exception:
+				# Left for the lifecycle rule
+				pass
+
+	def stats(self) -> dict:
+		return {
+			"pending": self.pending_count(),
+			"completed": self.completed,
+			"failed": self.failed,
+			"s3_list_requests": self.s3_list_requests,
+			"s3_get_requests": self.s3_get_requests,
+			"polling": {**self.polling.describe(), "min_poll_interval": self.min_poll_interval},
+			"completion_time": self.completion_time.snapshot(),
+			"discovery_lag": self.discovery_lag.snapshot(),
+			"latency": self.latency.snapshot(),
+			"latency_by_source": {k: h.snapshot() for k, h in self.latency_by_source.items()},
+			"listener": self.listener.stats() if self.listener is not None else None,
+		}
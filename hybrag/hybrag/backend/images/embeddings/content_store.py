@@ -0,0 +1,81 @@
+from __future__ import annotations
+from typing import List, Optional
+from botocore.exceptions import ClientError
+import hashlib
+import threading
+import numpy as np
+from ..cache import SharedDiskCache
+from .siglip import _decode_binary_embeddings, encode_f32_embeddings
+
+
+def content_hash(data: bytes) -> str:
+	return hashlib.sha256(data).hexdigest()
+
+
+class ContentAddressedEmbeddingStore:
+	"""Image embeddings keyed by sha256 of the image bytes plus the model namespace.
+
+	Backed either by a host-local SQLite file (shared by workers) or by S3 objects
+	under `prefix`, so identical uploads skip inference entirely. Values use the
+	F32E binary format from siglip.
+	"""
+
+	def __init__(self, namespace: str, local_path: Optional[str] = None, max_bytes: int = 1024 * 1024 * 1024,
+			s3_client=None, bucket: Optional[str] = None, prefix: str = 'embeddings/by-content/'):
+		if not local_path and not (s3_client and bucket):
+			raise ValueError('ContentAddressedEmbeddingStore needs local_path or s3_client + bucket')
+		# Namespace covers model and preprocessing; a different model must never reuse vectors
+		self.namespace = hashlib.sha1(namespace.encode('utf-8')).hexdigest()[:16]
+		self.local = SharedDiskCache(local_path, max_bytes=max_bytes) if local_path else None
+		self.s3 = s3_client
+		self.bucket = bucket
+		self.prefix = prefix.rstrip('/')
+		self._lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+
+	def _key(self, digest: str) -> str:
+		return f"{self.prefix}/{self.namespace}/{digest[:2]}/{digest}.f32"
+
+	def get(self, digest: str) -> List[float] | None:
+		raw = None
+		try:
+			if self.local is not None:
+				raw = self.local.get(self._key(digest))
+			else:
+				raw = self.s3.get_object(Bucket=self.bucket, Key=self._key(digest))['Body'].read()
+		except ClientError:
+			raw = None
+		vec = None
+		if raw:
+			try:
+				arr = _decode_binary_embeddings(raw)
+				vec = arr[0].tolist() if arr is not None and len(arr) else None
+			except Exception:
+				vec = None
+		with self._lock:
+			if vec is None:
+				self.misses += 1
+			else:
+				self.hits += 1
+		return vec
+
+	def put(self, digest: str, vec: List[float]) -> None:
+		raw = encode_f32_embeddings(np.asarray(vec, dtype=np.float32))
+		try:
+			if self.local is not None:
+				self.local.set(self._key(digest), raw)
+			else:
+				self.s3.put_object(Bucket=self.bucket, Key=self._key(digest), Body=raw, ContentType='application/x-embedding-f32')
+		except Exception:
+			# Losing a cache write only costs a future inference
+			pass
+
+	def stats(self) -> dict:
+		total = self.hits + self.misses
+		return {
+			"backend": 'local' if self.local is not None else 's3',
+			"hits": self.hits,
+			"misses": self.misses,
+			"hit_rate": (self.hits / total) if total else 0.0,
+		}
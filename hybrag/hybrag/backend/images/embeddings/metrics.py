@@ -0,0 +1,59 @@
+from __future__ import annotations
+from typing import Dict, List
+import bisect
+import threading
+
+
+def _default_bounds() -> List[float]:
+	# Log-spaced bucket upper bounds from 5 ms to ~20 min
+	bounds = []
+	b = 0.005
+	while b < 1200:
+		bounds.append(round(b, 4))
+		b *= 1.25
+	return bounds
+
+
+class LatencyHistogram:
+	"""Bucketed latency histogram (seconds) with approximate percentiles."""
+
+	def __init__(self, bounds: List[float] | None = None):
+		self.bounds = list(bounds or _default_bounds())
+		self.counts = [0] * (len(self.bounds) + 1)
+		self.count = 0
+		self.total = 0.0
+		self.max = 0.0
+		self._lock = threading.Lock()
+
+	def observe(self, seconds: float) -> None:
+		seconds = max(0.0, float(seconds))
+		i = bisect.bisect_left(self.bounds, seconds)
+		with self._lock:
+			self.counts[i] += 1
+			self.count += 1
+			self.total += seconds
+			if seconds > self.max:
+				self.max = seconds
+
+	def percentile(self, p: float) -> float | None:
+		"""Upper bound of the bucket holding the p-th percentile (0-100)."""
+		with self._lock:
+			if self.count == 0:
+				return None
+			target = max(1, int(round(self.count * p / 100.0)))
+			seen = 0
+			for i, c in enumerate(self.counts):
+				seen += c
+				if seen >= target:
+					return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+		return self.max
+
+	def snapshot(self) -> Dict[str, float | int | None]:
+		return {
+			"count": self.count,
+			"mean": (self.total / self.count) if self.count else None,
+			"p50": self.percentile(50),
+			"p90": self.percentile(90),
+			"p99": self.percentile(99),
+			"max": self.max if self.count else None,
+		}
@@ -0,0 +1,137 @@
+from __future__ import annotations
+from typing import Any, Callable, List, Optional
+from concurrent.futures import Future
+import threading
+import time
+from .async_jobs import AsyncEmbeddingJobManager, BadResponseShape
+from .singleflight import _chain
+
+
+class _Item:
+	__slots__ = ('image_url', 'normalize', 'future', 'solo')
+
+	def __init__(self, image_url: str, normalize: bool):
+		self.image_url = image_url
+		self.normalize = normalize
+		self.future: Future = Future()
+		# Set once its batch failed; resubmitted as its own job
+		self.solo = False
+
+
+class ImageMicroBatcher:
+	"""Gathers image embed requests for up to `window` seconds or `max_items`
+	requests and submits them as one {"image_urls": [...]} async job, then splits
+	the returned vectors back to each caller's future.
+
+	If a batch job fails, its images are resubmitted one per job so a single bad
+	URL or undecodable image fails only its own caller. If the endpoint answered
+	with the wrong shape it is assumed not to support image_urls, and batching is
+	also switched off for the rest of the process.
+	"""
+
+	def __init__(
+		self,
+		jobs: AsyncEmbeddingJobManager,
+		parse_one: Callable[[Any], Any],
+		parse_many: Callable[[Any, int], Any],
+		window: float = 0.05,
+		max_items: int = 16,
+	):
+		self.jobs = jobs
+		self.parse_one = parse_one
+		self.parse_many = parse_many
+		self.window = float(window)
+		self.max_items = max(1, int(max_items))
+		self.enabled = self.max_items > 1
+		self._queue: List[_Item] = []
+		self._cond = threading.Condition()
+		self._thread: Optional[threading.Thread] = None
+		self.batches = 0
+		self.batched_items = 0
+		self.fallback_items = 0
+
+	def submit(self, image_url: str, normalize: bool = True) -> Future:
+		if not self.enabled:
+			return self.jobs.submit({"image_url": image_url, "normalize": normalize}, parse=self.parse_one)
+		item = _Item(image_url, normalize)
+		with self._cond:
+			self._queue.append(item)
+			if self._thread is None or not self._thread.is_alive():
+				self._thread = threading.Thread(target=self._run, name='image-microbatch', daemon=True)
+				self._thread.start()
+			self._cond.notify()
+		return item.future
+
+	def _run(self) -> None:
+		while True:
+			with self._cond:
+				while not self._queue:
+					self._cond.wait()
+				# Window opens with the first queued item
+				deadline = time.time() + self.window
+				while len(self._queue) < self.max_items:
+					remaining = deadline - time.time()
+					if remaining <= 0:
+						break
+					self._cond.wait(timeout=remaining)
+				batch, self._queue = self._queue[:self.max_items], self._queue[self.max_items:]
+			for it in batch:
+				if it.solo:
+					self._single(it)
+			for normalize in (True, False):
+				group = [it for it in batch if it.normalize == normalize and not it.solo]
+				if group:
+					self._dispatch(group, normalize)
+
+	def _dispatch(self, group: List[_Item], normalize: bool) -> None:
+		if len(group) == 1 or not self.enabled:
+			for it in group:
+				self._single(it)
+			return
+		n = len(group)
+		try:
+			fut = self.jobs.submit(
+				{"image_urls": [it.image_url for it in group], "normalize": normalize},
+				parse=lambda data: self.parse_many(data, n),
+			)
+		except Exception as e:
+			for it in group:
+				it.future.set_exception(e)
+			return
+		self.batches += 1
+		self.batched_items += n
+		fut.add_done_callback(lambda f: self._split(f, group))
+
+	def _split(self, fut: Future, group: List[_Item]) -> None:
+		err = fut.exception()
+		if err is None:
+			for it, vec in zip(group, fut.result()):
+				it.future.set_result(vec)
+			return
+		if isinstance(err, BadResponseShape):
+			self.enabled = False
+		# Runs on the job scheduler thread: hand the retries to the batcher thread
+		# rather than blocking here on max_in_flight
+		for it in group:
+			it.solo = True
+		with self._cond:
+			self._queue[:0] = group
+			self._cond.notify()
+
+	def _single(self, it: _Item) -> None:
+		self.fallback_items += 1
+		try:
+			inner = self.jobs.submit({"image_url": it.image_url, "normalize": it.normalize}, parse=self.parse_one)
+		except Exception as e:
+			it.future.set_exception(e)
+			return
+		inner.add_done_callback(lambda f: _chain(f, it.future))
+
+	def stats(self) -> dict:
+		return {
+			"enabled": self.enabled,
+			"batches": self.batches,
+			"batched_items": self.batched_items,
+			"fallback_items": self.fallback_items,
+			"mean_batch_size": (self.batched_items / self.batches) if self.batches else None,
+		}
@@ -0,0 +1,134 @@
+from __future__ import annotations
+from typing import Any, Dict, Optional
+import json
+import random
+import threading
+import time
+
+
+def parse_async_notification(body: str) -> Dict[str, Any] | None:
+	"""Extract locations/status from a SageMaker async success or error notification.
+
+	Accepts both the raw SNS payload (SNS -> SQS with raw delivery) and the SNS
+	envelope where the payload sits in 'Message'.
+	"""
+	try:
+		data = json.loads(body)
+	except Exception:
+		return None
+	if isinstance(data, dict) and isinstance(data.get('Message'), str):
+		try:
+			data = json.loads(data['Message'])
+		except Exception:
+			return None
+	if not isinstance(data, dict):
+		return None
+	req = data.get('requestParameters') or {}
+	resp = data.get('responseParameters') or {}
+	status = str(data.get('invocationStatus') or '')
+	out = {
+		"ok": status.lower() == 'completed',
+		"status": status,
+		"inference_id": data.get('inferenceId'),
+		"input_location": req.get('inputLocation'),
+		"output_location": resp.get('outputLocation'),
+		"failure_location": resp.get('failureLocation') or data.get('failureLocation'),
+		"failure_reason": data.get('failureReason'),
+	}
+	if not (out["input_location"] or out["output_location"] or out["failure_location"]):
+		return None
+	return out
+
+
+class AsyncCompletionListener:
+	"""Long-polls the SQS queue subscribed to the async endpoint's success/error
+	SNS topics and hands each notification to the job manager.
+
+	Every worker process consumes the same queue, so a message for a job owned by
+	another process is released rather than deleted, with a random visibility of
+	1..release_visibility seconds so N workers do not hand it round in lockstep;
+	messages older than max_age are dropped since no caller can still be waiting
+	on them. Messages for jobs this process already resolved some other way are
+	deleted by the manager's claim. A redrive policy on the queue is the backstop
+	for anything left over.
+	"""
+
+	def __init__(self, sqs_client, queue_url: str, manager, wait_seconds: int = 20, max_messages: int = 10, max_age: float = 300, release_visibility: int = 5):
+		self.sqs = sqs_client
+		self.queue_url = queue_url
+		self.manager = manager
+		self.wait_seconds = int(wait_seconds)
+		self.max_messages = int(max_messages)
+		self.max_age = float(max_age)
+		self.release_visibility = max(1, int(release_visibility))
+		self._thread: Optional[threading.Thread] = None
+		self._stop = threading.Event()
+		self.received = 0
+		self.matched = 0
+		self.released = 0
+		self.dropped = 0
+		self.errors = 0
+
+	def start(self) -> None:
+		if self._thread is None or not self._thread.is_alive():
+			self._stop.clear()
+			self._thread = threading.Thread(target=self._run, name='async-embed-sqs', daemon=True)
+			self._thread.start()
+
+	def stop(self) -> None:
+		self._stop.set()
+
+	def _run(self) -> None:
+		while not self._stop.is_set():
+			try:
+				self.poll_once()
+			except Exception:
+				self.errors += 1
+				time.sleep(1)
+
+	def poll_once(self) -> int:
+		res = self.sqs.receive_message(
+			QueueUrl=self.queue_url,
+			MaxNumberOfMessages=self.max_messages,
+			WaitTimeSeconds=self.wait_seconds,
+			AttributeNames=['SentTimestamp'],
+		)
+		messages = res.get('Messages') or []
+		done = []
+		for msg in messages:
+			self.received += 1
+			note = parse_async_notification(msg.get('Body') or '')
+			if note is not None and self.manager.handle_notification(note):
+				self.matched += 1
+				done.append(msg)
+				continue
+			sent = float((msg.get('Attributes') or {}).get('SentTimestamp') or 0) / 1000.0
+			if note is None or (sent and time.time() - sent > self.max_age):
+				self.dropped += 1
+				done.append(msg)
+				continue
+			# Someone else's job: make it visible again soon, at a jittered time
+			self.released += 1
+			try:
+				self.sqs.change_message_visibility(
+					QueueUrl=self.queue_url,
+					ReceiptHandle=msg['ReceiptHandle'],
+					VisibilityTimeout=random.randint(1, self.release_visibility),
+				)
+			except Exception:
+				pass
+		if done:
+			self.sqs.delete_message_batch(
+				QueueUrl=self.queue_url,
+				Entries=[{"Id": str(i), "ReceiptHandle": m['ReceiptHandle']} for i, m in enumerate(done)],
+			)
+		return len(messages)
+
+	def stats(self) -> dict:
+		return {
+			"received": self.received,
+			"matched": self.matched,
+			"released": self.released,
+			"dropped": self.dropped,
+			"errors": self.errors,
+		}
@@ -0,0 +1,78 @@
+from __future__ import annotations
+from typing import Dict, Sequence
+import random
+import threading
+from .metrics import LatencyHistogram
+
+
+class AdaptivePollingPolicy:
+	"""Decides when to probe an async output next.
+
+	Once enough completions have been observed for the endpoint, the first probes
+	land on the p50/p75/p90 completion times; after that (or while the endpoint is
+	still cold) probes back off geometrically with jitter, capped at max_delay.
+	"""
+
+	def __init__(
+		self,
+		histogram: LatencyHistogram,
+		min_delay: float = 0.25,
+		max_delay: float = 15.0,
+		initial_delay: float = 1.0,
+		backoff: float = 1.6,
+		jitter: float = 0.2,
+		min_samples: int = 20,
+		probe_quantiles: Sequence[float] = (50, 75, 90),
+	):
+		self.histogram = histogram
+		self.min_delay = float(min_delay)
+		self.max_delay = float(max_delay)
+		self.initial_delay = float(initial_delay)
+		self.backoff = float(backoff)
+		self.jitter = float(jitter)
+		self.min_samples = int(min_samples)
+		self.probe_quantiles = tuple(probe_quantiles)
+
+	def next_delay(self, elapsed: float) -> float:
+		"""Seconds to wait before the next probe of a job submitted `elapsed` seconds ago."""
+		if self.histogram.count >= self.min_samples:
+			for q in self.probe_quantiles:
+				t = self.histogram.percentile(q)
+				if t is not None and t - elapsed >= self.min_delay:
+					return self._clamp(t - elapsed)
+		if elapsed <= 0:
+			return self._clamp(self._jittered(self.initial_delay))
+		# Next probe at ~elapsed * backoff, so probe spacing grows exponentially
+		return self._clamp(self._jittered(max(self.initial_delay, elapsed * (self.backoff - 1.0))))
+
+	def _jittered(self, delay: float) -> float:
+		if self.jitter <= 0:
+			return delay
+		return delay * random.uniform(1.0 - self.jitter, 1.0 + self.jitter)
+
+	def _clamp(self, delay: float) -> float:
+		return min(self.max_delay, max(self.min_delay, delay))
+
+	def describe(self) -> dict:
+		return {
+			"min_delay": self.min_delay,
+			"max_delay": self.max_delay,
+			"initial_delay": self.initial_delay,
+			"backoff": self.backoff,
+			"jitter": self.jitter,
+			"adaptive": self.histogram.count >= self.min_samples,
+		}
+
+
+_completion_histograms: Dict[str, LatencyHistogram] = {}
+_lock = threading.Lock()
+
+
+def completion_histogram(endpoint_name: str) -> LatencyHistogram:
+	"""Process-wide histogram of observed async completion times for an endpoint."""
+	with _lock:
+		hist = _completion_histograms.get(endpoint_name)
+		if hist is None:
+			hist = LatencyHistogram()
+			_completion_histograms[endpoint_name] = hist
+		return hist
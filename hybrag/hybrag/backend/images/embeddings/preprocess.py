@@ -0,0 +1,79 @@
+from __future__ import annotations
+from typing import Optional, Tuple
+from django.conf import settings
+import hashlib
+import io
+from PIL import Image, ImageOps
+from storage import s3 as storage
+
+
+def make_model_derivative(data: bytes, size: int = 384, quality: int = 90) -> bytes:
+	"""Re-encode an image as an RGB JPEG whose shorter side is `size` px.
+
+	SigLIP2 patch16-384 resizes every input to 384x384, so anything above that
+	is bytes the endpoint downloads and decodes only to throw away. Images that
+	are already small are re-encoded but never upscaled.
+	"""
+	with Image.open(io.BytesIO(data)) as im:
+		# Let the JPEG decoder skip resolution we will not keep
+		im.draft('RGB', (size * 2, size * 2))
+		im = ImageOps.exif_transpose(im)
+		if im.mode != 'RGB':
+			im = im.convert('RGB')
+		w, h = im.size
+		scale = size / float(min(w, h))
+		if scale < 1.0:
+			im = im.resize((max(size, round(w * scale)), max(size, round(h * scale))), Image.LANCZOS)
+		out = io.BytesIO()
+		im.save(out, format='JPEG', quality=quality)
+		return out.getvalue()
+
+
+def derivative_key(s3_key: str, etag: str, size: int | None = None) -> str:
+	"""Deterministic key for the model-sized copy of (s3_key, etag), so re-embedding
+	the same original reuses it while a replaced original gets a new one."""
+	size = int(size or getattr(settings, 'EMBED_IMAGE_SIZE', 384))
+	prefix = getattr(settings, 'EMBED_DERIVATIVE_PREFIX', 'derived/siglip2/').rstrip('/')
+	etag = (etag or '').strip('"')
+	digest = hashlib.sha1(f"{s3_key}\n{etag}".encode('utf-8')).hexdigest()
+	return f"{prefix}/{size}/{digest[:2]}/{digest}.jpg"
+
+
+def derivative_source_hash(s3_key: str, etag: str) -> Optional[str]:
+	"""sha256 of the original recorded on an existing derivative, if any."""
+	if not getattr(settings, 'EMBED_DOWNSCALE', True):
+		return None
+	meta = storage.head(derivative_key(s3_key, etag))
+	if meta is None:
+		return None
+	return (meta.get('Metadata') or {}).get('source-sha256') or None
+
+
+def ensure_model_derivative(s3_key: str, data: Optional[bytes] = None, etag: Optional[str] = None, source_hash: Optional[str] = None) -> Tuple[str, Optional[bytes]]:
+	"""Return (key to embed from, derivative bytes if generated now).
+
+	Falls back to the original key when downscaling is disabled or the bytes
+	cannot be decoded by Pillow; the original object is never modified.
+	"""
+	if not getattr(settings, 'EMBED_DOWNSCALE', True):
+		return s3_key, None
+	size = int(getattr(settings, 'EMBED_IMAGE_SIZE', 384))
+	if etag is None:
+		meta = storage.head(s3_key)
+		if meta is None:
+			return s3_key, None
+		etag = meta.get('ETag') or ''
+	key = derivative_key(s3_key, etag, size)
+	if storage.head(key) is not None:
+		return key, None
+	if data is None:
+		data = storage.get_bytes(s3_key)
+	try:
+		derived = make_model_derivative(data, size=size, quality=int(getattr(settings, 'EMBED_DERIVATIVE_QUALITY', 90)))
+	except Exception:
+		return s3_key, None
+	metadata = {'source-key': s3_key, 'source-etag': (etag or '').strip('"')}
+	if source_hash:
+		metadata['source-sha256'] = source_hash
+	storage.put_bytes(key, derived, content_type='image/jpeg', metadata=metadata)
+	return key, derived
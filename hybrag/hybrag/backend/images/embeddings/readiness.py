@@ -0,0 +1,146 @@
+from __future__ import annotations
+from typing import Dict, Optional
+from botocore.exceptions import ClientError
+import threading
+import time
+
+READY = 'ready'
+WARMING = 'warming'
+UNAVAILABLE = 'unavailable'
+
+_WARMING_STATUSES = {'Creating', 'Updating', 'SystemUpdating', 'RollingBack', 'UpdateRollbackFailed'}
+
+
+class EndpointNotReady(RuntimeError):
+	def __init__(self, endpoint_name: str, state: str, eta_seconds: Optional[float] = None, detail: str = ''):
+		self.endpoint_name = endpoint_name
+		self.state = state
+		self.eta_seconds = eta_seconds
+		super().__init__(f"Endpoint {endpoint_name} is {state}" + (f" ({detail})" if detail else ''))
+
+
+class EndpointReadiness:
+	__slots__ = ('state', 'status', 'current_instances', 'desired_instances', 'eta_seconds', 'checked_at', 'detail')
+
+	def __init__(self, state: str, status: str = '', current_instances: Optional[int] = None, desired_instances: Optional[int] = None,
+			eta_seconds: Optional[float] = None, checked_at: float = 0.0, detail: str = ''):
+		self.state = state
+		self.status = status
+		self.current_instances = current_instances
+		self.desired_instances = desired_instances
+		self.eta_seconds = eta_seconds
+		self.checked_at = checked_at
+		self.detail = detail
+
+	def as_dict(self) -> dict:
+		return {k: getattr(self, k) for k in self.__slots__}
+
+
+class EndpointReadinessTracker:
+	"""Caches describe_endpoint for one endpoint and refreshes it every ttl seconds
+	from a background thread, so callers get an immediate ready / warming (with
+	ETA) / unavailable answer instead of a control-plane call per request.
+	"""
+
+	def __init__(self, sm_client, endpoint_name: str, ttl: float = 30, warmup_seconds: float = 600, min_instances: int = 1):
+		self.sm = sm_client
+		self.endpoint_name = endpoint_name
+		self.ttl = float(ttl)
+		self.warmup_seconds = float(warmup_seconds)
+		self.min_instances = int(min_instances)
+		self._current: Optional[EndpointReadiness] = None
+		self._warming_since: Optional[float] = None
+		self._lock = threading.Lock()
+		self._thread: Optional[threading.Thread] = None
+		self.describe_calls = 0
+
+	def get(self) -> EndpointReadiness:
+		current = self._current
+		if current is None:
+			# First caller in this process pays one describe_endpoint
+			with self._lock:
+				if self._current is None:
+					self.refresh()
+				current = self._current
+		self._ensure_thread()
+		if current.state == WARMING and self._warming_since is not None:
+			eta = max(0.0, self.warmup_seconds - (time.time() - self._warming_since))
+			return EndpointReadiness(current.state, current.status, current.current_instances, current.desired_instances, eta, current.checked_at, current.detail)
+		return current
+
+	def _ensure_thread(self) -> None:
+		if self._thread is None or not self._thread.is_alive():
+			self._thread = threading.Thread(target=self._run, name=f'readiness-{self.endpoint_name}', daemon=True)
+			self._thread.start()
+
+	def _run(self) -> None:
+		while True:
+			time.sleep(self.ttl)
+			try:
+				self.refresh()
+			except Exception:
+				pass
+
+	def refresh(self) -> EndpointReadiness:
+		now = time.time()
+		try:
+			self.describe_calls += 1
+			info = self.sm.describe_endpoint(EndpointName=self.endpoint_name)
+		except ClientError as e:
+			code = (e.response or {}).get('Error', {}).get('Code')
+			if code == 'ValidationException':
+				# Endpoint does not exist
+				return self._set(EndpointReadiness(UNAVAILABLE, '', checked_at=now, detail=str(e)))
+			return self._keep_last(now, str(e))
+		except Exception as e:
+			return self._keep_last(now, str(e))
+		status = info.get('EndpointStatus') or ''
+		current = desired = None
+		for v in info.get('ProductionVariants') or []:
+			if 'CurrentInstanceCount' in v:
+				current = max(current or 0, int(v.get('CurrentInstanceCount') or 0))
+			if 'DesiredInstanceCount' in v:
+				desired = max(desired or 0, int(v.get('DesiredInstanceCount') or 0))
+		if status == 'InService' and (current is None or current >= self.min_instances):
+			state = READY
+		elif status == 'InService' or status in _WARMING_STATUSES:
+			# Scaled to zero or still being provisioned: async requests queue until capacity arrives
+			state = WARMING
+		else:
+			state = UNAVAILABLE
+		return self._set(EndpointReadiness(state, status, current, desired, checked_at=now, detail=info.get('FailureReason') or ''))
+
+	def _keep_last(self, now: float, detail: str) -> EndpointReadiness:
+		# Transient control-plane errors should not flip a known-good endpoint
+		last = self._current
+		if last is not None:
+			return last
+		return self._set(EndpointReadiness(WARMING, '', checked_at=now, detail=detail))
+
+	def _set(self, readiness: EndpointReadiness) -> EndpointReadiness:
+		if readiness.state == WARMING:
+			if self._warming_since is None:
+				self._warming_since = readiness.checked_at
+			readiness.eta_seconds = max(0.0, self.warmup_seconds - (readiness.checked_at - self._warming_since))
+		else:
+			self._warming_since = None
+		self._current = readiness
+		return readiness
+
+	def stats(self) -> dict:
+		current = self._current
+		return {"describe_calls": self.describe_calls, **(current.as_dict() if current is not None else {})}
+
+
+_trackers: Dict[str, EndpointReadinessTracker] = {}
+_trackers_lock = threading.Lock()
+
+
+def get_readiness_tracker(sm_client, endpoint_name: str, **kwargs) -> EndpointReadinessTracker:
+	"""Process-wide tracker per endpoint name."""
+	with _trackers_lock:
+		tracker = _trackers.get(endpoint_name)
+		if tracker is None:
+			tracker = EndpointReadinessTracker(sm_client, endpoint_name, **kwargs)
+			_trackers[endpoint_name] = tracker
+		return tracker
@@ -0,0 +1,237 @@
+from __future__ import annotations
+from typing import Any, Callable, Deque, Dict, Optional
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from botocore.exceptions import ClientError
+import threading
+import time
+from .metrics import LatencyHistogram
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Caller mistakes, not endpoint health
+_NON_TRIPPING_CODES = {'ValidationError', 'ValidationException'}
+
+
+class CircuitOpenError(RuntimeError):
+	def __init__(self, name: str, retry_after: float):
+		self.name = name
+		self.retry_after = retry_after
+		super().__init__(f"Circuit for {name} is open; retry in {retry_after:.1f}s")
+
+
+class CircuitBreaker:
+	"""Opens when the error rate over a sliding window exceeds error_rate (with at
+	least min_requests samples), fails fast for open_seconds, then lets a single
+	trial request through (half-open) to decide whether to close again."""
+
+	def __init__(self, name: str, window_seconds: float = 30, min_requests: int = 10, error_rate: float = 0.5, open_seconds: float = 15):
+		self.name = name
+		self.window_seconds = float(window_seconds)
+		self.min_requests = int(min_requests)
+		self.error_rate = float(error_rate)
+		self.open_seconds = float(open_seconds)
+		self.state = CLOSED
+		self._events: Deque[tuple] = deque()
+		self._opened_at = 0.0
+		self._trial_in_flight = False
+		self._lock = threading.Lock()
+		self.times_opened = 0
+		self.rejected = 0
+
+	def before_call(self) -> None:
+		with self._lock:
+			if self.state == OPEN:
+				remaining = self._opened_at + self.open_seconds - time.time()
+				if remaining > 0:
+					self.rejected += 1
+					raise CircuitOpenError(self.name, remaining)
+				self.state = HALF_OPEN
+			if self.state == HALF_OPEN:
+				if self._trial_in_flight:
+					self.rejected += 1
+					raise CircuitOpenError(self.name, 0.0)
+				self._trial_in_flight = True
+
+	def record(self, ok: bool) -> None:
+		now = time.time()
+		with self._lock:
+			if self.state == HALF_OPEN:
+				self._trial_in_flight = False
+				if ok:
+					self.state = CLOSED
+					self._events.clear()
+				else:
+					self._open(now)
+				return
+			self._events.append((now, ok))
+			cutoff = now - self.window_seconds
+			while self._events and self._events[0][0] < cutoff:
+				self._events.popleft()
+			if len(self._events) >= self.min_requests:
+				errors = sum(1 for _, good in self._events if not good)
+				if errors / len(self._events) >= self.error_rate:
+					self._open(now)
+
+	def _open(self, now: float) -> None:
+		self.state = OPEN
+		self._opened_at = now
+		self._events.clear()
+		self.times_opened += 1
+
+	def stats(self) -> dict:
+		with self._lock:
+			errors = sum(1 for _, good in self._events if not good)
+			return {
+				"state": self.state,
+				"window_requests": len(self._events),
+				"window_errors": errors,
+				"times_opened": self.times_opened,
+				"rejected": self.rejected,
+			}
+
+
+class ResilientEndpoint:
+	"""Tail-latency wrapper for one realtime endpoint: a circuit breaker in front,
+	and a hedged duplicate request fired once the primary has been running for
+	longer than the configured latency percentile. The first success wins.
+
+	The delay is timed from when the primary starts running, not from when it was
+	queued on the pool, and hedges are limited to hedge_max_rate of calls (a token
+	bucket holding at most hedge_burst), so a saturated pool or a slow endpoint
+	cannot double the load.
+	"""
+
+	def __init__(
+		self,
+		name: str,
+		hedge: bool = True,
+		hedge_percentile: float = 95,
+		hedge_min_delay: float = 0.05,
+		hedge_max_delay: float = 3.0,
+		hedge_default_delay: float = 1.0,
+		hedge_min_samples: int = 20,
+		hedge_max_rate: float = 0.05,
+		hedge_burst: float = 5,
+		max_workers: int = 16,
+		breaker: Optional[CircuitBreaker] = None,
+	):
+		self.name = name
+		self.hedge = bool(hedge)
+		self.hedge_percentile = float(hedge_percentile)
+		self.hedge_min_delay = float(hedge_min_delay)
+		self.hedge_max_delay = float(hedge_max_delay)
+		self.hedge_default_delay = float(hedge_default_delay)
+		self.hedge_min_samples = int(hedge_min_samples)
+		self.hedge_max_rate = max(0.0, float(hedge_max_rate))
+		self.hedge_burst = max(1.0, float(hedge_burst))
+		self._hedge_tokens = self.hedge_burst
+		self._hedge_lock = threading.Lock()
+		self.breaker = breaker or CircuitBreaker(name)
+		self.latency = LatencyHistogram()
+		self._pool = ThreadPoolExecutor(max_workers=max(2, int(max_workers)), thread_name_prefix=f'hedge-{name}')
+		self.calls = 0
+		self.hedges_fired = 0
+		self.hedges_skipped = 0
+		self.hedge_wins = 0
+
+	def hedge_delay(self) -> float:
+		delay = None
+		if self.latency.count >= self.hedge_min_samples:
+			delay = self.latency.percentile(self.hedge_percentile)
+		if delay is None:
+			delay = self.hedge_default_delay
+		return min(self.hedge_max_delay, max(self.hedge_min_delay, delay))
+
+	def call(self, fn: Callable[[], Any]) -> Any:
+		self.breaker.before_call()
+		self.calls += 1
+		start = time.time()
+		try:
+			result, hedged = self._call_hedged(fn) if self.hedge else (fn(), False)
+		except ClientError as e:
+			code = (e.response or {}).get('Error', {}).get('Code')
+			self.breaker.record(code in _NON_TRIPPING_CODES)
+			raise
+		except Exception:
+			self.breaker.record(False)
+			raise
+		self.breaker.record(True)
+		self.latency.observe(time.time() - start)
+		if hedged:
+			self.hedge_wins += 1
+		return result
+
+	def _take_hedge_token(self) -> bool:
+		with self._hedge_lock:
+			if self._hedge_tokens >= 1:
+				self._hedge_tokens -= 1
+				return True
+			return False
+
+	def _call_hedged(self, fn: Callable[[], Any]) -> tuple:
+		with self._hedge_lock:
+			self._hedge_tokens = min(self.hedge_burst, self._hedge_tokens + self.hedge_max_rate)
+		started = threading.Event()
+
+		def run():
+			started.set()
+			return fn()
+
+		primary = self._pool.submit(run)
+		started.wait()
+		done, _ = wait([primary], timeout=self.hedge_delay())
+		if done:
+			return primary.result(), False
+		if not self._take_hedge_token():
+			self.hedges_skipped += 1
+			return primary.result(), False
+		self.hedges_fired += 1
+		backup = self._pool.submit(fn)
+		pending = {primary, backup}
+		last_err: Optional[BaseException] = None
+		while pending:
+			done, pending = wait(pending, return_when=FIRST_COMPLETED)
+			for f in done:
+				if f.exception() is None:
+					# A loser still queued is dropped; one already running finishes and is ignored
+					for other in pending:
+						other.cancel()
+					return f.result(), f is backup
+				last_err = f.exception()
+		raise last_err  # type: ignore[misc]
+
+	def stats(self) -> dict:
+		return {
+			"calls": self.calls,
+			"hedges_fired": self.hedges_fired,
+			"hedges_skipped": self.hedges_skipped,
+			"hedge_wins": self.hedge_wins,
+			"hedge_delay": self.hedge_delay() if self.hedge else None,
+			"latency": self.latency.snapshot(),
+			"breaker": self.breaker.stats(),
+		}
+
+
+def build_endpoint(name: str, config: Dict[str, Any]) -> ResilientEndpoint:
+	"""Build from a config dict (see SAGEMAKER_ENDPOINT_RESILIENCE in settings)."""
+	breaker = CircuitBreaker(
+		name,
+		window_seconds=float(config.get('breaker_window_seconds', 30)),
+		min_requests=int(config.get('breaker_min_requests', 10)),
+		error_rate=float(config.get('breaker_error_rate', 0.5)),
+		open_seconds=float(config.get('breaker_open_seconds', 15)),
+	)
+	return ResilientEndpoint(
+		name,
+		hedge=bool(config.get('hedge', True)),
+		hedge_percentile=float(config.get('hedge_percentile', 95)),
+		hedge_min_delay=float(config.get('hedge_min_delay', 0.05)),
+		hedge_max_delay=float(config.get('hedge_max_delay', 3.0)),
+		hedge_default_delay=float(config.get('hedge_default_delay', 1.0)),
+		hedge_max_rate=float(config.get('hedge_max_rate', 0.05)),
+		hedge_burst=float(config.get('hedge_burst', 5)),
+		breaker=breaker,
+	)
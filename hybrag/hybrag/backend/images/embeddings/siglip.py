@@ -4,22 +4,64 @@ from django.conf import settings
 import json
 import boto3
 from botocore.config import Config
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
+from array import array
+import base64
+import io
+import struct
+import numpy as np
+from concurrent.futures import Future, ThreadPoolExecutor
+import hashlib
+import threading
 import time
-import uuid
+from ..cache import LRUCache, SharedDiskCache
+from .async_jobs import AsyncEmbeddingJobManager
+from .notifications import AsyncCompletionListener
+from .metrics import LatencyHistogram
+from .microbatch import ImageMicroBatcher
+from .polling import AdaptivePollingPolicy, completion_histogram
+from .resilience import CircuitOpenError, ResilientEndpoint, build_endpoint
+from .singleflight import SingleFlight, payload_key
+from .readiness import UNAVAILABLE, WARMING, EndpointNotReady, EndpointReadiness, EndpointReadinessTracker, get_readiness_tracker
 
 
-def _parse_s3_uri(uri: str) -> tuple[str, str]:
-	if not uri.startswith('s3://'):
-		raise ValueError(f'Not an s3 uri: {uri}')
-	without = uri[len('s3://'):]
-	parts = without.split('/', 1)
-	if len(parts) != 2:
-		raise ValueError(f'Invalid s3 uri: {uri}')
-	return parts[0], parts[1]
+NPY_CONTENT_TYPE = 'application/x-npy'
+# Raw little-endian float32 rows behind a 12-byte header: magic, uint32 rows, uint32 dim
+F32_CONTENT_TYPE = 'application/x-embedding-f32'
+F32_MAGIC = b'F32E'
+_F32_HEADER = struct.Struct('<4sII')
+
+
+def encode_f32_embeddings(vectors) -> bytes:
+	arr = np.ascontiguousarray(np.atleast_2d(np.asarray(vectors, dtype='<f4')))
+	return _F32_HEADER.pack(F32_MAGIC, arr.shape[0], arr.shape[1]) + arr.tobytes()
+
+
+def _decode_binary_embeddings(raw: bytes, content_type: str | None = None) -> np.ndarray | None:
+	"""Decode an npy or F32E payload into a (rows, dim) float32 array; None if the body is not binary."""
+	ctype = (content_type or '').split(';', 1)[0].strip().lower()
+	if raw[:6] == b'\x93NUMPY' or ctype == NPY_CONTENT_TYPE:
+		arr = np.load(io.BytesIO(raw), allow_pickle=False)
+		return np.atleast_2d(arr.astype(np.float32, copy=False))
+	if raw[:4] == F32_MAGIC or ctype == F32_CONTENT_TYPE:
+		magic, rows, dim = _F32_HEADER.unpack_from(raw)
+		if magic != F32_MAGIC or len(raw) != _F32_HEADER.size + rows * dim * 4:
+			raise ValueError('Malformed float32 embedding payload')
+		return np.frombuffer(raw, dtype='<f4', offset=_F32_HEADER.size).reshape(rows, dim)
+	return None
+
+
+def _decode_response(raw: bytes, content_type: str | None = None):
+	# Binary formats parse straight into NumPy; anything else goes through JSON
+	arr = _decode_binary_embeddings(raw, content_type)
+	if arr is not None:
+		return arr
+	return json.loads(raw)
 
 
 def _extract_embedding_from_data(data) -> List[float] | None:
+    if isinstance(data, np.ndarray):
+        return data.reshape(-1, data.shape[-1])[0].tolist() if data.size else None
     # Case 1: dict with 'embedding'
     if isinstance(data, dict):
         vec = data.get('embedding')
@@ -64,10 +106,97 @@ def _extract_embedding_from_data(data) -> List[float] | None:
     return None
 
 
+def _extract_embeddings_from_data(data, count: int) -> List[List[float]] | None:
+	# Batched responses: (n, dim) array, {'embeddings': [...]}, or a list with one entry per input
+	if isinstance(data, np.ndarray):
+		rows = data.reshape(-1, data.shape[-1]) if data.size else data
+		return rows.tolist() if len(rows) == count else None
+	if isinstance(data, dict):
+		for k in ('embeddings', 'predictions', 'outputs'):
+			if isinstance(data.get(k), list):
+				return _extract_embeddings_from_data(data[k], count)
+		body = data.get('body') or data.get('Body')
+		if isinstance(body, str):
+			try:
+				return _extract_embeddings_from_data(json.loads(body), count)
+			except Exception:
+				return None
+		return None
+	if not isinstance(data, list) or len(data) != count:
+		return None
+	out: List[List[float]] = []
+	for item in data:
+		vec = _extract_embedding_from_data(item)
+		if vec is None:
+			return None
+		out.append(vec)
+	return out
+
+
+def _normalize_text(text: str) -> str:
+	return ' '.join((text or '').split())
+
+
+class TextEmbeddingCache:
+	"""Two-tier cache for text embeddings: in-process LRU in front of a SQLite
+	file shared by all workers on the host. Vectors are stored as float32.
+	"""
+
+	def __init__(self, max_entries: int = 2048, path: str | None = None, max_bytes: int = 256 * 1024 * 1024):
+		self.memory = LRUCache(max_entries)
+		self.disk = SharedDiskCache(path, max_bytes=max_bytes) if path else None
+		self._lock = threading.Lock()
+		self.memory_hits = 0
+		self.disk_hits = 0
+		self.misses = 0
+
+	@staticmethod
+	def make_key(endpoint: str | None, model: str | None, text: str, normalize: bool) -> str:
+		raw = json.dumps([endpoint or '', model or '', bool(normalize), text], ensure_ascii=False)
+		return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+	def get(self, key: str) -> List[float] | None:
+		vec = self.memory.get(key)
+		if vec is not None:
+			with self._lock:
+				self.memory_hits += 1
+			return list(vec)
+		if self.disk is not None:
+			blob = self.disk.get(key)
+			if blob:
+				vec = array('f')
+				vec.frombytes(blob)
+				self.memory.set(key, vec)
+				with self._lock:
+					self.disk_hits += 1
+				return vec.tolist()
+		with self._lock:
+			self.misses += 1
+		return None
+
+	def set(self, key: str, vec: List[float]) -> None:
+		packed = array('f', vec)
+		self.memory.set(key, packed)
+		if self.disk is not None:
+			self.disk.set(key, packed.tobytes())
+
+	def stats(self) -> dict:
+		hits = self.memory_hits + self.disk_hits
+		total = hits + self.misses
+		return {
+			"memory_hits": self.memory_hits,
+			"disk_hits": self.disk_hits,
+			"misses": self.misses,
+			"hit_rate": (hits / total) if total else 0.0,
+			"memory_entries": len(self.memory),
+		}
+
+
 class SiglipService:
 	def __init__(self, model_name: str | None = None, device: str | None = None):
 		# Ignore local model; use SageMaker endpoint per settings
 		self.dim = int(getattr(settings, 'OS_EMB_DIM', 1536))
+		self.model_name = model_name or getattr(settings, 'SIGLIP_MODEL_NAME', None)
 		# Support separate endpoints for text (realtime) and image (async)
 		text_ep = getattr(settings, 'SAGEMAKER_TEXT_ENDPOINT_NAME', None) or getattr(settings, 'SAGEMAKER_ENDPOINT_NAME', None)
 		image_ep = getattr(settings, 'SAGEMAKER_IMAGE_ENDPOINT_NAME', None) or getattr(settings, 'SAGEMAKER_ENDPOINT_NAME', None)
@@ -78,6 +207,13 @@ class SiglipService:
 			raise RuntimeError('SAGEMAKER_RUNTIME_REGION or AWS_REGION not set')
 		self.text_endpoint = text_ep
 		self.image_endpoint = image_ep
+		# Realtime endpoint for small interactive images sent inline; empty disables the fast path
+		self.realtime_image_endpoint = getattr(settings, 'SAGEMAKER_REALTIME_IMAGE_ENDPOINT_NAME', None) or None
+		self.inline_image_max_bytes = int(getattr(settings, 'INLINE_IMAGE_MAX_BYTES', 256 * 1024))
+		self.route_latency: dict = {}
+		# Identical concurrent invocations share one in-flight call
+		self.single_flight = SingleFlight()
+		self._route_lock = threading.Lock()
 		self.client = boto3.client(
 			'sagemaker-runtime',
 			config=Config(
@@ -87,191 +223,244 @@ class SiglipService:
 				connect_timeout=3,
 			)
 		)
-		# Control-plane client for endpoint readiness polling
+		# Realtime calls get their own client so timeouts/retries can be tightened independently of async
+		self.realtime_client = boto3.client(
+			'sagemaker-runtime',
+			config=Config(
+				region_name=region,
+				retries={"max_attempts": int(getattr(settings, 'SAGEMAKER_REALTIME_MAX_ATTEMPTS', 1)), "mode": "standard"},
+				read_timeout=float(getattr(settings, 'SAGEMAKER_REALTIME_READ_TIMEOUT', 3)),
+				connect_timeout=3,
+				max_pool_connections=32,
+			)
+		)
+		self._resilience_config = dict(getattr(settings, 'SAGEMAKER_ENDPOINT_RESILIENCE', None) or {})
+		self._endpoints: dict = {}
+		# Control-plane client for the endpoint readiness tracker
 		self.sm = boto3.client('sagemaker', config=Config(region_name=region, retries={"max_attempts": 3, "mode": "standard"}))
 		self.s3 = boto3.client('s3', config=Config(region_name=getattr(settings, 'AWS_REGION', region)))
 		self.use_async = True
+		# e.g. 'application/x-embedding-f32, application/json;q=0.5' once the endpoints serve binary
+		self.accept = getattr(settings, 'SAGEMAKER_EMBEDDING_ACCEPT', None) or 'application/json'
+		self._async_jobs: AsyncEmbeddingJobManager | None = None
+		self._async_lock = threading.Lock()
+		self._image_batcher: ImageMicroBatcher | None = None
+		# Last wake-up job sent to a scaled-to-zero image endpoint
+		self._image_woken_at = 0.0
+		# None = unknown; flips to False once the text endpoint rejects list payloads
+		self.text_batch_supported: bool | None = None
+		self.text_embed_concurrency = max(1, int(getattr(settings, 'TEXT_EMBED_CONCURRENCY', 4)))
+		self.text_cache = TextEmbeddingCache(
+			max_entries=int(getattr(settings, 'TEXT_EMBED_CACHE_ENTRIES', 2048)),
+			path=getattr(settings, 'TEXT_EMBED_CACHE_PATH', None) or None,
+			max_bytes=int(getattr(settings, 'TEXT_EMBED_CACHE_MAX_MB', 256)) * 1024 * 1024,
+		)
 
-	def _wait_for_endpoint_min_instances(self, endpoint_name: str, min_instances: int = 1, max_wait_seconds: int = 1200, interval_seconds: int = 300) -> None:
-		"""Polls SageMaker endpoint until it's InService and (if available) has >= min_instances.
-		Checks every interval_seconds, up to max_wait_seconds (~20 minutes by default).
-		"""
-		start = time.time()
-		last_status = ''
-		while time.time() - start < max_wait_seconds:
-			try:
-				info = self.sm.describe_endpoint(EndpointName=endpoint_name)
-				status = info.get('EndpointStatus') or ''
-				last_status = status
-				# If AWS exposes current instance counts on variants, honor it; otherwise rely on InService
-				variants = info.get('ProductionVariants') or []
-				current_instances = 0
-				for v in variants:
-					try:
-						current_instances = max(current_instances, int(v.get('CurrentInstanceCount') or 0))
-					except Exception:
-						pass
-				if status == 'InService' and (current_instances == 0 or current_instances >= min_instances):
-					return
-			except Exception:
-				pass
-			time.sleep(interval_seconds)
-		raise RuntimeError(f"Endpoint {endpoint_name} not ready after {max_wait_seconds}s (last status={last_status})")
+	@property
+	def image_readiness(self) -> EndpointReadinessTracker:
+		return get_readiness_tracker(
+			self.sm,
+			self.image_endpoint,
+			ttl=float(getattr(settings, 'ENDPOINT_READINESS_TTL', 30)),
+			warmup_seconds=float(getattr(settings, 'ENDPOINT_WARMUP_SECONDS', 600)),
+		)
 
-	def _invoke(self, payload: dict) -> list[float]:
-		# Route by payload: text -> realtime endpoint, image -> async endpoint
-		is_image = any(k in payload for k in ("image_url", "image_urls"))
-		if is_image:
-			endpoint_name = self.image_endpoint
-			if not endpoint_name:
-				raise RuntimeError('SAGEMAKER_IMAGE_ENDPOINT_NAME not configured')
-			# Wait for endpoint readiness (every 5 minutes, up to ~20 minutes)
-			try:
-				self._wait_for_endpoint_min_instances(endpoint_name, min_instances=1, max_wait_seconds=1200, interval_seconds=300)
-			except Exception:
-				# Proceed to invoke anyway; downstream retry will attempt short backoff
-				pass
-			# Async invocation flow for image embeddings
-			bucket = getattr(settings, 'ASYNC_S3_INPUT_BUCKET', None) or getattr(settings, 'S3_BUCKET', None)
-			prefix = getattr(settings, 'ASYNC_S3_INPUT_PREFIX', 'siglip2-async-inputs/')
-			if not bucket:
-				raise RuntimeError('Async invocation requested but no ASYNC_S3_INPUT_BUCKET or S3_BUCKET configured')
-			key = f"{prefix.rstrip('/')}/{uuid.uuid4()}.json"
-			self.s3.put_object(Bucket=bucket, Key=key, Body=json.dumps(payload).encode('utf-8'), ContentType='application/json')
-			in_loc = f"s3://{bucket}/{key}"
-			resp_async = self.client.invoke_endpoint_async(
-				EndpointName=endpoint_name,
-				InputLocation=in_loc,
-				ContentType='application/json',
-			)
-			out_loc = resp_async.get('OutputLocation')
-			# If the endpoint is cold or has 0 instances, briefly retry invoke until it accepts
-			if not out_loc:
-				start = time.time()
-				while time.time() - start < 60:
-					try:
-						resp_async = self.client.invoke_endpoint_async(
-							EndpointName=endpoint_name,
-							InputLocation=in_loc,
-							ContentType='application/json',
-						)
-						out_loc = resp_async.get('OutputLocation')
-						if out_loc:
-							break
-					except Exception:
-						pass
-					time.sleep(2)
-			if out_loc:
-				out_bucket, out_key = _parse_s3_uri(out_loc)
-			else:
-				# Some async setups rely on known output prefix; derive path from request key
-				out_bucket = getattr(settings, 'ASYNC_S3_OUTPUT_BUCKET', None) or bucket
-				out_prefix = getattr(settings, 'ASYNC_S3_OUTPUT_PREFIX', 'siglip2-async-outputs/')
-				# Mirror filename, allow service to append suffixes; we will list and pick the newest
-				base_name = key.rsplit('/', 1)[-1].rsplit('.', 1)[0]
-				candidate_prefix = f"{out_prefix.rstrip('/')}/{base_name}"
-				# We'll list with prefix and pick first object when available
-			deadline = time.time() + int(getattr(settings, 'SAGEMAKER_ASYNC_TIMEOUT', 150))
-			last_err = None
-			while time.time() < deadline:
-				try:
-					if out_loc:
-						obj = self.s3.get_object(Bucket=out_bucket, Key=out_key)
-						data = json.loads(obj['Body'].read())
-					else:
-						# List objects under derived prefix and read the first available
-						lst = self.s3.list_objects_v2(Bucket=out_bucket, Prefix=candidate_prefix)
-						contents = lst.get('Contents') or []
-						if not contents:
-							raise self.s3.exceptions.NoSuchKey({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')  # trigger retry
-						best = sorted(contents, key=lambda x: x.get('LastModified') or 0, reverse=True)[0]
-						obj = self.s3.get_object(Bucket=out_bucket, Key=best['Key'])
-						data = json.loads(obj['Body'].read())
-					vec = _extract_embedding_from_data(data)
-					if vec is not None:
-						return vec
-					last_err = f'Bad async response shape: {type(data).__name__}'
-				except self.s3.exceptions.NoSuchKey:  # type: ignore[attr-defined]
-					pass
-				except Exception as pe:
-					last_err = str(pe)
-				time.sleep(2)
-			raise RuntimeError(last_err or 'Timed out waiting for async output')
-		# Realtime invocation for text embeddings
-		endpoint_name = self.text_endpoint
+	def _endpoint(self, endpoint_name: str) -> ResilientEndpoint:
+		guard = self._endpoints.get(endpoint_name)
+		if guard is None:
+			with self._route_lock:
+				guard = self._endpoints.get(endpoint_name)
+				if guard is None:
+					config = {**(self._resilience_config.get('default') or {}), **(self._resilience_config.get(endpoint_name) or {})}
+					guard = self._endpoints[endpoint_name] = build_endpoint(endpoint_name, config)
+		return guard
+
+	def _invoke_realtime(self, payload: dict, endpoint_name: str | None = None):
+		endpoint_name = endpoint_name or self.text_endpoint
 		if not endpoint_name:
 			raise RuntimeError('SAGEMAKER_TEXT_ENDPOINT_NAME not configured')
-		resp = self.client.invoke_endpoint(
+		# Circuit breaker + hedged duplicate for tail latency
+		return self._endpoint(endpoint_name).call(lambda: self._invoke_realtime_once(payload, endpoint_name))
+
+	def _invoke_realtime_once(self, payload: dict, endpoint_name: str):
+		resp = self.realtime_client.invoke_endpoint(
 			EndpointName=endpoint_name,
 			ContentType='application/json',
-			Accept='application/json',
+			Accept=self.accept,
 			Body=json.dumps(payload).encode('utf-8'),
 		)
-		body = json.loads(resp['Body'].read())
-		vec = _extract_embedding_from_data(body) or body.get('embedding')
+		return _decode_response(resp['Body'].read(), resp.get('ContentType'))
+
+	def _invoke(self, payload: dict) -> list[float]:
+		# Route by payload: text -> realtime endpoint, image -> async endpoint
+		is_image = any(k in payload for k in ("image_url", "image_urls"))
+		if is_image:
+			return self.submit_image(payload).result()
+		# Realtime invocation for text embeddings
+		body = self._invoke_realtime(payload)
+		vec = _extract_embedding_from_data(body)
 		if not isinstance(vec, list):
 			raise RuntimeError(f'Bad response from SageMaker endpoint: {body}')
 		return vec
 
-		# Try real-time first, fallback to async if the endpoint rejects it
+	@property
+	def async_jobs(self) -> AsyncEmbeddingJobManager:
+		if self._async_jobs is None:
+			with self._async_lock:
+				if self._async_jobs is None:
+					endpoint_name = self.image_endpoint
+					if not endpoint_name:
+						raise RuntimeError('SAGEMAKER_IMAGE_ENDPOINT_NAME not configured')
+					bucket = getattr(settings, 'ASYNC_S3_INPUT_BUCKET', None) or getattr(settings, 'S3_BUCKET', None)
+					if not bucket:
+						raise RuntimeError('Async invocation requested but no ASYNC_S3_INPUT_BUCKET or S3_BUCKET configured')
+					self._async_jobs = AsyncEmbeddingJobManager(
+						self.client,
+						self.s3,
+						endpoint_name,
+						input_bucket=bucket,
+						accept=self.accept,
+						decode=_decode_response,
+						input_prefix=getattr(settings, 'ASYNC_S3_INPUT_PREFIX', 'siglip2-async-inputs/'),
+						output_bucket=getattr(settings, 'ASYNC_S3_OUTPUT_BUCKET', None) or bucket,
+						output_prefix=getattr(settings, 'ASYNC_S3_OUTPUT_PREFIX', 'siglip2-async-outputs/'),
+						timeout=int(getattr(settings, 'SAGEMAKER_ASYNC_TIMEOUT', 150)),
+						polling=AdaptivePollingPolicy(
+							completion_histogram(endpoint_name),
+							min_delay=float(getattr(settings, 'ASYNC_POLL_MIN_DELAY', 0.25)),
+							max_delay=float(getattr(settings, 'ASYNC_POLL_MAX_DELAY', 15)),
+							initial_delay=float(getattr(settings, 'ASYNC_POLL_INITIAL_DELAY', 1.0)),
+							backoff=float(getattr(settings, 'ASYNC_POLL_BACKOFF', 1.6)),
+						),
+						max_in_flight=int(getattr(settings, 'SAGEMAKER_ASYNC_MAX_IN_FLIGHT', 256)),
+					)
+					queue_url = getattr(settings, 'ASYNC_NOTIFICATION_QUEUE_URL', None)
+					if queue_url:
+						sqs = boto3.client(
+							'sqs',
+							endpoint_url=getattr(settings, 'ASYNC_NOTIFICATION_SQS_ENDPOINT_URL', None) or None,
+							config=Config(region_name=getattr(settings, 'AWS_REGION', None)),
+						)
+						listener = AsyncCompletionListener(sqs, queue_url, self._async_jobs, max_age=int(getattr(settings, 'SAGEMAKER_ASYNC_TIMEOUT', 150)) * 2)
+						self._async_jobs.attach_listener(listener, fallback_poll_interval=float(getattr(settings, 'ASYNC_NOTIFICATION_FALLBACK_POLL', 15)))
+		return self._async_jobs
+
+	def check_image_endpoint(self) -> EndpointReadiness:
+		# Cached answer; a warming endpoint still accepts async jobs (they queue until it
+		# scales out), but only if it should be up before the job's deadline
+		readiness = self.image_readiness.get()
+		if readiness.state == UNAVAILABLE or (
+			readiness.state == WARMING
+			and readiness.eta_seconds is not None
+			and readiness.eta_seconds > float(getattr(settings, 'SAGEMAKER_ASYNC_TIMEOUT', 150))
+		):
+			raise EndpointNotReady(self.image_endpoint, readiness.state, readiness.eta_seconds, readiness.status or readiness.detail)
+		return readiness
+
+	@property
+	def image_batcher(self) -> ImageMicroBatcher:
+		if self._image_batcher is None:
+			jobs = self.async_jobs
+			with self._async_lock:
+				if self._image_batcher is None:
+					self._image_batcher = ImageMicroBatcher(
+						jobs,
+						parse_one=_extract_embedding_from_data,
+						parse_many=_extract_embeddings_from_data,
+						window=float(getattr(settings, 'ASYNC_IMAGE_BATCH_WINDOW_MS', 50)) / 1000.0,
+						max_items=int(getattr(settings, 'ASYNC_IMAGE_BATCH_MAX', 16)),
+					)
+		return self._image_batcher
+
+	def _wake_image_endpoint(self, payload: dict) -> None:
+		# Callers get a 503, but one queued job per warm-up period is what makes the
+		# backlog-driven scaling policy start an instance; its result is not awaited
+		warmup = float(getattr(settings, 'ENDPOINT_WARMUP_SECONDS', 600))
+		with self._async_lock:
+			if time.time() - self._image_woken_at < warmup:
+				return
+			self._image_woken_at = time.time()
 		try:
-			resp = self.client.invoke_endpoint(
-				EndpointName=self.endpoint,
-				ContentType='application/json',
-				Accept='application/json',
-				Body=json.dumps(payload).encode('utf-8'),
-			)
-			body = json.loads(resp['Body'].read())
-			vec = body.get('embedding')
-			if not isinstance(vec, list):
-				raise RuntimeError(f'Bad response from SageMaker endpoint: {body}')
-			return vec
-		except ClientError as e:
-			msg = str(e)
-			if 'does not support this inference type' in msg:
-				# Fallback to async
-				bucket = getattr(settings, 'ASYNC_S3_INPUT_BUCKET', None) or getattr(settings, 'S3_BUCKET', None)
-				prefix = getattr(settings, 'ASYNC_S3_INPUT_PREFIX', 'siglip2-async-inputs/')
-				if not bucket:
-					raise RuntimeError('Async fallback requested but no ASYNC_S3_INPUT_BUCKET or S3_BUCKET configured')
-				key = f"{prefix.rstrip('/')}/{uuid.uuid4()}.json"
-				self.s3.put_object(Bucket=bucket, Key=key, Body=json.dumps(payload).encode('utf-8'), ContentType='application/json')
-				in_loc = f"s3://{bucket}/{key}"
-				resp_async = self.client.invoke_endpoint_async(
-					EndpointName=self.endpoint,
-					InputLocation=in_loc,
-					ContentType='application/json',
-				)
-				out_loc = resp_async.get('OutputLocation')
-				if not out_loc:
-					raise RuntimeError(f'Async invoke returned no OutputLocation: {resp_async}')
-				out_bucket, out_key = _parse_s3_uri(out_loc)
-				deadline = time.time() + int(getattr(settings, 'SAGEMAKER_ASYNC_TIMEOUT', 150))
-				last_err = None
-				while time.time() < deadline:
-					try:
-						if out_loc:
-							obj = self.s3.get_object(Bucket=out_bucket, Key=out_key)
-							data = json.loads(obj['Body'].read())
-						else:
-							lst = self.s3.list_objects_v2(Bucket=out_bucket, Prefix=candidate_prefix)
-							contents = lst.get('Contents') or []
-							if not contents:
-								raise self.s3.exceptions.NoSuchKey({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
-							best = sorted(contents, key=lambda x: x.get('LastModified') or 0, reverse=True)[0]
-							obj = self.s3.get_object(Bucket=out_bucket, Key=best['Key'])
-							data = json.loads(obj['Body'].read())
-						vec = _extract_embedding_from_data(data)
-						if vec is not None:
-							return vec
-						last_err = f'Bad async response shape: {type(data).__name__}'
-					except self.s3.exceptions.NoSuchKey:  # type: ignore[attr-defined]
-						pass
-					except Exception as pe:
-						last_err = str(pe)
-					time.sleep(2)
-				raise RuntimeError(last_err or 'Timed out waiting for async output')
+			self.async_jobs.submit(payload, parse=_extract_embedding_from_data)
+		except Exception:
+			pass
+
+	def submit_image(self, payload: dict) -> Future:
+		try:
+			self.check_image_endpoint()
+		except EndpointNotReady as e:
+			if e.state == WARMING:
+				self._wake_image_endpoint(payload)
 			raise
+		if set(payload) <= {"image_url", "normalize"} and payload.get("image_url"):
+			# Single-image jobs are micro-batched into image_urls invocations
+			submit = lambda: self.image_batcher.submit(payload["image_url"], normalize=bool(payload.get("normalize", True)))
+		else:
+			submit = lambda: self.async_jobs.submit(payload, parse=_extract_embedding_from_data)
+		return self.single_flight.share(payload_key(payload), submit)
+
+	def image_embed_urls(self, image_urls: List[str], normalize: bool = True) -> List[List[float]]:
+		# Keep every image in flight at once; the job manager bounds concurrency
+		start = time.time()
+		futures = [self.submit_image({"image_url": u, "normalize": normalize}) for u in image_urls]
+		vecs = [f.result() for f in futures]
+		if vecs:
+			self._observe_route('async_bulk', (time.time() - start) / len(vecs))
+		return vecs
+
+	def embed_image(self, image_url: str | None = None, image_bytes: bytes | None = None, bulk: bool = False, normalize: bool = True) -> list[float]:
+		"""Route one image: small interactive images go inline (base64) to the realtime
+		endpoint, everything else (large, bulk, or no bytes at hand) through async S3."""
+		if (
+			not bulk
+			and image_bytes is not None
+			and self.realtime_image_endpoint
+			and len(image_bytes) <= self.inline_image_max_bytes
+		):
+			start = time.time()
+			endpoint_name = self.realtime_image_endpoint
+			inline = {"image_b64": base64.b64encode(image_bytes).decode('ascii'), "normalize": normalize}
+			try:
+				body = self.single_flight.do(
+					payload_key([endpoint_name, inline]),
+					lambda: self._invoke_realtime(inline, endpoint_name=endpoint_name),
+				)
+				vec = _extract_embedding_from_data(body)
+				if vec is not None:
+					self._observe_route('realtime_inline', time.time() - start)
+					return vec
+			except ClientError as e:
+				code = (e.response or {}).get('Error', {}).get('Code')
+				if code == 'ValidationError':
+					# Endpoint missing or misconfigured; stop trying for this process. A
+					# ModelError can be one bad image, so those are left to the circuit breaker
+					self.realtime_image_endpoint = None
+				if not image_url:
+					raise
+			except BotoCoreError:
+				# Read timeout, connection error and the like: async still has a chance
+				if not image_url:
+					raise
+			except CircuitOpenError:
+				# Realtime endpoint is failing fast; async has its own capacity
+				if not image_url:
+					raise
+			self._observe_route('realtime_inline_failed', time.time() - start)
+			if not image_url:
+				raise RuntimeError('Bad inline image response from SageMaker endpoint')
+		if not image_url:
+			raise RuntimeError('image_url required for async image embedding')
+		start = time.time()
+		vec = self.submit_image({"image_url": image_url, "normalize": normalize}).result()
+		self._observe_route('async_bulk' if bulk else 'async', time.time() - start)
+		return vec
+
+	def _observe_route(self, route: str, seconds: float) -> None:
+		with self._route_lock:
+			hist = self.route_latency.get(route)
+			if hist is None:
+				hist = self.route_latency[route] = LatencyHistogram()
+		hist.observe(seconds)
 
 	def image_embed(self, file_path: str) -> list[float]:
 		# This code used to load image locally. Now assume image is accessible via URL.
@@ -281,5 +470,70 @@ class SiglipService:
 	def image_embed_batch(self, file_paths: List[str]) -> List[List[float]]:
 		raise RuntimeError('Local batch embedding disabled. Use S3 presigned URLs and invoke per image or batch upstream.')
 
-	def text_embed(self, text: str) -> list[float]:
-		return self._invoke({"text": text, "normalize": True})
+	def text_embed(self, text: str, normalize: bool = True) -> list[float]:
+		text = _normalize_text(text)
+		key = TextEmbeddingCache.make_key(self.text_endpoint, self.model_name, text, normalize)
+		vec = self.text_cache.get(key)
+		if vec is not None:
+			return vec
+		# Concurrent misses for the same text share one realtime call
+		vec = self.single_flight.do(key, lambda: self._fill_text(key, text, normalize))
+		return list(vec)
+
+	def _fill_text(self, key: str, text: str, normalize: bool) -> list[float]:
+		vec = self._invoke({"text": text, "normalize": normalize})
+		self.text_cache.set(key, vec)
+		return vec
+
+	def text_embed_batch(self, texts: List[str], normalize: bool = True) -> List[List[float]]:
+		texts = [_normalize_text(t) for t in texts]
+		keys = [TextEmbeddingCache.make_key(self.text_endpoint, self.model_name, t, normalize) for t in texts]
+		found: dict = {}
+		missing: List[str] = []
+		for t, k in zip(texts, keys):
+			if k in found or t in missing:
+				continue
+			vec = self.text_cache.get(k)
+			if vec is not None:
+				found[k] = vec
+			else:
+				missing.append(t)
+		if len(missing) > 1 and self.text_batch_supported is not False:
+			vecs = None
+			try:
+				body = self._invoke_realtime({"texts": missing, "normalize": normalize})
+				vecs = _extract_embeddings_from_data(body, len(missing))
+				if vecs is None:
+					self.text_batch_supported = False
+			except ClientError as e:
+				# A model/validation error means the handler does not take lists; anything else is transient
+				code = (e.response or {}).get('Error', {}).get('Code')
+				if code in ('ModelError', 'ValidationError'):
+					self.text_batch_supported = False
+			if vecs is not None:
+				self.text_batch_supported = True
+				for t, vec in zip(missing, vecs):
+					k = TextEmbeddingCache.make_key(self.text_endpoint, self.model_name, t, normalize)
+					self.text_cache.set(k, vec)
+					found[k] = vec
+				missing = []
+		if missing:
+			# Single-text endpoint: fan out with bounded concurrency (text_embed fills the cache)
+			workers = min(self.text_embed_concurrency, len(missing))
+			with ThreadPoolExecutor(max_workers=workers) as pool:
+				vecs = list(pool.map(lambda t: self.text_embed(t, normalize=normalize), missing))
+			for t, vec in zip(missing, vecs):
+				found[TextEmbeddingCache.make_key(self.text_endpoint, self.model_name, t, normalize)] = vec
+		return [found[k] for k in keys]
+
+	def stats(self) -> dict:
+		return {
+			"text_cache": self.text_cache.stats(),
+			"text_batch_supported": self.text_batch_supported,
+			"async_jobs": self._async_jobs.stats() if self._async_jobs is not None else None,
+			"image_batcher": self._image_batcher.stats() if self._image_batcher is not None else None,
+			"image_endpoint": self.image_readiness.stats() if self.image_endpoint else None,
+			"image_routes": {k: h.snapshot() for k, h in self.route_latency.items()},
+			"single_flight": self.single_flight.stats(),
+			"realtime_endpoints": {k: g.stats() for k, g in self._endpoints.items()},
+		}
@@ -0,0 +1,93 @@
+from __future__ import annotations
+from typing import Any, Callable, Dict
+from concurrent.futures import Future
+from urllib.parse import urlsplit, urlunsplit
+import hashlib
+import json
+import threading
+
+
+def payload_key(payload: Any) -> str:
+	"""Stable hash of an invocation payload. Query strings are dropped from image
+	URLs so two presigned URLs for the same object count as the same request."""
+	def strip(v):
+		if isinstance(v, str) and v.startswith(('http://', 'https://')):
+			u = urlsplit(v)
+			return urlunsplit((u.scheme, u.netloc, u.path, '', ''))
+		if isinstance(v, list):
+			return [strip(x) for x in v]
+		if isinstance(v, dict):
+			return {k: strip(x) for k, x in v.items()}
+		return v
+	raw = json.dumps(strip(payload), sort_keys=True, ensure_ascii=False, default=str)
+	return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _chain(src: Future, dst: Future) -> None:
+	err = src.exception()
+	if err is not None:
+		dst.set_exception(err)
+	else:
+		dst.set_result(src.result())
+
+
+class SingleFlight:
+	"""Coalesces concurrent identical calls: while a call for a key is in flight,
+	other callers with the same key wait for its result instead of repeating it."""
+
+	def __init__(self):
+		self._calls: Dict[str, Future] = {}
+		self._lock = threading.Lock()
+		self.executed = 0
+		self.coalesced = 0
+
+	def do(self, key: str, fn: Callable[[], Any]) -> Any:
+		with self._lock:
+			fut = self._calls.get(key)
+			leader = fut is None
+			if leader:
+				fut = Future()
+				self._calls[key] = fut
+				self.executed += 1
+			else:
+				self.coalesced += 1
+		if not leader:
+			return fut.result()
+		try:
+			result = fn()
+		except BaseException as e:
+			fut.set_exception(e)
+			raise
+		else:
+			fut.set_result(result)
+			return result
+		finally:
+			self._forget(key, fut)
+
+	def share(self, key: str, submit: Callable[[], Future]) -> Future:
+		"""Future-returning variant: reuse the in-flight future for key, if any.
+		submit() runs outside the lock since it may block on backpressure."""
+		with self._lock:
+			fut = self._calls.get(key)
+			if fut is not None and not fut.done():
+				self.coalesced += 1
+				return fut
+			fut = Future()
+			self._calls[key] = fut
+			self.executed += 1
+		fut.add_done_callback(lambda f: self._forget(key, f))
+		try:
+			inner = submit()
+		except BaseException as e:
+			fut.set_exception(e)
+			raise
+		inner.add_done_callback(lambda f: _chain(f, fut))
+		return fut
+
+	def _forget(self, key: str, fut: Future) -> None:
+		with self._lock:
+			if self._calls.get(key) is fut:
+				del self._calls[key]
+
+	def stats(self) -> dict:
+		return {"executed": self.executed, "coalesced": self.coalesced, "in_flight": len(self._calls)}
@@ -0,0 +1,87 @@
+from __future__ import annotations
+from typing import List, Optional
+from django.conf import settings
+import os
+from storage import s3 as storage
+from storage.s3 import presign_get
+from .embeddings.content_store import ContentAddressedEmbeddingStore, content_hash
+from .embeddings.preprocess import derivative_source_hash, ensure_model_derivative
+
+_content_store = None
+
+
+def _downscaling() -> bool:
+	return bool(getattr(settings, 'EMBED_DOWNSCALE', True))
+
+
+def content_namespace() -> str:
+	"""Model plus how its input was prepared; vectors from differently prepared
+	images are not interchangeable, so they never share a namespace."""
+	model = getattr(settings, 'SIGLIP_MODEL_NAME', '')
+	if not _downscaling():
+		return f"{model}@original"
+	size = int(getattr(settings, 'EMBED_IMAGE_SIZE', 384))
+	quality = int(getattr(settings, 'EMBED_DERIVATIVE_QUALITY', 90))
+	return f"{model}@{size}/jpeg-q{quality}"
+
+
+def get_content_store() -> ContentAddressedEmbeddingStore | None:
+	global _content_store
+	backend = (getattr(settings, 'EMBED_CONTENT_STORE', '') or '').lower()
+	if not backend:
+		return None
+	if _content_store is None:
+		namespace = content_namespace()
+		if backend == 'local':
+			_content_store = ContentAddressedEmbeddingStore(
+				namespace,
+				local_path=getattr(settings, 'EMBED_CONTENT_STORE_PATH', None) or os.path.join('/tmp', 'hybrag', 'image-embeddings.sqlite3'),
+				max_bytes=int(getattr(settings, 'EMBED_CONTENT_STORE_MAX_MB', 1024)) * 1024 * 1024,
+			)
+		else:
+			_content_store = ContentAddressedEmbeddingStore(
+				namespace,
+				s3_client=storage.client(),
+				bucket=getattr(settings, 'S3_BUCKET', ''),
+				prefix=getattr(settings, 'EMBED_CONTENT_STORE_PREFIX', 'embeddings/by-content/'),
+			)
+	return _content_store
+
+
+def s3_key_for_item(item, filename: str = '') -> str:
+	"""Stable S3 key of an ImageItem's original upload."""
+	from django.utils.text import slugify
+	ext = os.path.splitext(filename or '')[1] or '.jpg'
+	return f"images/{slugify(str(item.building))}/{str(item.id)}{ext}"
+
+
+def embed_s3_image(siglip, s3_key: str, data: Optional[bytes] = None, etag: Optional[str] = None) -> List[float]:
+	"""Embedding for an image already in S3_BUCKET.
+
+	Duplicate uploads are answered from the content-addressed store (keyed by
+	sha256 of the bytes); otherwise the model-sized derivative is embedded and the
+	vector recorded for next time. A vector computed from the original because no
+	derivative could be made is not recorded, since it would not match the namespace.
+	"""
+	store = get_content_store()
+	digest = None
+	if store is not None:
+		if etag is None:
+			meta = storage.head(s3_key)
+			etag = (meta or {}).get('ETag') or ''
+		if data is not None:
+			digest = content_hash(data)
+		else:
+			# A derivative written earlier remembers the hash, saving a download of the original
+			digest = derivative_source_hash(s3_key, etag)
+			if digest is None:
+				data = storage.get_bytes(s3_key)
+				digest = content_hash(data)
+		vec = store.get(digest)
+		if vec is not None:
+			return vec
+	embed_key, derived = ensure_model_derivative(s3_key, data=data, etag=etag, source_hash=digest)
+	vec = siglip.embed_image(image_url=presign_get(embed_key), image_bytes=derived)
+	if store is not None and (embed_key != s3_key or not _downscaling()):
+		store.put(digest, vec)
+	return vec
@@ -0,0 +1,44 @@
+from __future__ import annotations
+from django.core.management.base import BaseCommand
+from images.embeddings.siglip import (
+	_decode_response,
+	_extract_embedding_from_data,
+	encode_f32_embeddings,
+	F32_CONTENT_TYPE,
+	NPY_CONTENT_TYPE,
+)
+import io
+import json
+import time
+import numpy as np
+
+
+class Command(BaseCommand):
+	help = "Compare decode time and payload size of JSON vs binary embedding responses"
+
+	def add_arguments(self, parser):
+		parser.add_argument('--dim', type=int, default=1536, help='Embedding dimension')
+		parser.add_argument('--rows', type=int, default=1, help='Vectors per response')
+		parser.add_argument('--iterations', type=int, default=2000, help='Decode iterations per format')
+
+	def handle(self, *args, **options):
+		dim, rows, iters = options['dim'], options['rows'], options['iterations']
+		vecs = np.random.default_rng(0).standard_normal((rows, dim)).astype(np.float32)
+		buf = io.BytesIO()
+		np.save(buf, vecs)
+		payloads = {
+			'json': (json.dumps({"embedding": vecs[0].tolist()} if rows == 1 else {"embeddings": vecs.tolist()}).encode('utf-8'), 'application/json'),
+			'npy': (buf.getvalue(), NPY_CONTENT_TYPE),
+			'f32': (encode_f32_embeddings(vecs), F32_CONTENT_TYPE),
+		}
+		self.stdout.write(f"dim={dim} rows={rows} iterations={iters}")
+		baseline = None
+		for name, (raw, ctype) in payloads.items():
+			start = time.perf_counter()
+			for _ in range(iters):
+				_extract_embedding_from_data(_decode_response(raw, ctype))
+			per_call = (time.perf_counter() - start) / iters * 1e6
+			baseline = baseline or per_call
+			self.stdout.write(
+				f"{name:>5}: {len(raw):>8} bytes  {per_call:9.1f} us/decode  ({baseline / per_call:5.1f}x vs json)"
+			)
@@ -0,0 +1,54 @@
+from __future__ import annotations
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from images.views import get_base_vectors
+from images.vector.ivf import IVFIndex
+import time
+import numpy as np
+
+
+class Command(BaseCommand):
+	help = "Train an IVF index over the configured vector store and report recall/latency per nprobe"
+
+	def add_arguments(self, parser):
+		parser.add_argument('--nlist', type=int, default=getattr(settings, 'VECTOR_IVF_NLIST', 0), help='Posting lists (0 = ~4*sqrt(n))')
+		parser.add_argument('--nprobe', type=int, default=getattr(settings, 'VECTOR_IVF_NPROBE', 8), help='Default lists probed per query')
+		parser.add_argument('--iters', type=int, default=20, help='k-means iterations')
+		parser.add_argument('--output', type=str, default=getattr(settings, 'VECTOR_IVF_PATH', '/tmp/hybrag/ivf-images.npz'), help='Index file to write')
+		parser.add_argument('--eval', type=int, default=50, help='Stored vectors to use as evaluation queries (0 to skip)')
+		parser.add_argument('--k', type=int, default=10, help='k for the recall report')
+
+	def handle(self, *args, **options):
+		store = get_base_vectors()
+		if not hasattr(store, 'export_blocks'):
+			raise CommandError(f'{type(store).__name__} cannot be listed; build_ivf_index needs the S3 vector store')
+		dim = int(getattr(settings, 'OS_EMB_DIM', 1536))
+		start = time.time()
+		idx = IVFIndex.from_blocks(dim, store.export_blocks(), nlist=options['nlist'] or None, nprobe=options['nprobe'], iters=options['iters'])
+		if not len(idx):
+			raise CommandError('No vectors found in the store')
+		idx.save(options['output'])
+		sizes = idx.list_sizes()
+		self.stdout.write(self.style.SUCCESS(
+			f"Indexed {len(idx)} vectors into {idx.nlist} lists in {time.time() - start:.1f}s -> {options['output']} "
+			f"(list size min/median/max {sizes.min()}/{int(np.median(sizes))}/{sizes.max()})"
+		))
+		if options['eval'] > 0:
+			self._report(idx, options['eval'], options['k'])
+
+	def _report(self, idx: IVFIndex, count: int, k: int):
+		rng = np.random.default_rng(0)
+		live = np.flatnonzero(~idx._deleted[:len(idx._ids)])
+		queries = idx._vectors[rng.choice(live, min(count, live.size), replace=False)]
+		truth = [{r['id'] for r in idx.search(q, k, nprobe=idx.nlist)} for q in queries]
+		self.stdout.write(f"{'nprobe':>8} {'recall@' + str(k):>10} {'ms/query':>10}")
+		nprobe = 1
+		while True:
+			start = time.perf_counter()
+			found = [{r['id'] for r in idx.search(q, k, nprobe=nprobe)} for q in queries]
+			ms = (time.perf_counter() - start) / len(queries) * 1000
+			recall = float(np.mean([len(f & t) / max(1, len(t)) for f, t in zip(found, truth)]))
+			self.stdout.write(f"{nprobe:>8} {recall:>10.3f} {ms:>10.2f}")
+			if nprobe >= idx.nlist:
+				break
+			nprobe = min(idx.nlist, nprobe * 2)
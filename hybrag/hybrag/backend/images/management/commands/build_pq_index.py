@@ -0,0 +1,97 @@
+from __future__ import annotations
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from images.views import get_base_vectors
+from images.vector.exact_index import normalize_rows
+from images.vector.pq import PQIndex
+import time
+import numpy as np
+
+
+class _Truth:
+	"""Exact top-k for a few stored vectors, accumulated while the blocks stream past.
+
+	The first blocks are held until `count` queries are picked from them, so every
+	row (including those earlier blocks) is scored against every query.
+	"""
+
+	def __init__(self, count: int, k: int):
+		self.count = count
+		self.k = k
+		self.queries = None
+		self.pending = []
+		self.best_ids = None
+		self.best_scores = None
+
+	def feed(self, blocks):
+		for block in blocks:
+			if self.count > 0 and self.queries is None:
+				self.pending.append(block)
+				if sum(len(ids) for ids, _, _ in self.pending) >= self.count:
+					self._start()
+			elif self.queries is not None:
+				self._score(*block[:2])
+			yield block
+		if self.count > 0 and self.queries is None and self.pending:
+			self._start()
+
+	def _start(self):
+		held = np.concatenate([np.asarray(v, dtype=np.float32) for _, v, _ in self.pending])
+		pick = np.random.default_rng(0).choice(held.shape[0], min(self.count, held.shape[0]), replace=False)
+		self.queries = normalize_rows(held[pick])
+		self.best_ids = np.empty((len(pick), 0), dtype=object)
+		self.best_scores = np.empty((len(pick), 0), dtype=np.float32)
+		for ids, vectors, _ in self.pending:
+			self._score(ids, vectors)
+		self.pending = []
+
+	def _score(self, ids, vectors):
+		scores = np.concatenate([self.best_scores, self.queries @ normalize_rows(np.asarray(vectors, dtype=np.float32)).T], axis=1)
+		all_ids = np.concatenate([self.best_ids, np.broadcast_to(np.asarray(ids, dtype=object), (len(self.queries), len(ids)))], axis=1)
+		keep = np.argsort(-scores, axis=1)[:, :self.k]
+		self.best_scores = np.take_along_axis(scores, keep, axis=1)
+		self.best_ids = np.take_along_axis(all_ids, keep, axis=1)
+
+
+class Command(BaseCommand):
+	help = "Train a product-quantized index over the configured vector store and report memory and recall"
+
+	def add_arguments(self, parser):
+		parser.add_argument('--m', type=int, default=getattr(settings, 'VECTOR_PQ_M', 0), help='Bytes per vector (0 = dim/8)')
+		parser.add_argument('--rerank', type=int, default=getattr(settings, 'VECTOR_PQ_RERANK', 4), help='Default candidates per result rescored exactly')
+		parser.add_argument('--train-size', type=int, default=20000, help='Vectors used to train the codebooks')
+		parser.add_argument('--output', type=str, default=getattr(settings, 'VECTOR_PQ_PATH', '/tmp/hybrag/pq-images.npz'), help='Index file to write')
+		parser.add_argument('--eval', type=int, default=50, help='Stored vectors to use as evaluation queries (0 to skip)')
+		parser.add_argument('--k', type=int, default=10, help='k for the recall report')
+
+	def handle(self, *args, **options):
+		store = get_base_vectors()
+		if not hasattr(store, 'export_blocks'):
+			raise CommandError(f'{type(store).__name__} cannot be listed; build_pq_index needs the S3 vector store')
+		dim = int(getattr(settings, 'OS_EMB_DIM', 1536))
+		truth = _Truth(options['eval'], options['k'])
+		start = time.time()
+		idx = PQIndex.from_blocks(dim, truth.feed(store.export_blocks()), m=options['m'] or None, rerank=options['rerank'], train_size=options['train_size'])
+		if not len(idx):
+			raise CommandError('No vectors found in the store')
+		idx.save(options['output'])
+		full = len(idx._ids) * dim * 4
+		used = idx.memory_bytes()
+		self.stdout.write(self.style.SUCCESS(
+			f"Encoded {len(idx)} vectors as {idx.m} bytes each in {time.time() - start:.1f}s -> {options['output']} "
+			f"(vector bytes only: {full / 2**20:.1f} MiB float32 -> {used / 2**20:.1f} MiB, {full / max(1, used):.1f}x smaller; "
+			f"ids and payloads are held as Python objects on top of this)"
+		))
+		if truth.queries is not None:
+			idx.fetch = getattr(store, 'fetch_vectors', None)
+			self._report(idx, truth, options['k'], options['rerank'])
+
+	def _report(self, idx: PQIndex, truth: _Truth, k: int, rerank: int):
+		expected = [set(row) for row in truth.best_ids.tolist()]
+		self.stdout.write(f"{'rerank':>8} {'recall@' + str(k):>10} {'ms/query':>10}")
+		for factor in sorted({0, 1, 2, max(0, rerank), 2 * max(0, rerank)} if idx.fetch else {0}):
+			start = time.perf_counter()
+			found = [{r['id'] for r in idx.search(q, k, rerank=factor)} for q in truth.queries]
+			ms = (time.perf_counter() - start) / len(truth.queries) * 1000
+			recall = float(np.mean([len(f & t) / max(1, len(t)) for f, t in zip(found, expected)]))
+			self.stdout.write(f"{factor:>8} {recall:>10.3f} {ms:>10.2f}")
@@ -0,0 +1,162 @@
+from __future__ import annotations
+from django.core.management.base import BaseCommand, CommandError
+from images.embeddings.async_jobs import AsyncEmbeddingJobManager
+from images.embeddings.notifications import AsyncCompletionListener
+from concurrent.futures import wait
+from contextlib import nullcontext
+import json
+import time
+import uuid
+import boto3
+
+try:
+	from moto import mock_aws
+except ImportError:  # only needed when no endpoints are given
+	mock_aws = None
+
+
+class _Endpoint:
+	"""Stands in for the SageMaker runtime: writes the output for each invocation to
+	S3 and sends the success notification to SQS, either after returning (the
+	usual order) or before, by handing it to the listener from inside the call."""
+
+	def __init__(self, s3, sqs, queue_url: str, bucket: str):
+		self.s3 = s3
+		self.sqs = sqs
+		self.queue_url = queue_url
+		self.bucket = bucket
+		self.listener = None
+		self.notify_first = False
+
+	def invoke_endpoint_async(self, EndpointName, InputLocation, ContentType, Accept):
+		key = f"outputs/{uuid.uuid4()}.out"
+		self.s3.put_object(Bucket=self.bucket, Key=key, Body=json.dumps({"embedding": [0.6, 0.8]}).encode('utf-8'), ContentType='application/json')
+		self.sqs.send_message(QueueUrl=self.queue_url, MessageBody=json.dumps(notification(InputLocation, f"s3://{self.bucket}/{key}")))
+		if self.notify_first:
+			self.listener.poll_once()
+		return {"OutputLocation": f"s3://{self.bucket}/{key}", "FailureLocation": f"s3://{self.bucket}/failures/{uuid.uuid4()}.out"}
+
+
+def notification(input_location: str, output_location: str) -> dict:
+	return {
+		"invocationStatus": "Completed",
+		"inferenceId": str(uuid.uuid4()),
+		"requestParameters": {"inputLocation": input_location},
+		"responseParameters": {"outputLocation": output_location},
+	}
+
+
+class Command(BaseCommand):
+	help = "Exercise the async completion listener's ack, release and expiry paths against SQS (moto in-process, or ElasticMQ/moto_server)"
+
+	def add_arguments(self, parser):
+		parser.add_argument('--sqs-endpoint', type=str, default='', help='SQS endpoint, e.g. http://localhost:9324 for ElasticMQ (default: moto in-process)')
+		parser.add_argument('--s3-endpoint', type=str, default='', help='S3 endpoint, e.g. a moto_server or MinIO URL (required with --sqs-endpoint)')
+		parser.add_argument('--region', type=str, default='us-east-1', help='Region for both clients')
+		parser.add_argument('--bucket', type=str, default='hybrag-listener-check', help='Bucket for async inputs and outputs (created if missing)')
+
+	def handle(self, *args, **options):
+		if bool(options['sqs_endpoint']) != bool(options['s3_endpoint']):
+			raise CommandError('--sqs-endpoint and --s3-endpoint go together')
+		if not options['sqs_endpoint'] and mock_aws is None:
+			raise CommandError('moto is not installed; pip install moto, or pass --sqs-endpoint/--s3-endpoint')
+		failures = []
+		with (nullcontext() if options['sqs_endpoint'] else mock_aws()):
+			kwargs = {"region_name": options['region']}
+			if options['sqs_endpoint']:
+				# Local emulators accept any credentials
+				kwargs.update(aws_access_key_id='x', aws_secret_access_key='x')
+			s3 = boto3.client('s3', endpoint_url=options['s3_endpoint'] or None, **kwargs)
+			sqs = boto3.client('sqs', endpoint_url=options['sqs_endpoint'] or None, **kwargs)
+			bucket = options['bucket']
+			try:
+				s3.create_bucket(Bucket=bucket)
+			except (s3.exceptions.BucketAlreadyOwnedByYou, s3.exceptions.BucketAlreadyExists):
+				pass
+			for name, check in (
+				('ack', self._check_ack),
+				('ack before invoke returns', self._check_early_ack),
+				('ack after polling resolved the job', self._check_late_ack),
+				('release', self._check_release),
+				('expiry', self._check_expiry),
+			):
+				# A queue per check: a released message stays invisible for a few seconds
+				queue_url = sqs.create_queue(QueueName=f"hybrag-listener-check-{uuid.uuid4().hex[:8]}")['QueueUrl']
+				try:
+					endpoint = _Endpoint(s3, sqs, queue_url, bucket)
+					manager = AsyncEmbeddingJobManager(endpoint, s3, 'listener-check', bucket, input_prefix='inputs/', output_prefix='outputs/', timeout=30)
+					listener = AsyncCompletionListener(sqs, queue_url, manager, wait_seconds=1)
+					# Polled by hand below; S3 polling only as a distant fallback
+					manager.listener = endpoint.listener = listener
+					manager.min_poll_interval = 3600
+					try:
+						check(sqs, queue_url, endpoint, manager, listener)
+						self.stdout.write(self.style.SUCCESS(f'PASS {name}'))
+					except AssertionError as e:
+						failures.append(name)
+						self.stdout.write(self.style.ERROR(f'FAIL {name}: {e}'))
+				finally:
+					sqs.delete_queue(QueueUrl=queue_url)
+		if failures:
+			raise CommandError(f"{len(failures)} listener check(s) failed: {', '.join(failures)}")
+
+	@staticmethod
+	def _counts(sqs, queue_url: str) -> tuple:
+		attrs = sqs.get_queue_attributes(
+			QueueUrl=queue_url,
+			AttributeNames=['ApproximateNumberOfMessages', 'ApproximateNumberOfMessagesNotVisible'],
+		)['Attributes']
+		return int(attrs['ApproximateNumberOfMessages']), int(attrs['ApproximateNumberOfMessagesNotVisible'])
+
+	def _check_ack(self, sqs, queue_url, endpoint, manager, listener):
+		future = manager.submit({"image_url": "https://example.com/a.jpg"})
+		deadline = time.time() + 10
+		while not future.done() and time.time() < deadline:
+			listener.poll_once()
+		assert future.done(), 'job not resolved by its notification'
+		assert future.result() == {"embedding": [0.6, 0.8]}, f'unexpected result {future.result()!r}'
+		assert listener.matched == 1 and listener.released == 0, f'listener stats {listener.stats()}'
+		assert self._counts(sqs, queue_url) == (0, 0), f'message not deleted: {self._counts(sqs, queue_url)}'
+
+	def _check_early_ack(self, sqs, queue_url, endpoint, manager, listener):
+		endpoint.notify_first = True
+		future = manager.submit({"image_url": "https://example.com/b.jpg"})
+		wait([future], timeout=10)
+		assert future.done(), 'job not resolved by the notification that arrived before invoke returned'
+		# The future resolves before poll_once (still inside invoke) counts and deletes the message
+		deadline = time.time() + 5
+		while self._counts(sqs, queue_url) != (0, 0) and time.time() < deadline:
+			time.sleep(0.05)
+		assert listener.matched == 1 and listener.released == 0, f'listener stats {listener.stats()}'
+		assert manager.pending_count() == 0, f'{manager.pending_count()} job(s) left pending'
+		assert self._counts(sqs, queue_url) == (0, 0), f'message not deleted: {self._counts(sqs, queue_url)}'
+
+	def _check_late_ack(self, sqs, queue_url, endpoint, manager, listener):
+		future = manager.submit({"image_url": "https://example.com/c.jpg"})
+		deadline = time.time() + 10
+		while manager.pending_count() == 0 and time.time() < deadline:
+			time.sleep(0.01)
+		with manager._cond:
+			jobs = list(manager._pending.values())
+		# The S3 poller finds the output before the listener sees the notification
+		manager._poll_once(jobs)
+		assert future.done(), 'job not resolved by polling'
+		listener.poll_once()
+		assert listener.matched == 1 and listener.released == 0, f'listener stats {listener.stats()}'
+		assert self._counts(sqs, queue_url) == (0, 0), f'message for a resolved job not deleted: {self._counts(sqs, queue_url)}'
+
+	def _check_release(self, sqs, queue_url, endpoint, manager, listener):
+		sqs.send_message(QueueUrl=queue_url, MessageBody=json.dumps(notification('s3://elsewhere/in.json', 's3://elsewhere/out.out')))
+		listener.poll_once()
+		assert listener.released == 1 and listener.matched == 0, f'listener stats {listener.stats()}'
+		assert self._counts(sqs, queue_url) == (0, 1), f'released message not kept back briefly: {self._counts(sqs, queue_url)}'
+		time.sleep(listener.release_visibility + 1)
+		assert self._counts(sqs, queue_url) == (1, 0), f'message not visible again: {self._counts(sqs, queue_url)}'
+
+	def _check_expiry(self, sqs, queue_url, endpoint, manager, listener):
+		sqs.send_message(QueueUrl=queue_url, MessageBody=json.dumps(notification('s3://elsewhere/in.json', 's3://elsewhere/out.out')))
+		listener.max_age = 0.0
+		time.sleep(0.01)
+		listener.poll_once()
+		assert listener.dropped == 1 and listener.released == 0, f'listener stats {listener.stats()}'
+		assert self._counts(sqs, queue_url) == (0, 0), f'expired message not deleted: {self._counts(sqs, queue_url)}'
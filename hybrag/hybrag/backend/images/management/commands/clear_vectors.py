@@ -0,0 +1,38 @@
+from __future__ import annotations
+from django.core.management.base import BaseCommand, CommandError
+from images.views import get_vectors
+import time
+
+
+class Command(BaseCommand):
+	help = "Delete every vector in the configured store, streaming pages into concurrent deletes (resumable with --checkpoint)"
+
+	def add_arguments(self, parser):
+		parser.add_argument('--namespace', type=str, default='', help='Namespace (ignored by stores without namespaces)')
+		parser.add_argument('--checkpoint', type=str, default='', help='Local file recording the listing position; rerun with the same path to resume')
+		parser.add_argument('--yes', action='store_true', help='Do not ask for confirmation')
+
+	def handle(self, *args, **options):
+		vec = get_vectors()
+		if not options['yes']:
+			answer = input('Delete ALL vectors in the store? Type "yes" to continue: ')
+			if answer.strip().lower() != 'yes':
+				self.stdout.write(self.style.WARNING('Aborted.'))
+				return
+		start = time.time()
+		last = [0.0]
+
+		def progress(done, total):
+			now = time.time()
+			if now - last[0] >= 2:
+				last[0] = now
+				self.stdout.write(self.style.NOTICE(f'Deleted {done} ({done / max(now - start, 1e-6):.0f}/s)'))
+
+		kwargs = {}
+		# Only the S3 store streams and checkpoints its deletes; other stores drop the whole index at once
+		if hasattr(vec, 'scan_blocks'):
+			kwargs = {"checkpoint": options['checkpoint'] or None, "progress": progress}
+		elif options['checkpoint']:
+			raise CommandError('--checkpoint needs the S3 vector store')
+		vec.delete_all(namespace=options['namespace'] or None, **kwargs)
+		self.stdout.write(self.style.SUCCESS(f'All vectors deleted in {time.time() - start:.1f}s'))
@@ -0,0 +1,28 @@
+from __future__ import annotations
+from django.core.management.base import BaseCommand, CommandError
+from images.views import get_vectors
+
+
+class Command(BaseCommand):
+	help = "Pack the legacy per-id S3 vector objects into binary segments with a manifest"
+
+	def add_arguments(self, parser):
+		parser.add_argument('--rows', type=int, default=4096, help='Vectors per segment object')
+		parser.add_argument('--dtype', choices=['float32', 'float16'], default='float32', help='Stored vector precision')
+		parser.add_argument('--grace', type=float, default=3600, help='Seconds a replaced segment is kept for scans still reading the old manifest')
+		parser.add_argument('--delete-source', action='store_true', help='Delete the per-id JSON objects once packed (objects overwritten meanwhile are kept)')
+
+	def handle(self, *args, **options):
+		vec = get_vectors()
+		if not hasattr(vec, 'compact_segments'):
+			raise CommandError(f'{type(vec).__name__} has no legacy S3 layout to compact')
+		if getattr(vec, 'vector_mode', False):
+			raise CommandError('Store is in S3 Vectors bucket mode; there are no legacy objects to compact')
+		self.stdout.write(self.style.NOTICE(f"Compacting {vec.bucket}/{vec.prefix}/{vec.index} (rows={options['rows']}, dtype={options['dtype']})"))
+		stats = vec.compact_segments(rows_per_segment=max(1, options['rows']), dtype=options['dtype'], delete_source=options['delete_source'], grace_seconds=max(0.0, options['grace']))
+		mb = stats['bytes'] / (1024 * 1024)
+		self.stdout.write(self.style.SUCCESS(
+			f"Wrote {stats['segments']} segments with {stats['vectors']} vectors ({mb:.1f} MB) "
+			f"from {stats['source_objects']} per-id objects; {stats['tombstones_applied']} tombstones applied; "
+			f"{stats['retired_segments']} replaced segments kept, {stats['deleted_segments']} deleted"
+		))
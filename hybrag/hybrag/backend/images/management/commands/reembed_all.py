@@ -3,7 +3,10 @@ from django.core.management.base import BaseCommand
 from django.conf import settings
 from images.models import ImageItem
 from images.views import get_siglip, get_vectors
-import os
+from images.ingest import s3_key_for_item
+from images.embeddings.preprocess import ensure_model_derivative
+from storage import s3 as storage
+from storage.s3 import presign_get
 
 class Base(BaseCommand):
 	pass
@@ -36,35 +39,39 @@ class Command(BaseCommand):
 		self.stdout.write(self.style.NOTICE(f'Re-embedding {total} images (batch={batch_size})'))
 
 		buf_items = []
-		buf_paths = []
+		buf_keys = []
 		count = 0
 		for item in qs.iterator():
-			if not os.path.exists(item.file.path):
+			s3_key = s3_key_for_item(item, item.file.name)
+			meta = storage.head(s3_key)
+			if meta is None:
 				continue
 			buf_items.append(item)
-			buf_paths.append(item.file.path)
+			buf_keys.append((s3_key, meta.get('ETag') or ''))
 			if len(buf_items) >= batch_size:
-				self._process_batch(buf_items, buf_paths, sig, vec, namespace)
+				self._process_batch(buf_items, buf_keys, sig, vec, namespace)
 				count += len(buf_items)
 				self.stdout.write(self.style.NOTICE(f'Upserted {count}'))
-				buf_items, buf_paths = [], []
+				buf_items, buf_keys = [], []
 		if buf_items:
-			self._process_batch(buf_items, buf_paths, sig, vec, namespace)
+			self._process_batch(buf_items, buf_keys, sig, vec, namespace)
 			count += len(buf_items)
 			self.stdout.write(self.style.NOTICE(f'Upserted {count}'))
 
 		self.stdout.write(self.style.SUCCESS('Re-embedding complete.'))
 
-	def _process_batch(self, items, paths, sig, vec, namespace):
-		vectors = sig.image_embed_batch(paths)
+	def _process_batch(self, items, keys, sig, vec, namespace):
+		# All images go in flight together; the async client micro-batches them into image_urls jobs
+		urls = [presign_get(ensure_model_derivative(k, etag=etag)[0]) for k, etag in keys]
+		vectors = sig.image_embed_urls(urls)
 		upserts = []
-		for it, v in zip(items, vectors):
+		for it, (s3_key, _), v in zip(items, keys, vectors):
 			payload = {
 				"id": str(it.id),
 				"building": it.building,
 				"shot_date": str(it.shot_date),
 				"shot_ymd": int(str(it.shot_date).replace('-', '')),
-				"image_url": getattr(settings, 'BACKEND_BASE_URL', 'http://127.0.0.1:8000').rstrip('/') + it.file.url,
+				"s3_key": s3_key,
 				"notes": it.notes or "",
 			}
 			upserts.append({"id": str(it.id), "values": v, "metadata": payload})
@@ -0,0 +1,141 @@
+from __future__ import annotations
+from typing import Any, Dict, List, Optional
+import hashlib
+import json
+import threading
+import time
+from .cache import LRUCache, SharedDiskCache
+
+
+def normalize_query_text(q: str) -> str:
+	"""Cache-key form of a raw query: case and whitespace folded, before spellcheck."""
+	return ' '.join((q or '').lower().split())
+
+
+class SearchResultCache:
+	"""Search results keyed by (normalized query, filters, k) and the store generation.
+
+	Two tiers like the text embedding cache: an in-process LRU in front of a
+	SQLite file shared by every worker on the host, which also holds the
+	generation counter. Any write through GenerationTrackingStore bumps the
+	generation, so entries computed before it are never served again; the TTL
+	bounds staleness from writes made on other hosts. Results are stored
+	without presigned URLs, which the caller regenerates on every hit.
+	"""
+
+	def __init__(self, ttl: float = 60.0, max_entries: int = 512, path: str | None = None, max_bytes: int = 64 * 1024 * 1024):
+		self.ttl = float(ttl)
+		self.memory = LRUCache(max_entries)
+		self.disk = SharedDiskCache(path, max_bytes=max_bytes) if path else None
+		self._generation = 0
+		self._lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+
+	@property
+	def enabled(self) -> bool:
+		return self.ttl > 0
+
+	def generation(self) -> int:
+		if self.disk is not None:
+			value = self.disk.counter('search_generation')
+			if value is not None:
+				return value
+		return self._generation
+
+	def bump(self) -> None:
+		with self._lock:
+			self._generation += 1
+		if self.disk is not None:
+			self.disk.incr('search_generation')
+
+	@staticmethod
+	def make_key(**parts: Any) -> str:
+		raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+		return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+	def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+		if not self.enabled:
+			return None
+		full = f"{self.generation()}:{key}"
+		now = time.time()
+		entry = self.memory.get(full)
+		if entry is None and self.disk is not None:
+			blob = self.disk.get(full)
+			if blob:
+				try:
+					entry = json.loads(blob)
+				except Exception:
+					entry = None
+				if entry is not None:
+					self.memory.set(full, entry)
+		if entry is None or now - entry['at'] > self.ttl:
+			with self._lock:
+				self.misses += 1
+			return None
+		with self._lock:
+			self.hits += 1
+		# Callers annotate results in place (presigned URLs); hand out a copy
+		return json.loads(json.dumps(entry['results']))
+
+	def set(self, key: str, results: List[Dict[str, Any]], generation: int) -> None:
+		"""Store results under the generation read before the search ran, so a write
+		that lands mid-search leaves them unreachable."""
+		if not self.enabled:
+			return
+		entry = {"at": time.time(), "results": json.loads(json.dumps(results, default=str))}
+		full = f"{generation}:{key}"
+		self.memory.set(full, entry)
+		if self.disk is not None:
+			self.disk.set(full, json.dumps(entry).encode('utf-8'))
+
+	def stats(self) -> dict:
+		total = self.hits + self.misses
+		return {
+			"hits": self.hits,
+			"misses": self.misses,
+			"hit_rate": (self.hits / total) if total else 0.0,
+			"generation": self.generation(),
+			"memory_entries": len(self.memory),
+			"ttl_seconds": self.ttl,
+		}
+
+
+class GenerationTrackingStore:
+	"""Wraps a vector store so that every write bumps the search cache generation,
+	failed ones included since they may have partially applied. Everything else,
+	search included, is forwarded unchanged."""
+
+	def __init__(self, store, cache: SearchResultCache):
+		self.store = store
+		self.cache = cache
+
+	def __getattr__(self, name: str):
+		store = self.__dict__.get('store')
+		if store is None:
+			raise AttributeError(name)
+		return getattr(store, name)
+
+	def upsert(self, *args, **kwargs):
+		try:
+			return self.store.upsert(*args, **kwargs)
+		finally:
+			self.cache.bump()
+
+	def upsert_batch(self, *args, **kwargs):
+		try:
+			return self.store.upsert_batch(*args, **kwargs)
+		finally:
+			self.cache.bump()
+
+	def delete_ids(self, *args, **kwargs):
+		try:
+			return self.store.delete_ids(*args, **kwargs)
+		finally:
+			self.cache.bump()
+
+	def delete_all(self, *args, **kwargs):
+		try:
+			return self.store.delete_all(*args, **kwargs)
+		finally:
+			self.cache.bump()
@@ -0,0 +1,185 @@
+from __future__ import annotations
+from django.test import SimpleTestCase
+import json
+import os
+import shutil
+import tempfile
+import threading
+import numpy as np
+from .vector.hnsw import HNSWVectorStore
+from .vector.local_store import RECORD
+from .vector.mmap_index import MmapVectorIndex
+from .vector.s3_vector_store import _PageWatermark
+
+DIM = 4
+
+
+def vec(i: int) -> list:
+	v = np.zeros(DIM, dtype=np.float32)
+	v[i % DIM] = 1.0
+	v[(i + 1) % DIM] = 0.1 * (i + 1)
+	return v.tolist()
+
+
+class _TmpDirMixin:
+	def setUp(self):
+		super().setUp()
+		self.tmp = tempfile.mkdtemp(prefix='hybrag-test-')
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp, ignore_errors=True)
+		super().tearDown()
+
+
+class LocalIndexStoreTests(_TmpDirMixin, SimpleTestCase):
+	"""Two stores on one path stand in for two workers on one host."""
+
+	def store(self, save_every: int = 1000) -> HNSWVectorStore:
+		return HNSWVectorStore(os.path.join(self.tmp, 'idx.bin'), dim=DIM, save_every=save_every)
+
+	@staticmethod
+	def ids(store) -> set:
+		return {r['id'] for r in store.search(vec(0), top_k=100)}
+
+	def test_interleaved_writes_are_shared(self):
+		a, b = self.store(), self.store()
+		a.upsert('p1', vec(1), {"building": "A"})
+		b.upsert('p2', vec(2), {"building": "B"})
+		a.delete_ids(['p1'])
+		self.assertEqual(self.ids(b), {'p2'})
+		b.save()
+		self.assertEqual(os.path.getsize(a.log_path), 0)
+		a.upsert('p3', vec(3), {"building": "A"})
+		self.assertEqual(self.ids(b), {'p2', 'p3'})
+		self.assertEqual([r['id'] for r in b.search(vec(3), top_k=10, building='A')], ['p3'])
+		# A fresh process sees the saved file plus the log written after it
+		self.assertEqual(self.ids(self.store()), {'p2', 'p3'})
+
+	def test_clear_reaches_other_instances(self):
+		a, b = self.store(), self.store()
+		a.upsert('p1', vec(1), {})
+		b.upsert('p2', vec(2), {})
+		a.delete_all()
+		self.assertEqual(self.ids(b), set())
+		b.upsert('p3', vec(3), {})
+		self.assertEqual(self.ids(a), {'p3'})
+		self.assertEqual(self.ids(self.store()), {'p3'})
+
+	def test_save_keeps_records_appended_by_others(self):
+		a, b = self.store(), self.store()
+		a.upsert('p1', vec(1), {})
+		index_save = a.index.save
+
+		def racing_save(path):
+			index_save(path)
+			# Lands after the snapshot was written but before the log is cut
+			b.upsert('p2', vec(2), {})
+
+		a.index.save = racing_save
+		a.save()
+		self.assertGreater(os.path.getsize(a.log_path), 0)
+		self.assertEqual(self.ids(self.store()), {'p1', 'p2'})
+
+	def test_torn_log_tail_is_ignored_then_truncated(self):
+		a = self.store()
+		a.upsert('p1', vec(1), {})
+		with open(a.log_path, 'ab') as fh:
+			# A writer that died halfway through its append
+			fh.write(RECORD.pack(200) + b'{"op": "upsert", "ite')
+		b = self.store()
+		self.assertEqual(self.ids(b), {'p1'})
+		b.upsert('p2', vec(2), {})
+		self.assertEqual(self.ids(self.store()), {'p1', 'p2'})
+		self.assertEqual(self.ids(a), {'p1', 'p2'})
+
+
+class MmapVectorIndexTests(_TmpDirMixin, SimpleTestCase):
+	def index(self) -> MmapVectorIndex:
+		# A large merge factor keeps background merges out of the way; the tests merge by hand
+		return MmapVectorIndex(os.path.join(self.tmp, 'mm'), DIM, merge_factor=1000)
+
+	@staticmethod
+	def contents(idx) -> dict:
+		return {r['id']: r.get('v') for r in idx.search(vec(0), top_k=100)}
+
+	def test_merge_racing_an_append(self):
+		a, b = self.index(), self.index()
+		for i in range(4):
+			a.upsert(f'p{i}', vec(i), {"v": 'old'})
+		swap = a._swap
+
+		def racing_swap(replaced, entries, built_at=None):
+			# Written while the merged segment was being built from the old rows
+			b.upsert('p1', vec(1), {"v": 'new'})
+			b.delete(['p2'])
+			return swap(replaced, entries, built_at)
+
+		a._swap = racing_swap
+		a.compact()
+		expected = {'p0': 'old', 'p1': 'new', 'p3': 'old'}
+		self.assertEqual(self.contents(a), expected)
+		self.assertEqual(self.contents(b), expected)
+		self.assertEqual(self.contents(self.index()), expected)
+		self.assertEqual(len(a), 3)
+
+	def test_tiered_merges_keep_the_latest_write(self):
+		idx = MmapVectorIndex(os.path.join(self.tmp, 'mm'), DIM, merge_factor=2)
+		for i in range(20):
+			idx.upsert(f'p{i % 5}', vec(i), {"v": i})
+			if i % 7 == 6:
+				idx.delete([f'p{i % 5}'])
+		for thread in threading.enumerate():
+			if thread.name == 'mmap-index-merge':
+				thread.join()
+		idx._merge_tiers()
+		self.assertEqual(self.contents(self.index()), {'p0': 15, 'p1': 16, 'p2': 17, 'p3': 18, 'p4': 19})
+		self.assertLess(len(idx._segments), 20)
+
+	def test_rebuild_racing_an_append(self):
+		a, b = self.index(), self.index()
+		a.upsert('gone', vec(0), {"v": 'old'})
+		a.upsert('kept', vec(1), {"v": 'old'})
+
+		def rows():
+			yield 'kept', vec(1), {"v": 'rebuilt'}
+			# Writes are not blocked while the rebuild scans
+			b.upsert('during', vec(2), {"v": 'new'})
+			b.upsert('kept', vec(1), {"v": 'new'})
+			yield 'other', vec(3), {"v": 'rebuilt'}
+
+		a.rebuild(rows())
+		expected = {'kept': 'new', 'during': 'new', 'other': 'rebuilt'}
+		self.assertEqual(self.contents(a), expected)
+		self.assertEqual(self.contents(self.index()), expected)
+
+
+class PageWatermarkTests(_TmpDirMixin, SimpleTestCase):
+	def token(self, path: str):
+		if not os.path.exists(path):
+			return None
+		with open(path) as fh:
+			return json.load(fh)['token']
+
+	def test_out_of_order_pages(self):
+		path = os.path.join(self.tmp, 'checkpoint.json')
+		marks = _PageWatermark(path, 'legacy:vectors/images/', 'bucket', 'images')
+		marks.done(1, 't2')
+		# Page 0 is still being deleted, so resuming must start from the beginning
+		self.assertIsNone(self.token(path))
+		marks.done(0, 't1')
+		self.assertEqual(self.token(path), 't2')
+		marks.done(3, 't4')
+		self.assertEqual(self.token(path), 't2')
+		marks.done(2, 't3')
+		self.assertEqual(self.token(path), 't4')
+		with open(path) as fh:
+			state = json.load(fh)
+		self.assertEqual((state['bucket'], state['index'], state['stage']), ('bucket', 'images', 'legacy:vectors/images/'))
+
+	def test_final_page_leaves_last_token(self):
+		path = os.path.join(self.tmp, 'checkpoint.json')
+		marks = _PageWatermark(path, 'vectors', 'bucket', 'images')
+		marks.done(0, 't1')
+		marks.done(1, None)
+		# The caller removes the file once the run finishes; until then it resumes after page 0
+		self.assertEqual(self.token(path), 't1')
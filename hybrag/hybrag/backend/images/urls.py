@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import ImageIngestView, ImageSearchView, ImageBatchIngestView, UpsertViaS3View, PresignUploadView, UIIndexView
+from .views import ImageIngestView, ImageSearchView, ImageBatchIngestView, UpsertViaS3View, PresignUploadView, UIIndexView, StatsView
 
 urlpatterns = [
     path('', UIIndexView.as_view()),
@@ -8,4 +8,5 @@ urlpatterns = [
 	path('api/images/upsert-s3', UpsertViaS3View.as_view()),
 	path('api/presign-upload', PresignUploadView.as_view()),
 	path('api/search', ImageSearchView.as_view()),
+	path('api/stats', StatsView.as_view()),
 ]
@@ -0,0 +1,211 @@
+from __future__ import annotations
+from typing import Any, Dict, Iterable, List, Optional
+import threading
+import time
+import numpy as np
+
+
+def ymd_bound(value: Optional[str]) -> Optional[int]:
+    """'2024-05-01' -> 20240501; None or unparseable -> None (filter not applied)."""
+    if not value:
+        return None
+    try:
+        return int(str(value).replace('-', ''))
+    except Exception:
+        return None
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k best finite scores, best first."""
+    n = scores.shape[0]
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k] if k < n else np.arange(n)
+    top = top[np.argsort(-scores[top], kind='stable')]
+    return top[np.isfinite(scores[top])]
+
+
+class LabelCodes:
+    """Interns a label column (`building`) as small ints, so filtering on it is one
+    integer comparison over a NumPy column. Code 0 is "no label"."""
+
+    def __init__(self):
+        self.values: List[Optional[str]] = [None]
+        self._codes: Dict[Optional[str], int] = {None: 0}
+
+    def code(self, value: Optional[str]) -> int:
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def find(self, value: Optional[str]) -> int:
+        """Code of a label, or -1 (matches no row) if it was never stored."""
+        return self._codes.get(value, -1)
+
+    def encode(self, values: Iterable[Optional[str]]) -> np.ndarray:
+        return np.fromiter((self.code(v) for v in values), dtype=np.int32)
+
+    def decode(self, codes: np.ndarray) -> List[Optional[str]]:
+        return np.asarray(self.values, dtype=object)[codes].tolist()
+
+
+class ExactVectorIndex:
+    """In-memory exact cosine index.
+
+    Vectors live pre-normalized in one contiguous float32 matrix (grown by
+    doubling), with `building`/`shot_ymd` held as columns so filters are
+    vectorized masks. A query is one matrix-vector product plus argpartition.
+    Deletes move the last row into the freed slot, so rows stay dense.
+    """
+
+    def __init__(self, dim: int, capacity: int = 1024):
+        self.dim = int(dim)
+        self._vectors = np.zeros((max(1, capacity), self.dim), dtype=np.float32)
+        self._ymd = np.zeros(max(1, capacity), dtype=np.int64)
+        self._building = np.zeros(max(1, capacity), dtype=np.int32)
+        self._labels = LabelCodes()
+        self._ids: List[str] = []
+        self._meta: List[Dict[str, Any]] = []
+        self._rows: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        self.built_at = 0.0
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, point_id: str) -> bool:
+        return str(point_id) in self._rows
+
+    def _grow(self, need: int) -> None:
+        cap = self._vectors.shape[0]
+        if need <= cap:
+            return
+        while cap < need:
+            cap *= 2
+        vectors = np.zeros((cap, self.dim), dtype=np.float32)
+        vectors[:len(self._ids)] = self._vectors[:len(self._ids)]
+        ymd = np.zeros(cap, dtype=np.int64)
+        ymd[:len(self._ids)] = self._ymd[:len(self._ids)]
+        building = np.zeros(cap, dtype=np.int32)
+        building[:len(self._ids)] = self._building[:len(self._ids)]
+        self._vectors, self._ymd, self._building = vectors, ymd, building
+
+    def upsert(self, point_id: str, vector: List[float], payload: Optional[Dict[str, Any]] = None) -> None:
+        self.upsert_many([(point_id, vector, payload)])
+
+    def upsert_many(self, items: Iterable[tuple]) -> None:
+        """items: (id, vector, payload) tuples."""
+        items = list(items)
+        if not items:
+            return
+        vecs = normalize_rows(np.asarray([v for _, v, _ in items], dtype=np.float32).reshape(len(items), self.dim))
+        with self._lock:
+            self._grow(len(self._ids) + len(items))
+            for (point_id, _, payload), vec in zip(items, vecs):
+                point_id = str(point_id)
+                meta = {k: v for k, v in (payload or {}).items() if k != 'embedding'}
+                row = self._rows.get(point_id)
+                if row is None:
+                    row = len(self._ids)
+                    self._rows[point_id] = row
+                    self._ids.append(point_id)
+                    self._meta.append(meta)
+                self._vectors[row] = vec
+                self._ymd[row] = ymd_bound(meta.get('shot_ymd')) or 0
+                self._building[row] = self._labels.code(meta.get('building'))
+                self._meta[row] = meta
+
+    def delete(self, ids: Iterable[str]) -> None:
+        with self._lock:
+            for point_id in ids:
+                row = self._rows.pop(str(point_id), None)
+                if row is None:
+                    continue
+                last = len(self._ids) - 1
+                if row != last:
+                    moved = self._ids[last]
+                    self._vectors[row] = self._vectors[last]
+                    self._ymd[row] = self._ymd[last]
+                    self._ids[row] = moved
+                    self._building[row] = self._building[last]
+                    self._meta[row] = self._meta[last]
+                    self._rows[moved] = row
+                self._ids.pop()
+                self._meta.pop()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._ids, self._meta, self._rows = [], [], {}
+
+    def rebuild(self, items: Iterable[tuple], stale_before: Optional[float] = None) -> None:
+        """Replace the contents with items ((id, vector, payload) tuples). Skipped when
+        the index was built after stale_before; a never-built index is always built."""
+        if self.built_at and (stale_before is None or self.built_at >= stale_before):
+            return
+        fresh = ExactVectorIndex(self.dim)
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= 1000:
+                fresh.upsert_many(batch)
+                batch = []
+        fresh.upsert_many(batch)
+        with self._lock:
+            self._vectors, self._ymd, self._building, self._labels = fresh._vectors, fresh._ymd, fresh._building, fresh._labels
+            self._ids, self._meta, self._rows = fresh._ids, fresh._meta, fresh._rows
+            self.built_at = time.time()
+
+    def _mask(self, n: int, building: Optional[str], ymd_from: Optional[int], ymd_to: Optional[int]) -> Optional[np.ndarray]:
+        mask = None
+        if building:
+            mask = self._building[:n] == self._labels.find(building)
+        if ymd_from is not None:
+            m = self._ymd[:n] >= ymd_from
+            mask = m if mask is None else mask & m
+        if ymd_to is not None:
+            m = self._ymd[:n] <= ymd_to
+            mask = m if mask is None else mask & m
+        return mask
+
+    def search(
+        self,
+        query_vector: List[float],
+        top_k: int = 10,
+        building: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        return self.search_batch([query_vector], top_k=top_k, building=building, date_from=date_from, date_to=date_to)[0]
+
+    def search_batch(
+        self,
+        query_vectors: List[List[float]],
+        top_k: int = 10,
+        building: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """One result list per query, scored with a single matrix product."""
+        queries = normalize_rows(np.asarray(query_vectors, dtype=np.float32).reshape(-1, self.dim))
+        k = max(1, int(top_k))
+        with self._lock:
+            n = len(self._ids)
+            if n == 0:
+                return [[] for _ in range(queries.shape[0])]
+            scores = queries @ self._vectors[:n].T
+            mask = self._mask(n, building, ymd_bound(date_from), ymd_bound(date_to))
+            if mask is not None:
+                scores = np.where(mask[None, :], scores, -np.inf)
+            return [
+                [{"id": self._ids[row], "score": float(row_scores[row]), **self._meta[row]} for row in top_k_indices(row_scores, k)]
+                for row_scores in scores
+            ]
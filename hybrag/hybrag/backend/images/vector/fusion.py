@@ -0,0 +1,35 @@
+from __future__ import annotations
+from typing import Any, Dict, List, Optional
+
+FUSIONS = ('max', 'rrf')
+
+
+def fuse_results(result_lists: List[List[Dict[str, Any]]], top_k: int = 10, method: str = 'max', rrf_k: int = 60) -> List[Dict[str, Any]]:
+    """Merge per-query result lists into one ranking of top_k rows.
+
+    'max' scores each id by its best similarity over the queries (max-sim); the
+    union of per-query top-k lists always contains the fused top-k. 'rrf' is
+    reciprocal rank fusion, sum(1 / (rrf_k + rank)), which ignores score scales.
+    The row kept for an id is the one from its best-scoring list.
+    """
+    if method not in FUSIONS:
+        raise ValueError(f"Unknown fusion {method!r}; expected one of {FUSIONS}")
+    best: Dict[str, Dict[str, Any]] = {}
+    fused: Dict[str, float] = {}
+    for results in result_lists:
+        for rank, row in enumerate(results, start=1):
+            point_id = row.get('id')
+            score = float(row.get('score') or 0.0)
+            if point_id not in best or score > float(best[point_id].get('score') or 0.0):
+                best[point_id] = row
+            if method == 'rrf':
+                fused[point_id] = fused.get(point_id, 0.0) + 1.0 / (rrf_k + rank)
+            else:
+                fused[point_id] = max(fused.get(point_id, score), score)
+    order = sorted(fused, key=lambda i: -fused[i])[:max(1, int(top_k))]
+    return [{**best[i], "score": fused[i]} for i in order]
+
+
+def finish_batch(result_lists: List[List[Dict[str, Any]]], top_k: int, fuse: Optional[str]):
+    """search_batch return value: the per-query lists, or one fused list when `fuse` is set."""
+    return fuse_results(result_lists, top_k, fuse) if fuse else result_lists
@@ -0,0 +1,322 @@
+from __future__ import annotations
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import heapq
+import json
+import math
+import os
+import random
+import struct
+import threading
+import zlib
+import numpy as np
+from .exact_index import LabelCodes, normalize_rows, top_k_indices, ymd_bound
+from .local_store import LocalIndexStore
+
+MAGIC = b'HNSW'
+VERSION = 1
+# magic, version, dim, M, ef_construction, nodes, entry point, max level, meta length
+HEADER = struct.Struct('<4sHIIIIiiQ')
+
+
+class HNSWIndex:
+    """Hierarchical navigable small world graph over cosine distance.
+
+    Nodes are pre-normalized rows of a float32 matrix; each node keeps one int32
+    neighbour array per level (up to 2*M on level 0, M above). Deletes are
+    tombstones: the node stays in the graph for navigation but is never
+    returned. Re-upserting an id tombstones the old node and inserts a new one.
+
+    Filters (`building`, `shot_ymd` range) are applied during the level-0 walk,
+    so the graph is traversed through non-matching nodes; when few rows match,
+    search falls back to an exact scan of just those rows.
+    """
+
+    def __init__(self, dim: int, M: int = 16, ef_construction: int = 200, ef_search: int = 64, exact_threshold: int = 2048, seed: int = 0):
+        self.dim = int(dim)
+        self.M = max(2, int(M))
+        self.ef_construction = max(self.M, int(ef_construction))
+        self.ef_search = max(1, int(ef_search))
+        self.exact_threshold = int(exact_threshold)
+        self._ml = 1.0 / math.log(self.M)
+        self._rng = random.Random(seed)
+        self._vectors = np.zeros((1024, self.dim), dtype=np.float32)
+        self._ymd = np.zeros(1024, dtype=np.int32)
+        self._deleted = np.zeros(1024, dtype=bool)
+        self._building = np.zeros(1024, dtype=np.int32)
+        self._labels = LabelCodes()
+        self._links: List[List[np.ndarray]] = []
+        self._ids: List[str] = []
+        self._payloads: List[Dict[str, Any]] = []
+        self._node: Dict[str, int] = {}
+        self.entry = -1
+        self.max_level = -1
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._node)
+
+    @property
+    def nodes(self) -> int:
+        """Graph size including tombstones."""
+        return len(self._ids)
+
+    def _grow(self) -> None:
+        n = len(self._ids)
+        if n < self._vectors.shape[0]:
+            return
+        cap = self._vectors.shape[0] * 2
+        for name in ('_vectors', '_ymd', '_deleted', '_building'):
+            old = getattr(self, name)
+            new = np.zeros((cap,) + old.shape[1:], dtype=old.dtype)
+            new[:n] = old[:n]
+            setattr(self, name, new)
+
+    # -- graph ---------------------------------------------------------
+
+    def _search_layer(self, q: np.ndarray, entry_points: List[int], ef: int, level: int, allowed: Optional[np.ndarray] = None) -> List[Tuple[float, int]]:
+        """Best-first walk of one level; returns up to ef (distance, node) pairs,
+        nearest first, counting only nodes with allowed[node] when given."""
+        vectors = self._vectors
+        visited = set(entry_points)
+        dists = 1.0 - vectors[entry_points] @ q
+        candidates = list(zip(dists.tolist(), entry_points))
+        heapq.heapify(candidates)
+        results: List[Tuple[float, int]] = []  # max-heap via negated distance
+        for d, e in candidates:
+            if allowed is None or allowed[e]:
+                heapq.heappush(results, (-d, e))
+        while len(results) > ef:
+            heapq.heappop(results)
+        while candidates:
+            d, c = heapq.heappop(candidates)
+            if len(results) >= ef and d > -results[0][0]:
+                break
+            links = self._links[c]
+            if level >= len(links):
+                continue
+            fresh = [x for x in links[level].tolist() if x not in visited]
+            if not fresh:
+                continue
+            visited.update(fresh)
+            for dist, x in zip((1.0 - vectors[fresh] @ q).tolist(), fresh):
+                if len(results) < ef or dist < -results[0][0]:
+                    heapq.heappush(candidates, (dist, x))
+                    if allowed is None or allowed[x]:
+                        heapq.heappush(results, (-dist, x))
+                        if len(results) > ef:
+                            heapq.heappop(results)
+        return sorted((-d, x) for d, x in results)
+
+    def _select(self, candidates: List[Tuple[float, int]], m: int) -> List[int]:
+        """Neighbour selection heuristic: keep a candidate only if it is closer to the
+        base than to any neighbour already kept, then top up with the nearest rest."""
+        kept: List[int] = []
+        for d, c in candidates:
+            if len(kept) >= m:
+                break
+            if not kept or bool(((1.0 - self._vectors[kept] @ self._vectors[c]) > d).all()):
+                kept.append(c)
+        if len(kept) < m:
+            chosen = set(kept)
+            kept.extend([c for _, c in candidates if c not in chosen][:m - len(kept)])
+        return kept
+
+    def _link(self, node: int, level: int, neighbours: List[int]) -> None:
+        self._links[node][level] = np.asarray(neighbours, dtype=np.int32)
+        mmax = 2 * self.M if level == 0 else self.M
+        for e in neighbours:
+            current = self._links[e][level]
+            if len(current) < mmax:
+                self._links[e][level] = np.append(current, np.int32(node))
+                continue
+            pool = np.append(current, np.int32(node))
+            d = 1.0 - self._vectors[pool] @ self._vectors[e]
+            order = np.argsort(d, kind='stable')
+            self._links[e][level] = np.asarray(self._select(list(zip(d[order].tolist(), pool[order].tolist())), mmax), dtype=np.int32)
+
+    def _insert(self, point_id: str, vec: np.ndarray, payload: Dict[str, Any]) -> None:
+        self._grow()
+        node = len(self._ids)
+        level = int(-math.log(1.0 - self._rng.random()) * self._ml)
+        self._vectors[node] = vec
+        self._ymd[node] = ymd_bound(payload.get('shot_ymd')) or 0
+        self._deleted[node] = False
+        self._building[node] = self._labels.code(payload.get('building'))
+        self._ids.append(point_id)
+        self._payloads.append(payload)
+        self._links.append([np.zeros(0, dtype=np.int32) for _ in range(level + 1)])
+        self._node[point_id] = node
+        if self.entry < 0:
+            self.entry, self.max_level = node, level
+            return
+        ep = [self.entry]
+        for lc in range(self.max_level, level, -1):
+            ep = [self._search_layer(vec, ep, 1, lc)[0][1]]
+        for lc in range(min(level, self.max_level), -1, -1):
+            found = self._search_layer(vec, ep, self.ef_construction, lc)
+            self._link(node, lc, self._select(found, self.M))
+            ep = [x for _, x in found]
+        if level > self.max_level:
+            self.entry, self.max_level = node, level
+
+    # -- public API ----------------------------------------------------
+
+    def upsert(self, point_id: str, vector: List[float], payload: Optional[Dict[str, Any]] = None) -> None:
+        self.upsert_many([(point_id, vector, payload)])
+
+    def upsert_many(self, items: Iterable[tuple]) -> None:
+        items = list(items)
+        if not items:
+            return
+        vecs = normalize_rows(np.asarray([v for _, v, _ in items], dtype=np.float32).reshape(len(items), self.dim))
+        with self._lock:
+            for (point_id, _, payload), vec in zip(items, vecs):
+                point_id = str(point_id)
+                old = self._node.pop(point_id, None)
+                if old is not None:
+                    self._deleted[old] = True
+                self._insert(point_id, vec, {k: v for k, v in (payload or {}).items() if k != 'embedding'})
+
+    def delete(self, ids: Iterable[str]) -> None:
+        with self._lock:
+            for point_id in ids:
+                node = self._node.pop(str(point_id), None)
+                if node is not None:
+                    self._deleted[node] = True
+
+    def search(
+        self,
+        query_vector: List[float],
+        top_k: int = 10,
+        building: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        ef: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        q = normalize_rows(np.asarray(query_vector, dtype=np.float32).reshape(self.dim))
+        k = max(1, int(top_k))
+        ymd_from, ymd_to = ymd_bound(date_from), ymd_bound(date_to)
+        with self._lock:
+            n = len(self._ids)
+            if not self._node:
+                return []
+            allowed = ~self._deleted[:n]
+            if building:
+                allowed &= self._building[:n] == self._labels.find(building)
+            if ymd_from is not None:
+                allowed &= self._ymd[:n] >= ymd_from
+            if ymd_to is not None:
+                allowed &= self._ymd[:n] <= ymd_to
+            matching = int(allowed.sum())
+            if matching == 0:
+                return []
+            if matching <= self.exact_threshold or matching < 0.02 * len(self._node):
+                # Few candidates: an exact scan of them is cheaper and has full recall
+                rows = np.flatnonzero(allowed)
+                scores = self._vectors[rows] @ q
+                hits = [(float(scores[i]), int(rows[i])) for i in top_k_indices(scores, k)]
+            else:
+                ep = [self.entry]
+                for lc in range(self.max_level, 0, -1):
+                    ep = [self._search_layer(q, ep, 1, lc)[0][1]]
+                found = self._search_layer(q, ep, max(k, int(ef or self.ef_search)), 0, allowed=allowed)
+                hits = [(1.0 - d, x) for d, x in found[:k]]
+            return [{"id": self._ids[x], "score": score, **self._payloads[x]} for score, x in hits]
+
+    # -- persistence ---------------------------------------------------
+
+    def save(self, path: str) -> None:
+        """Write the graph to one binary file (atomically replaced)."""
+        with self._lock:
+            n = len(self._ids)
+            levels = np.asarray([len(l) - 1 for l in self._links], dtype=np.int8)
+            flat = [arr for links in self._links for arr in links]
+            counts = np.asarray([len(a) for a in flat], dtype=np.int32)
+            neighbours = np.concatenate(flat).astype(np.int32) if flat else np.zeros(0, dtype=np.int32)
+            meta = zlib.compress(json.dumps({
+                "ids": self._ids,
+                "building": self._labels.decode(self._building[:n]),
+                "payloads": self._payloads,
+                "ef_search": self.ef_search,
+                "exact_threshold": self.exact_threshold,
+            }, default=str).encode('utf-8'))
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, 'wb') as fh:
+                fh.write(HEADER.pack(MAGIC, VERSION, self.dim, self.M, self.ef_construction, n, self.entry, self.max_level, len(meta)))
+                fh.write(self._vectors[:n].tobytes())
+                fh.write(self._ymd[:n].tobytes())
+                fh.write(self._deleted[:n].astype(np.uint8).tobytes())
+                fh.write(levels.tobytes())
+                fh.write(struct.pack('<Q', len(neighbours)))
+                fh.write(counts.tobytes())
+                fh.write(neighbours.tobytes())
+                fh.write(meta)
+            os.replace(tmp, path)
+
+    @classmethod
+    def from_blocks(cls, dim: int, blocks: Iterable[tuple], **params) -> 'HNSWIndex':
+        idx = cls(dim, **params)
+        for ids, vectors, payloads in blocks:
+            idx.upsert_many(zip(ids, vectors, payloads))
+        return idx
+
+    @classmethod
+    def load(cls, path: str) -> 'HNSWIndex':
+        with open(path, 'rb') as fh:
+            raw = fh.read()
+        magic, version, dim, M, efc, n, entry, max_level, meta_len = HEADER.unpack_from(raw, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not an HNSW index file")
+        pos = HEADER.size
+
+        def take(dtype, count):
+            nonlocal pos
+            arr = np.frombuffer(raw, dtype=dtype, count=count, offset=pos)
+            pos += arr.nbytes
+            return arr
+
+        vectors = take(np.float32, n * dim).reshape(n, dim)
+        ymd = take(np.int32, n)
+        deleted = take(np.uint8, n).astype(bool)
+        levels = take(np.int8, n)
+        (total,) = struct.unpack_from('<Q', raw, pos)
+        pos += 8
+        counts = take(np.int32, int(levels.astype(np.int64).sum()) + n)
+        neighbours = take(np.int32, total)
+        meta = json.loads(zlib.decompress(raw[pos:pos + meta_len]))
+        idx = cls(dim, M=M, ef_construction=efc, ef_search=meta.get('ef_search', 64), exact_threshold=meta.get('exact_threshold', 2048))
+        cap = max(1024, n)
+        idx._vectors = np.zeros((cap, dim), dtype=np.float32)
+        idx._vectors[:n] = vectors
+        idx._ymd = np.zeros(cap, dtype=np.int32)
+        idx._ymd[:n] = ymd
+        idx._deleted = np.zeros(cap, dtype=bool)
+        idx._deleted[:n] = deleted
+        idx._building = np.zeros(cap, dtype=np.int32)
+        idx._building[:n] = idx._labels.encode(meta['building'])
+        parts = np.split(neighbours, np.cumsum(counts)[:-1]) if len(counts) else []
+        links: List[List[np.ndarray]] = []
+        i = 0
+        for lv in levels.tolist():
+            links.append([p.copy() for p in parts[i:i + lv + 1]])
+            i += lv + 1
+        idx._links = links
+        idx._ids = meta['ids']
+        idx._payloads = meta['payloads']
+        idx._node = {pid: node for node, pid in enumerate(idx._ids) if not deleted[node]}
+        idx.entry, idx.max_level = entry, max_level
+        return idx
+
+
+class HNSWVectorStore(LocalIndexStore):
+    """LocalIndexStore backed by an HNSWIndex graph file."""
+
+    index_cls = HNSWIndex
+
+    def __init__(self, path: str, dim: int = 1536, source=None, M: int = 16, ef_construction: int = 200, ef_search: int = 64, save_every: int = 500):
+        self.ef_search = int(ef_search)
+        super().__init__(path, dim=dim, source=source, save_every=save_every, M=M, ef_construction=ef_construction, ef_search=ef_search)
+
+    def _configure(self, index: HNSWIndex) -> HNSWIndex:
+        index.ef_search = self.ef_search
+        return index
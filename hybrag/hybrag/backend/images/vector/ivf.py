@@ -0,0 +1,220 @@
+from __future__ import annotations
+from typing import Any, Dict, Iterable, List, Optional
+import json
+import math
+import os
+import threading
+import zlib
+import numpy as np
+from .exact_index import LabelCodes, normalize_rows, top_k_indices, ymd_bound
+from .kmeans import assign, kmeans
+from .local_store import LocalIndexStore
+
+
+class IVFIndex:
+    """Inverted-file index: spherical k-means centroids partition the vectors into
+    nlist posting lists, and a query scores only the rows of its nprobe nearest
+    lists. Everything is vectorized NumPy over one float32 matrix; posting lists
+    are a CSR view (rows sorted by list) rebuilt lazily after writes.
+
+    Before train() (or for an empty build) every query is an exact scan.
+    """
+
+    def __init__(self, dim: int, nlist: int = 256, nprobe: int = 8, centroids: Optional[np.ndarray] = None):
+        self.dim = int(dim)
+        self.nlist = max(1, int(nlist))
+        self.nprobe = max(1, int(nprobe))
+        self.centroids = centroids
+        self._vectors = np.zeros((1024, self.dim), dtype=np.float32)
+        self._ymd = np.zeros(1024, dtype=np.int32)
+        self._deleted = np.zeros(1024, dtype=bool)
+        self._list = np.zeros(1024, dtype=np.int32)
+        self._building = np.zeros(1024, dtype=np.int32)
+        self._labels = LabelCodes()
+        self._ids: List[str] = []
+        self._payloads: List[Dict[str, Any]] = []
+        self._node: Dict[str, int] = {}
+        self._order: Optional[np.ndarray] = None
+        self._offsets: Optional[np.ndarray] = None
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._node)
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def _grow(self, need: int) -> None:
+        cap = self._vectors.shape[0]
+        if need <= cap:
+            return
+        while cap < need:
+            cap *= 2
+        n = len(self._ids)
+        for name in ('_vectors', '_ymd', '_deleted', '_list', '_building'):
+            old = getattr(self, name)
+            new = np.zeros((cap,) + old.shape[1:], dtype=old.dtype)
+            new[:n] = old[:n]
+            setattr(self, name, new)
+
+    def train(self, iters: int = 20, sample: Optional[int] = None, seed: int = 0) -> None:
+        """Fit nlist centroids on (a sample of) the live rows and reassign every row."""
+        with self._lock:
+            live = np.flatnonzero(~self._deleted[:len(self._ids)])
+            if live.size == 0:
+                return
+            sample = int(sample or max(self.nlist * 64, 50000))
+            if live.size > sample:
+                live = np.random.default_rng(seed).choice(live, sample, replace=False)
+            self.nlist = min(self.nlist, live.size)
+            self.centroids = kmeans(self._vectors[live], self.nlist, iters=iters, spherical=True, seed=seed)
+            n = len(self._ids)
+            self._list[:n] = assign(self._vectors[:n], self.centroids, spherical=True)[0]
+            self._order = None
+
+    def upsert_many(self, items: Iterable[tuple]) -> None:
+        items = list(items)
+        if not items:
+            return
+        vecs = normalize_rows(np.asarray([v for _, v, _ in items], dtype=np.float32).reshape(len(items), self.dim))
+        lists = assign(vecs, self.centroids, spherical=True)[0] if self.centroids is not None else np.zeros(len(items), dtype=np.int32)
+        with self._lock:
+            self._grow(len(self._ids) + len(items))
+            for (point_id, _, payload), vec, lst in zip(items, vecs, lists):
+                point_id = str(point_id)
+                old = self._node.get(point_id)
+                if old is not None:
+                    self._deleted[old] = True
+                meta = {k: v for k, v in (payload or {}).items() if k != 'embedding'}
+                row = len(self._ids)
+                self._vectors[row] = vec
+                self._ymd[row] = ymd_bound(meta.get('shot_ymd')) or 0
+                self._deleted[row] = False
+                self._list[row] = lst
+                self._building[row] = self._labels.code(meta.get('building'))
+                self._ids.append(point_id)
+                self._payloads.append(meta)
+                self._node[point_id] = row
+            self._order = None
+
+    def delete(self, ids: Iterable[str]) -> None:
+        with self._lock:
+            for point_id in ids:
+                row = self._node.pop(str(point_id), None)
+                if row is not None:
+                    self._deleted[row] = True
+
+    def _postings(self):
+        if self._order is None:
+            n = len(self._ids)
+            self._order = np.argsort(self._list[:n], kind='stable').astype(np.int64)
+            self._offsets = np.searchsorted(self._list[:n][self._order], np.arange(self.nlist + 1))
+        return self._order, self._offsets
+
+    def list_sizes(self) -> np.ndarray:
+        with self._lock:
+            order, offsets = self._postings()
+            return np.diff(offsets)
+
+    def search(
+        self,
+        query_vector: List[float],
+        top_k: int = 10,
+        building: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        nprobe: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        q = normalize_rows(np.asarray(query_vector, dtype=np.float32).reshape(self.dim))
+        k = max(1, int(top_k))
+        with self._lock:
+            n = len(self._ids)
+            if not self._node:
+                return []
+            if self.centroids is None:
+                rows = np.arange(n)
+            else:
+                probe = min(int(nprobe or self.nprobe), self.nlist)
+                sims = self.centroids @ q
+                lists = np.argpartition(-sims, probe - 1)[:probe] if probe < self.nlist else np.arange(self.nlist)
+                order, offsets = self._postings()
+                rows = np.concatenate([order[offsets[l]:offsets[l + 1]] for l in lists])
+            mask = ~self._deleted[rows]
+            if building:
+                mask &= self._building[rows] == self._labels.find(building)
+            ymd_from, ymd_to = ymd_bound(date_from), ymd_bound(date_to)
+            if ymd_from is not None:
+                mask &= self._ymd[rows] >= ymd_from
+            if ymd_to is not None:
+                mask &= self._ymd[rows] <= ymd_to
+            rows = rows[mask]
+            scores = self._vectors[rows] @ q
+            return [{"id": self._ids[rows[i]], "score": float(scores[i]), **self._payloads[rows[i]]} for i in top_k_indices(scores, k)]
+
+    @classmethod
+    def from_blocks(cls, dim: int, blocks: Iterable[tuple], nlist: Optional[int] = None, nprobe: int = 8, iters: int = 20) -> 'IVFIndex':
+        idx = cls(dim, nlist=nlist or 1, nprobe=nprobe)
+        for ids, vectors, payloads in blocks:
+            idx.upsert_many(zip(ids, vectors, payloads))
+        if len(idx):
+            # ~4*sqrt(n) lists keeps both the centroid scan and each posting list small
+            idx.nlist = int(nlist) if nlist else max(1, int(4 * math.sqrt(len(idx))))
+            idx.train(iters=iters)
+        return idx
+
+    def save(self, path: str) -> None:
+        with self._lock:
+            n = len(self._ids)
+            meta = zlib.compress(json.dumps({
+                "ids": self._ids,
+                "building": self._labels.decode(self._building[:n]),
+                "payloads": self._payloads,
+                "nlist": self.nlist,
+                "nprobe": self.nprobe,
+            }, default=str).encode('utf-8'))
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, 'wb') as fh:
+                np.savez(
+                    fh,
+                    vectors=self._vectors[:n],
+                    ymd=self._ymd[:n],
+                    deleted=self._deleted[:n],
+                    lists=self._list[:n],
+                    centroids=self.centroids if self.centroids is not None else np.zeros((0, self.dim), dtype=np.float32),
+                    meta=np.frombuffer(meta, dtype=np.uint8),
+                )
+            os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'IVFIndex':
+        with np.load(path) as data:
+            meta = json.loads(zlib.decompress(data['meta'].tobytes()))
+            vectors = data['vectors']
+            centroids = data['centroids']
+            idx = cls(vectors.shape[1], nlist=meta['nlist'], nprobe=meta['nprobe'], centroids=centroids if len(centroids) else None)
+            n = vectors.shape[0]
+            idx._grow(n)
+            idx._vectors[:n] = vectors
+            idx._ymd[:n] = data['ymd']
+            idx._deleted[:n] = data['deleted']
+            idx._list[:n] = data['lists']
+        idx._ids = meta['ids']
+        idx._building[:n] = idx._labels.encode(meta['building'])
+        idx._payloads = meta['payloads']
+        idx._node = {pid: row for row, pid in enumerate(idx._ids) if not idx._deleted[row]}
+        return idx
+
+
+class IVFVectorStore(LocalIndexStore):
+    """LocalIndexStore backed by an IVFIndex; search(..., nprobe=) trades recall for latency per call."""
+
+    index_cls = IVFIndex
+
+    def __init__(self, path: str, dim: int = 1536, source=None, nlist: Optional[int] = None, nprobe: int = 8, save_every: int = 500):
+        self.nprobe = int(nprobe)
+        super().__init__(path, dim=dim, source=source, save_every=save_every, nlist=nlist, nprobe=nprobe)
+
+    def _configure(self, index: IVFIndex) -> IVFIndex:
+        index.nprobe = self.nprobe
+        return index
@@ -0,0 +1,85 @@
+from __future__ import annotations
+from typing import Optional, Tuple
+import numpy as np
+
+
+def assign(x: np.ndarray, centroids: np.ndarray, spherical: bool = False, chunk: int = 8192) -> Tuple[np.ndarray, np.ndarray]:
+    """Nearest centroid per row of x, in chunks to bound the distance matrix.
+
+    Returns (labels, distances); distances are squared L2, or 1 - cosine when
+    spherical (x and centroids are then expected to be unit-norm).
+    """
+    n = x.shape[0]
+    labels = np.empty(n, dtype=np.int32)
+    dists = np.empty(n, dtype=np.float32)
+    c_sq = None if spherical else (centroids * centroids).sum(axis=1)
+    for start in range(0, n, chunk):
+        block = x[start:start + chunk]
+        sims = block @ centroids.T
+        if spherical:
+            best = sims.argmax(axis=1)
+            d = 1.0 - sims[np.arange(len(block)), best]
+        else:
+            # ||x||^2 is constant per row, so argmin over ||c||^2 - 2 x.c suffices
+            partial = c_sq[None, :] - 2.0 * sims
+            best = partial.argmin(axis=1)
+            d = partial[np.arange(len(block)), best] + (block * block).sum(axis=1)
+        labels[start:start + chunk] = best
+        dists[start:start + chunk] = np.maximum(d, 0.0)
+    return labels, dists
+
+
+def kmeans(x: np.ndarray, k: int, iters: int = 20, spherical: bool = False, seed: int = 0, tol: float = 1e-4, init: Optional[np.ndarray] = None) -> np.ndarray:
+    """Lloyd's k-means with k-means++ seeding, vectorized in NumPy.
+
+    spherical=True clusters unit vectors by cosine (centroids re-normalized each
+    step), as used by the IVF coarse quantizer; PQ sub-spaces use plain L2.
+    Empty clusters are re-seeded from the points farthest from their centroid.
+    """
+    x = np.ascontiguousarray(x, dtype=np.float32)
+    n = x.shape[0]
+    if n == 0:
+        raise ValueError('kmeans needs at least one point')
+    k = min(int(k), n)
+    rng = np.random.default_rng(seed)
+    if init is not None:
+        centroids = np.array(init, dtype=np.float32)
+    else:
+        centroids = _plus_plus(x, k, rng, spherical)
+    prev = None
+    for _ in range(max(1, int(iters))):
+        labels, dists = assign(x, centroids, spherical=spherical)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, x)
+        nonempty = counts > 0
+        centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+        empty = np.flatnonzero(~nonempty)
+        if empty.size:
+            far = np.argsort(-dists)[:empty.size]
+            centroids[empty] = x[far]
+        if spherical:
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids /= norms
+        inertia = float(dists.sum())
+        if prev is not None and abs(prev - inertia) <= tol * max(prev, 1e-12):
+            break
+        prev = inertia
+    return centroids
+
+
+def _plus_plus(x: np.ndarray, k: int, rng: np.random.Generator, spherical: bool) -> np.ndarray:
+    # Seeding on a bounded sample keeps k-means++ at O(sample * k)
+    sample = x if x.shape[0] <= 20000 else x[rng.choice(x.shape[0], 20000, replace=False)]
+    centroids = np.empty((k, x.shape[1]), dtype=np.float32)
+    centroids[0] = sample[rng.integers(sample.shape[0])]
+    _, d = assign(sample, centroids[:1], spherical=spherical)
+    for i in range(1, k):
+        p = d.astype(np.float64)
+        total = p.sum()
+        pick = rng.integers(sample.shape[0]) if total <= 0 else rng.choice(sample.shape[0], p=p / total)
+        centroids[i] = sample[pick]
+        _, d_new = assign(sample, centroids[i:i + 1], spherical=spherical)
+        d = np.minimum(d, d_new)
+    return centroids
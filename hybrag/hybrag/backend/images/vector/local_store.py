@@ -0,0 +1,364 @@
+from __future__ import annotations
+from typing import Any, Dict, List, Optional
+from contextlib import contextmanager
+import base64
+import fcntl
+import json
+import os
+import struct
+import threading
+import time
+import numpy as np
+from .fusion import finish_batch
+
+# Log records are a little-endian length followed by that many bytes of JSON
+RECORD = struct.Struct('<I')
+
+
+def _identity(path: str):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class LocalIndexStore:
+    """Drop-in for S3VectorStore (upsert / upsert_batch / delete_ids / delete_all /
+    search) that answers searches from a local index file.
+
+    Subclasses set `index_cls`, which provides from_blocks(dim, blocks, **params),
+    load(path), save(path), upsert_many, delete and search. Writes go to `source`
+    first (when given), then are appended to `<path>.log` under an flock and
+    applied to the in-memory index. Every process replays the records other
+    processes appended before it searches or writes, so all workers on a host see
+    the same writes and a restart loses none of them. Once the log holds
+    `save_every` records the index is written to `path` in a background thread
+    and the log is cut down to the records that arrived meanwhile; the lock is
+    held only to swap the two files.
+
+    A missing index file is built in a background thread from
+    source.export_blocks() (S3 Vectors when active, else the legacy layout),
+    by one process per host; until it is published, searches are answered by
+    `source`. Attributes not defined here are looked up on `source`.
+    """
+
+    index_cls: Any = None
+
+    def __init__(self, path: str, dim: int = 1536, source=None, save_every: int = 500, **params):
+        self.path = path
+        self.log_path = path + '.log'
+        self.dim = int(dim)
+        self.source = source
+        self.save_every = max(1, int(save_every))
+        self._params = params
+        self._snapshot = None
+        self._offset = 0
+        self._records = 0
+        self._lock = threading.RLock()
+        self._saving = threading.Lock()
+        self._builder: Optional[threading.Thread] = None
+        self._build_failed_at = 0.0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.index, self._snapshot = self._load_snapshot()
+        if self.index is None and source is None:
+            self.index = self._configure(self.index_cls.from_blocks(self.dim, [], **params))
+        self._refresh()
+
+    def __getattr__(self, name: str):
+        source = self.__dict__.get('source')
+        if source is None:
+            raise AttributeError(name)
+        return getattr(source, name)
+
+    def _configure(self, index):
+        """Apply per-process query settings to a freshly loaded index."""
+        return index
+
+    @property
+    def ready(self) -> bool:
+        """False while the index is being built and searches go to `source`."""
+        return self.index is not None
+
+    # -- building ------------------------------------------------------
+
+    def _source_blocks(self):
+        for name in ('export_blocks', 'scan_blocks'):
+            if hasattr(self.source, name):
+                return getattr(self.source, name)()
+        return []
+
+    def _start_build(self) -> None:
+        if self._builder is not None and self._builder.is_alive():
+            return
+        if time.monotonic() - self._build_failed_at < 60:
+            return
+        self._builder = threading.Thread(target=self._build, name='local-index-build', daemon=True)
+        self._builder.start()
+
+    def _build(self) -> None:
+        """Build from source and publish the file. Every process runs this, but the
+        build lock lets one build while the others wait and then load its file."""
+        try:
+            with self._flock(fcntl.LOCK_EX, '.build.lock'):
+                if _identity(self.path) is not None:
+                    return
+                # Writes already in the log also reached source before the scan starts
+                with self._flock(fcntl.LOCK_EX), self._lock:
+                    start = self._catch_up()
+                index = self._configure(self.index_cls.from_blocks(self.dim, self._source_blocks(), **self._params))
+                with self._flock(fcntl.LOCK_EX), self._lock:
+                    if self.index is not None:
+                        return
+                    self.index, self._offset, self._records = index, start, 0
+                    self._catch_up()
+                self.save()
+        except Exception:
+            self._build_failed_at = time.monotonic()
+            raise
+
+    # -- log -----------------------------------------------------------
+
+    @contextmanager
+    def _flock(self, mode: int, name: str = '.lock'):
+        with open(self.path + name, 'a+') as fh:
+            fcntl.flock(fh, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _load_snapshot(self):
+        """(index, identity) of the index file, or (None, None) when there is none."""
+        for _ in range(3):
+            before = _identity(self.path)
+            if before is None:
+                return None, None
+            try:
+                index = self.index_cls.load(self.path)
+            except FileNotFoundError:
+                continue
+            if _identity(self.path) == before:
+                return self._configure(index), before
+        return None, None
+
+    def _apply(self, record: dict) -> None:
+        op = record.get('op')
+        if self.index is None:
+            return  # not built yet; the build replays the log from where it started
+        if op == 'upsert':
+            self.index.upsert_many(
+                (point_id, np.frombuffer(base64.b64decode(vec), dtype=np.float32), payload)
+                for point_id, vec, payload in record['items']
+            )
+        elif op == 'delete':
+            self.index.delete(record['ids'])
+        elif op == 'clear':
+            self.index = self._configure(self.index_cls.from_blocks(self.dim, [], **self._params))
+
+    def _catch_up(self) -> int:
+        """Apply records appended since our offset; caller holds the flock and
+        self._lock. Returns the end of the last complete record."""
+        try:
+            with open(self.log_path, 'rb') as fh:
+                fh.seek(0, os.SEEK_END)
+                if fh.tell() < self._offset:
+                    # The log was replaced behind our back; everything in it is new to us
+                    self._offset = self._records = 0
+                fh.seek(self._offset)
+                raw = fh.read()
+        except FileNotFoundError:
+            self._offset = self._records = 0
+            return 0
+        pos = 0
+        while pos + RECORD.size <= len(raw):
+            (size,) = RECORD.unpack_from(raw, pos)
+            if pos + RECORD.size + size > len(raw):
+                break  # torn append from a crashed writer; the next writer truncates it
+            self._apply(json.loads(raw[pos + RECORD.size:pos + RECORD.size + size]))
+            pos += RECORD.size + size
+            self._records += 1
+        self._offset += pos
+        return self._offset
+
+    def _refresh(self) -> None:
+        """Pick up a newer index file and replay log records written by other processes."""
+        if self.index is None and _identity(self.path) is None:
+            self._start_build()
+        while True:
+            if _identity(self.path) == self._snapshot:
+                try:
+                    if os.stat(self.log_path).st_size == self._offset:
+                        return
+                except FileNotFoundError:
+                    if not self._offset:
+                        return
+                with self._flock(fcntl.LOCK_SH), self._lock:
+                    if _identity(self.path) == self._snapshot:
+                        self._catch_up()
+                        return
+            # Another process saved; load its file without holding the lock
+            index, ident = self._load_snapshot()
+            with self._flock(fcntl.LOCK_SH), self._lock:
+                if _identity(self.path) == ident:
+                    if index is not None:
+                        self.index, self._offset, self._records = index, 0, 0
+                    self._snapshot = ident
+                    self._catch_up()
+                    return
+
+    def _write(self, record: dict) -> None:
+        data = json.dumps(record, default=str).encode('utf-8')
+        self._refresh()
+        with self._flock(fcntl.LOCK_EX), self._lock:
+            if _identity(self.path) != self._snapshot:
+                # Saved by another process since _refresh(); rare, so reload under the lock
+                index, self._snapshot = self._load_snapshot()
+                if index is not None:
+                    self.index, self._offset, self._records = index, 0, 0
+            end = self._catch_up()
+            with open(self.log_path, 'ab') as fh:
+                if fh.tell() != end:
+                    fh.truncate(end)
+                fh.write(RECORD.pack(len(data)) + data)
+            self._offset = end + RECORD.size + len(data)
+            self._records += 1
+            self._apply(record)
+            due = self.index is not None and self._records >= self.save_every
+        if due:
+            self._save_soon()
+
+    # -- saving --------------------------------------------------------
+
+    def _save_soon(self) -> None:
+        if not self._saving.locked():
+            threading.Thread(target=self.save, name='local-index-save', daemon=True).start()
+
+    def save(self) -> None:
+        """Write the index to `path` and cut the log down to the records the file
+        does not contain. Skipped when another process saved first."""
+        if not self._saving.acquire(blocking=False):
+            return
+        try:
+            with self._flock(fcntl.LOCK_EX | fcntl.LOCK_NB, '.save.lock'):
+                self._save()
+        except BlockingIOError:
+            pass  # another process is saving
+        finally:
+            self._saving.release()
+
+    def _save(self) -> None:
+        self._refresh()
+        with self._lock:
+            index, snapshot, start, records = self.index, self._snapshot, self._offset, self._records
+        if index is None:
+            return
+        # Written without any lock: the file may also hold records past `start`,
+        # which replay idempotently on top of it
+        tmp = f"{self.path}.{os.getpid()}.snapshot"
+        index.save(tmp)
+        with self._flock(fcntl.LOCK_EX), self._lock:
+            if _identity(self.path) != snapshot:
+                os.remove(tmp)
+                return
+            end = self._catch_up()
+            tail = b''
+            if end > start:
+                with open(self.log_path, 'rb') as fh:
+                    fh.seek(start)
+                    tail = fh.read(end - start)
+            os.replace(tmp, self.path)
+            # Index file first: a crash between the two replaces only replays the whole old log
+            log_tmp = f"{self.log_path}.{os.getpid()}.tmp"
+            with open(log_tmp, 'wb') as fh:
+                fh.write(tail)
+            os.replace(log_tmp, self.log_path)
+            self._snapshot = _identity(self.path)
+            self._offset = len(tail)
+            self._records -= records
+
+    # -- store API -----------------------------------------------------
+
+    @staticmethod
+    def _row(point_id: str, vector, payload: Optional[Dict[str, Any]]) -> list:
+        vec = np.asarray(vector, dtype=np.float32)
+        return [str(point_id), base64.b64encode(vec.tobytes()).decode('ascii'), payload or {}]
+
+    def upsert(self, point_id: str, vector: List[float], payload: Dict[str, Any], namespace: Optional[str] = None) -> None:
+        if len(vector) != self.dim:
+            raise ValueError(f"Vector length {len(vector)} != dim {self.dim}")
+        if self.source is not None:
+            self.source.upsert(point_id, vector, payload, namespace=namespace)
+        self._write({"op": "upsert", "items": [self._row(point_id, vector, payload)]})
+
+    def upsert_batch(self, items: List[Dict[str, Any]], namespace: Optional[str] = None, **options) -> None:
+        """options (e.g. progress=) are passed through to source.upsert_batch."""
+        if not items:
+            return
+        items = list(items)
+        rows = []
+        for it in items:
+            vals = it.get('values') or it.get('vector')
+            if vals is None:
+                raise ValueError('Missing values for upsert item')
+            if len(vals) != self.dim:
+                raise ValueError(f"Vector length {len(vals)} != dim {self.dim}")
+            rows.append(self._row(it.get('id'), vals, it.get('metadata')))
+        if self.source is not None:
+            self.source.upsert_batch(items, namespace=namespace, **options)
+        self._write({"op": "upsert", "items": rows})
+
+    def delete_ids(self, ids: List[str], namespace: Optional[str] = None) -> None:
+        if not ids:
+            return
+        if self.source is not None:
+            self.source.delete_ids(ids, namespace=namespace)
+        self._write({"op": "delete", "ids": [str(i) for i in ids]})
+
+    def delete_all(self, namespace: Optional[str] = None, **options) -> None:
+        """options (e.g. checkpoint=, progress=) are passed through to source.delete_all."""
+        if self.source is not None:
+            self.source.delete_all(namespace=namespace, **options)
+        self._write({"op": "clear"})
+        self.save()
+
+    def search(
+        self,
+        query_vector: List[float],
+        top_k: int = 10,
+        building: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        namespace: Optional[str] = None,
+        **options,
+    ) -> List[Dict[str, Any]]:
+        """options are index-specific query knobs (ef for HNSW, nprobe for IVF)."""
+        if len(query_vector) != self.dim:
+            raise ValueError(f"Query vector length {len(query_vector)} != dim {self.dim}")
+        self._refresh()
+        index = self.index
+        if index is None:
+            return self.source.search(query_vector, top_k=top_k, building=building, date_from=date_from, date_to=date_to, namespace=namespace)
+        return index.search(query_vector, top_k=top_k, building=building, date_from=date_from, date_to=date_to, **options)
+
+    def search_batch(
+        self,
+        query_vectors: List[List[float]],
+        top_k: int = 10,
+        building: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        namespace: Optional[str] = None,
+        fuse: Optional[str] = None,
+        **options,
+    ):
+        """search() per query vector; one list per query, or one fused list when `fuse` is set."""
+        for q in query_vectors:
+            if len(q) != self.dim:
+                raise ValueError(f"Query vector length {len(q)} != dim {self.dim}")
+        self._refresh()
+        index = self.index
+        if index is None:
+            return self.source.search_batch(query_vectors, top_k=top_k, building=building, date_from=date_from, date_to=date_to, namespace=namespace, fuse=fuse)
+        results = [index.search(q, top_k=top_k, building=building, date_from=date_from, date_to=date_to, **options) for q in query_vectors]
+        return finish_batch(results, top_k, fuse)
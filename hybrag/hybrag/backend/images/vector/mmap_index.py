@@ -0,0 +1,394 @@
+from __future__ import annotations
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from contextlib import contextmanager
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+import numpy as np
+from .exact_index import LabelCodes, normalize_rows, top_k_indices, ymd_bound
+
+MANIFEST = 'manifest.json'
+
+
+class _Segment:
+    """One immutable segment: `<name>.f32` (rows x dim float32, pre-normalized),
+    `<name>.ymd` (int32 shot_ymd column) and `<name>.meta.json` (ids, building
+    column, payloads, and ids this segment deletes from earlier ones)."""
+
+    __slots__ = ('name', 'vectors', 'ymd', 'ids', 'building', 'labels', 'payloads', 'deleted', 'live')
+
+    def __init__(self, root: str, name: str, rows: int, dim: int):
+        self.name = name
+        with open(os.path.join(root, name + '.meta.json'), 'rb') as fh:
+            meta = json.loads(fh.read())
+        if rows:
+            self.vectors = np.memmap(os.path.join(root, name + '.f32'), dtype=np.float32, mode='r', shape=(rows, dim))
+            self.ymd = np.memmap(os.path.join(root, name + '.ymd'), dtype=np.int32, mode='r', shape=(rows,))
+        else:
+            self.vectors = np.zeros((0, dim), dtype=np.float32)
+            self.ymd = np.zeros(0, dtype=np.int32)
+        self.ids: List[str] = meta.get('ids') or []
+        self.labels = LabelCodes()
+        self.building = self.labels.encode(meta.get('building') or [])
+        self.payloads: List[Dict[str, Any]] = meta.get('payloads') or []
+        self.deleted: List[str] = meta.get('deleted') or []
+        # Rows not superseded by a later segment; maintained per reader
+        self.live = np.ones(rows, dtype=bool)
+
+    def fresh(self) -> '_Segment':
+        """The same mapped files with every row live, to re-derive liveness off to the side."""
+        seg = object.__new__(_Segment)
+        for name in self.__slots__:
+            setattr(seg, name, getattr(self, name))
+        seg.live = np.ones(len(self.ids), dtype=bool)
+        return seg
+
+    @property
+    def weight(self) -> int:
+        return len(self.ids) + len(self.deleted)
+
+
+class MmapVectorIndex:
+    """Exact cosine index stored on local disk and memory-mapped by every worker.
+
+    Writes append immutable segments and atomically replace manifest.json under
+    an flock, so all processes on a host share one copy of the vectors through
+    the page cache. Readers stat the manifest before each query and map only the
+    segments published since; after a merge they reuse the segments still listed.
+    Segments are merged by size tier: once merge_factor neighbouring segments
+    fall in the same tier (rows + deletes, in powers of merge_factor) a
+    background thread writes their union as one segment, and the flock is held
+    only to swap it into the manifest. Each row is thus rewritten about
+    log(n) / log(merge_factor) times, never on the request thread.
+    """
+
+    def __init__(self, path: str, dim: int, merge_factor: int = 8):
+        self.path = path
+        self.dim = int(dim)
+        self.merge_factor = max(2, int(merge_factor))
+        os.makedirs(path, exist_ok=True)
+        self._segments: List[_Segment] = []
+        self._where: Dict[str, tuple] = {}
+        self._signature = None
+        self._built_at = 0.0
+        self._lock = threading.RLock()
+        self._merging = threading.Lock()
+
+    def __len__(self) -> int:
+        self.refresh()
+        return len(self._where)
+
+    @property
+    def built_at(self) -> float:
+        self.refresh()
+        return self._built_at
+
+    # -- reading -------------------------------------------------------
+
+    def _read_manifest(self) -> dict:
+        try:
+            with open(os.path.join(self.path, MANIFEST), 'rb') as fh:
+                return json.loads(fh.read())
+        except FileNotFoundError:
+            return {"dim": self.dim, "seq": 0, "built_at": 0.0, "segments": []}
+
+    def refresh(self) -> None:
+        """Map segments published since the last call; a single stat() when nothing changed."""
+        for _ in range(3):
+            try:
+                st = os.stat(os.path.join(self.path, MANIFEST))
+                sig = (st.st_ino, st.st_mtime_ns, st.st_size)
+            except FileNotFoundError:
+                sig = None
+            with self._lock:
+                if sig == self._signature:
+                    return
+                manifest = self._read_manifest()
+                if int(manifest.get('dim') or self.dim) != self.dim:
+                    raise ValueError(f"Index at {self.path} has dim {manifest.get('dim')} != {self.dim}")
+                entries = manifest.get('segments') or []
+                loaded = [seg.name for seg in self._segments]
+                try:
+                    if [e['name'] for e in entries[:len(loaded)]] == loaded:
+                        for entry in entries[len(loaded):]:
+                            seg = self._open(entry)
+                            self._apply(seg, self._where)
+                            self._segments.append(seg)
+                    else:
+                        # Merged or rebuilt: keep the segments still listed, re-derive which rows are live
+                        known = {seg.name: seg for seg in self._segments}
+                        segments: List[_Segment] = []
+                        where: Dict[str, tuple] = {}
+                        for entry in entries:
+                            seg = known[entry['name']].fresh() if entry['name'] in known else self._open(entry)
+                            self._apply(seg, where)
+                            segments.append(seg)
+                        self._segments, self._where = segments, where
+                except FileNotFoundError:
+                    # Compacted away between reading the manifest and opening it; re-read
+                    self._segments, self._where, self._signature = [], {}, None
+                    continue
+                self._built_at = float(manifest.get('built_at') or 0.0)
+                self._signature = sig
+                return
+
+    def _open(self, entry: dict) -> _Segment:
+        return _Segment(self.path, entry['name'], int(entry['rows']), self.dim)
+
+    @staticmethod
+    def _apply(seg: _Segment, where: Dict[str, tuple]) -> None:
+        """Lay seg over the segments already in `where`, marking the rows it supersedes."""
+        for point_id in seg.deleted:
+            prev = where.pop(point_id, None)
+            if prev is not None:
+                prev[0].live[prev[1]] = False
+        for row, point_id in enumerate(seg.ids):
+            prev = where.pop(point_id, None)
+            if prev is not None:
+                prev[0].live[prev[1]] = False
+            where[point_id] = (seg, row)
+
+    @staticmethod
+    def _live_items(segments: List[_Segment]) -> Iterator[tuple]:
+        for seg in segments:
+            for row in np.flatnonzero(seg.live):
+                yield seg.ids[row], seg.vectors[row], seg.payloads[row]
+
+    def search(
+        self,
+        query_vector: List[float],
+        top_k: int = 10,
+        building: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        return self.search_batch([query_vector], top_k=top_k, building=building, date_from=date_from, date_to=date_to)[0]
+
+    def search_batch(
+        self,
+        query_vectors: List[List[float]],
+        top_k: int = 10,
+        building: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """One result list per query; each segment is scored for all queries in one product."""
+        self.refresh()
+        queries = normalize_rows(np.asarray(query_vectors, dtype=np.float32).reshape(-1, self.dim))
+        k = max(1, int(top_k))
+        ymd_from, ymd_to = ymd_bound(date_from), ymd_bound(date_to)
+        with self._lock:
+            segments = list(self._segments)
+        candidates: List[list] = [[] for _ in range(queries.shape[0])]
+        for seg in segments:
+            if not seg.ids:
+                continue
+            mask = seg.live.copy()
+            if building:
+                mask &= seg.building == seg.labels.find(building)
+            if ymd_from is not None:
+                mask &= seg.ymd >= ymd_from
+            if ymd_to is not None:
+                mask &= seg.ymd <= ymd_to
+            if not mask.any():
+                continue
+            scores = np.where(mask[None, :], np.asarray(queries @ seg.vectors.T), -np.inf)
+            for found, row_scores in zip(candidates, scores):
+                for row in top_k_indices(row_scores, k):
+                    found.append((float(row_scores[row]), seg, int(row)))
+        out = []
+        for found in candidates:
+            found.sort(key=lambda c: -c[0])
+            out.append([{"id": seg.ids[row], "score": score, **seg.payloads[row]} for score, seg, row in found[:k]])
+        return out
+
+    # -- writing -------------------------------------------------------
+
+    @contextmanager
+    def _flock(self, name: str, mode: int):
+        with open(os.path.join(self.path, name), 'a+') as fh:
+            fcntl.flock(fh, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _writer(self):
+        """The manifest lock; held only to append a segment or swap segments in."""
+        return self._flock('.lock', fcntl.LOCK_EX)
+
+    def _atomic_write(self, name: str, data: bytes) -> None:
+        tmp = os.path.join(self.path, f".{name}.{os.getpid()}.tmp")
+        with open(tmp, 'wb') as fh:
+            fh.write(data)
+        os.replace(tmp, os.path.join(self.path, name))
+
+    def _write_segment(self, name: str, items: Iterable[tuple], deleted: Iterable[str] = ()) -> dict:
+        ids: List[str] = []
+        building: List[Optional[str]] = []
+        payloads: List[Dict[str, Any]] = []
+        ymd: List[int] = []
+        tmp = os.path.join(self.path, f".{name}.f32.{os.getpid()}.tmp")
+        with open(tmp, 'wb') as fh:
+            # Streamed in chunks so a rebuild never holds the whole matrix in memory
+            chunk: List[Any] = []
+            for point_id, vector, payload in items:
+                meta = {k: v for k, v in (payload or {}).items() if k != 'embedding'}
+                ids.append(str(point_id))
+                building.append(meta.get('building'))
+                payloads.append(meta)
+                ymd.append(ymd_bound(meta.get('shot_ymd')) or 0)
+                chunk.append(vector)
+                if len(chunk) >= 1024:
+                    fh.write(normalize_rows(np.asarray(chunk, dtype=np.float32).reshape(len(chunk), self.dim)).tobytes())
+                    chunk = []
+            if chunk:
+                fh.write(normalize_rows(np.asarray(chunk, dtype=np.float32).reshape(len(chunk), self.dim)).tobytes())
+        os.replace(tmp, os.path.join(self.path, name + '.f32'))
+        self._atomic_write(name + '.ymd', np.asarray(ymd, dtype=np.int32).tobytes())
+        deleted = [str(i) for i in deleted]
+        meta = {"ids": ids, "building": building, "payloads": payloads, "deleted": deleted}
+        self._atomic_write(name + '.meta.json', json.dumps(meta, default=str).encode('utf-8'))
+        return {"name": name, "rows": len(ids), "deletes": len(deleted)}
+
+    def _remove_segments(self, names: Iterable[str]) -> None:
+        # Readers that still map a removed segment keep it alive until they unmap it
+        for name in names:
+            for ext in ('.f32', '.ymd', '.meta.json'):
+                try:
+                    os.remove(os.path.join(self.path, name + ext))
+                except OSError:
+                    pass
+
+    def _publish(self, manifest: dict, drop: Iterable[str] = ()) -> None:
+        self._atomic_write(MANIFEST, json.dumps(manifest).encode('utf-8'))
+        self._remove_segments(drop)
+
+    def _append(self, items: List[tuple], deleted: Iterable[str] = ()) -> None:
+        with self._writer():
+            manifest = self._read_manifest()
+            seq = int(manifest.get('seq') or 0) + 1
+            manifest['dim'] = self.dim
+            manifest['seq'] = seq
+            manifest.setdefault('segments', []).append(self._write_segment(f"seg-{seq:08d}", items, deleted))
+            self._publish(manifest)
+        self.refresh()
+        with self._lock:
+            due = self._pick_run(self._segments) is not None
+        if due and not self._merging.locked():
+            threading.Thread(target=self._merge_tiers, name='mmap-index-merge', daemon=True).start()
+
+    def _swap(self, replaced: List[str], entries: List[dict], built_at: Optional[float] = None) -> bool:
+        """Replace the consecutive segments `replaced` with `entries` in the manifest.
+        False (and the new files removed) when the manifest no longer lists them."""
+        with self._writer():
+            manifest = self._read_manifest()
+            current = manifest.get('segments') or []
+            names = [e['name'] for e in current]
+            n = len(replaced)
+            at = next((i for i in range(len(names) - n + 1) if names[i:i + n] == replaced), None)
+            if at is None:
+                self._remove_segments(e['name'] for e in entries)
+                return False
+            manifest['dim'] = self.dim
+            manifest['segments'] = current[:at] + entries + current[at + n:]
+            if built_at is not None:
+                manifest['built_at'] = built_at
+            self._publish(manifest, drop=replaced)
+        return True
+
+    def _pick_run(self, segments: List[_Segment]) -> Optional[tuple]:
+        """(start, stop) of merge_factor neighbouring segments in the same size tier, oldest first."""
+        tiers = []
+        for seg in segments:
+            weight, tier = max(1, seg.weight), 0
+            while weight >= self.merge_factor:
+                weight //= self.merge_factor
+                tier += 1
+            tiers.append(tier)
+        start = 0
+        while start < len(tiers):
+            stop = start
+            while stop < len(tiers) and tiers[stop] == tiers[start]:
+                stop += 1
+            if stop - start >= self.merge_factor:
+                return start, start + self.merge_factor
+            start = stop
+        return None
+
+    def _merge(self, segments: List[_Segment], start: int, stop: int) -> bool:
+        """Write segments[start:stop] as one segment (no manifest lock) and swap it in.
+        Rows superseded by any later segment are dropped; deletes are kept unless
+        nothing older remains for them to apply to."""
+        picked = segments[start:stop]
+        deleted = sorted({point_id for seg in picked for point_id in seg.deleted}) if start else []
+        entry = self._write_segment(f"seg-m{uuid.uuid4().hex}", self._live_items(picked), deleted)
+        return self._swap([seg.name for seg in picked], [entry])
+
+    def _merge_tiers(self) -> None:
+        """Background merge loop; one per host, other processes skip while it runs."""
+        if not self._merging.acquire(blocking=False):
+            return
+        try:
+            with self._flock('.merge.lock', fcntl.LOCK_EX | fcntl.LOCK_NB):
+                while True:
+                    self.refresh()
+                    with self._lock:
+                        segments = list(self._segments)
+                    run = self._pick_run(segments)
+                    if run is None:
+                        return
+                    self._merge(segments, *run)
+        except BlockingIOError:
+            pass
+        finally:
+            self._merging.release()
+
+    def compact(self) -> None:
+        """Merge every segment into one; writes wait only for the manifest swap."""
+        with self._flock('.merge.lock', fcntl.LOCK_EX):
+            self.refresh()
+            with self._lock:
+                segments = list(self._segments)
+            if len(segments) > 1:
+                self._merge(segments, 0, len(segments))
+        self.refresh()
+
+    def upsert(self, point_id: str, vector: List[float], payload: Optional[Dict[str, Any]] = None) -> None:
+        self._append([(point_id, vector, payload)])
+
+    def upsert_many(self, items: Iterable[tuple]) -> None:
+        items = list(items)
+        if items:
+            self._append(items)
+
+    def delete(self, ids: Iterable[str]) -> None:
+        ids = [str(i) for i in ids]
+        if ids:
+            self._append([], deleted=ids)
+
+    def clear(self) -> None:
+        self.rebuild([], stale_before=float('inf'))
+
+    def rebuild(self, items: Iterable[tuple], stale_before: Optional[float] = None) -> None:
+        """Replace the index with items ((id, vector, payload) tuples). Skipped when
+        another process built it after stale_before while we waited.
+
+        The new segment is written without the manifest lock, so writes carry on
+        during the scan; segments they publish meanwhile stay on top of it. The
+        merge lock keeps a single rebuild per host and pauses merges until the
+        swap.
+        """
+        with self._flock('.merge.lock', fcntl.LOCK_EX):
+            manifest = self._read_manifest()
+            built_at = float(manifest.get('built_at') or 0.0)
+            if built_at and (stale_before is None or built_at >= stale_before):
+                self.refresh()
+                return
+            replaced = [e['name'] for e in manifest.get('segments') or []]
+            entry = self._write_segment(f"seg-b{uuid.uuid4().hex}", items)
+            self._swap(replaced, [entry], built_at=time.time())
+        self.refresh()
@@ -4,6 +4,7 @@ import os
 from opensearchpy import OpenSearch, RequestsHttpConnection
 from requests_aws4auth import AWS4Auth
 import boto3
+from .fusion import finish_batch
 
 class VectorStore:
 	def __init__(self, api_key: str = '', environment: Optional[str] = None, index_name: str = 'media-embeddings', dim: int = 1536, host: Optional[str] = None):
@@ -128,6 +129,43 @@ class VectorStore:
 		date_to: Optional[str] = None,
 		namespace: Optional[str] = None,
 	) -> List[Dict[str, Any]]:
+		res = self.client.search(index=self.index_name, body=self._knn_body(query_vector, top_k, building, date_from, date_to))
+		return self._hits(res)
+
+	def search_batch(
+		self,
+		query_vectors: List[List[float]],
+		top_k: int = 10,
+		building: Optional[str] = None,
+		date_from: Optional[str] = None,
+		date_to: Optional[str] = None,
+		namespace: Optional[str] = None,
+		fuse: Optional[str] = None,
+	):
+		"""All queries in one _msearch round trip; one result list per query, or a
+		single list fused by 'max' or 'rrf' when `fuse` is given."""
+		if not query_vectors:
+			return finish_batch([], top_k, fuse)
+		lines: List[Dict[str, Any]] = []
+		for q in query_vectors:
+			lines.append({"index": self.index_name})
+			lines.append(self._knn_body(q, top_k, building, date_from, date_to))
+		res = self.client.msearch(body=lines)
+		results = []
+		for r in res.get('responses', []):
+			if r.get('error'):
+				raise RuntimeError(f"OpenSearch msearch failed: {r['error']}")
+			results.append(self._hits(r))
+		return finish_batch(results, top_k, fuse)
+
+	def _knn_body(
+		self,
+		query_vector: List[float],
+		top_k: int,
+		building: Optional[str],
+		date_from: Optional[str],
+		date_to: Optional[str],
+	) -> Dict[str, Any]:
 		filters: Dict[str, Any] = {}
 		must: List[Any] = []
 		if building:
@@ -159,8 +197,9 @@ class VectorStore:
 		else:
 			query_obj = {"knn": {"embedding": {"vector": query_vector, "k": top_k}}}
 
-		body: Dict[str, Any] = {"size": top_k, "query": query_obj}
-		res = self.client.search(index=self.index_name, body=body)
+		return {"size": top_k, "query": query_obj}
+
+	def _hits(self, res: Dict[str, Any]) -> List[Dict[str, Any]]:
 		hits = res.get('hits', {}).get('hits', [])
 		out: List[Dict[str, Any]] = []
 		for h in hits:
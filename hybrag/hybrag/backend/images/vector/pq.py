@@ -0,0 +1,299 @@
+from __future__ import annotations
+from typing import Any, Callable, Dict, Iterable, List, Optional
+import json
+import os
+import threading
+import zlib
+import numpy as np
+from .exact_index import LabelCodes, normalize_rows, top_k_indices, ymd_bound
+from .kmeans import assign, kmeans
+from .local_store import LocalIndexStore
+
+KSUB = 256  # centroids per sub-space, so each code is one uint8
+ADC_CHUNK = 65536  # rows scored per step, bounding the gathered codes and temporaries
+
+
+def default_subspaces(dim: int, dsub: int = 8) -> int:
+    """Largest M <= dim / dsub that divides dim (1536 -> 192, i.e. 192 bytes per vector)."""
+    m = max(1, dim // max(1, dsub))
+    while dim % m:
+        m -= 1
+    return m
+
+
+class ProductQuantizer:
+    """Splits a vector into m sub-vectors and replaces each by the index of its
+    nearest centroid in a per-sub-space codebook of 256 entries (plain L2 k-means).
+    """
+
+    def __init__(self, dim: int, m: int, codebooks: Optional[np.ndarray] = None):
+        if dim % m:
+            raise ValueError(f"dim {dim} is not divisible by m={m}")
+        self.dim = int(dim)
+        self.m = int(m)
+        self.dsub = self.dim // self.m
+        self.codebooks = codebooks  # (m, KSUB, dsub) float32
+
+    def train(self, x: np.ndarray, iters: int = 20, seed: int = 0) -> None:
+        x = np.ascontiguousarray(x, dtype=np.float32).reshape(-1, self.m, self.dsub)
+        books = np.zeros((self.m, KSUB, self.dsub), dtype=np.float32)
+        for j in range(self.m):
+            c = kmeans(x[:, j, :], KSUB, iters=iters, seed=seed + j)
+            books[j, :len(c)] = c
+            # Fewer training points than KSUB: pad with copies, which assign() never prefers
+            books[j, len(c):] = c[0]
+        self.codebooks = books
+
+    def encode(self, x: np.ndarray) -> np.ndarray:
+        x = np.asarray(x, dtype=np.float32).reshape(-1, self.m, self.dsub)
+        codes = np.empty((x.shape[0], self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codes[:, j] = assign(np.ascontiguousarray(x[:, j, :]), self.codebooks[j])[0]
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return self.codebooks[np.arange(self.m), codes].reshape(codes.shape[0], self.dim)
+
+    def tables(self, q: np.ndarray) -> np.ndarray:
+        """(m, KSUB) inner products of each query sub-vector with its codebook."""
+        return np.einsum('jkd,jd->jk', self.codebooks, q.reshape(self.m, self.dsub))
+
+    def adc(self, table: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Asymmetric distance: the raw query against the encoded rows, as summed table
+        lookups. One sub-space at a time, so the only temporary is one float per row."""
+        scores = np.zeros(codes.shape[0], dtype=np.float32)
+        for j in range(self.m):
+            scores += table[j, codes[:, j]]
+        return scores
+
+
+class PQIndex:
+    """Compressed in-memory index: only m uint8 codes per vector are held
+    (192 bytes for 1536 dims, 32x less than float32), queried with ADC tables
+    over unit-normalized vectors so the score approximates cosine similarity.
+
+    When `fetch` is set (ids -> {id: full vector}), the best top_k * rerank
+    candidates are rescored exactly with vectors from the backing store.
+    Until the quantizer is trained, rows are kept uncompressed and scanned
+    exactly; training happens once `train_size` of them have accumulated.
+    """
+
+    def __init__(self, dim: int, m: Optional[int] = None, rerank: int = 4, train_size: int = 20000, quantizer: Optional[ProductQuantizer] = None):
+        self.dim = int(dim)
+        self.train_size = max(1, int(train_size))
+        self.pq = quantizer or ProductQuantizer(self.dim, int(m or default_subspaces(self.dim)))
+        self.m = self.pq.m
+        self.rerank = max(0, int(rerank))
+        self.fetch: Optional[Callable[[List[str]], Dict[str, np.ndarray]]] = None
+        self._codes = np.zeros((1024, self.m), dtype=np.uint8)
+        self._ymd = np.zeros(1024, dtype=np.int32)
+        self._deleted = np.zeros(1024, dtype=bool)
+        self._building = np.zeros(1024, dtype=np.int32)
+        self._labels = LabelCodes()
+        self._raw: Dict[int, np.ndarray] = {}
+        self._ids: List[str] = []
+        self._payloads: List[Dict[str, Any]] = []
+        self._node: Dict[str, int] = {}
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._node)
+
+    @property
+    def trained(self) -> bool:
+        return self.pq.codebooks is not None
+
+    def memory_bytes(self) -> int:
+        """Bytes held for vectors: codes plus codebooks (and any not-yet-encoded rows).
+        Ids, building and payloads are Python objects per row and not counted; at
+        192 bytes of codes per row they usually take more than the codes do."""
+        books = self.pq.codebooks.nbytes if self.trained else 0
+        return len(self._ids) * self.m + books + len(self._raw) * self.dim * 4
+
+    def _grow(self, need: int) -> None:
+        cap = self._codes.shape[0]
+        if need <= cap:
+            return
+        while cap < need:
+            cap *= 2
+        n = len(self._ids)
+        for name in ('_codes', '_ymd', '_deleted', '_building'):
+            old = getattr(self, name)
+            new = np.zeros((cap,) + old.shape[1:], dtype=old.dtype)
+            new[:n] = old[:n]
+            setattr(self, name, new)
+
+    def train(self, iters: int = 20, seed: int = 0) -> None:
+        """Fit the codebooks on the rows held uncompressed, then encode them."""
+        with self._lock:
+            if not self._raw:
+                return
+            rows = np.fromiter(self._raw.keys(), dtype=np.int64, count=len(self._raw))
+            raw = np.stack([self._raw[r] for r in rows.tolist()])
+            self.pq.train(raw, iters=iters, seed=seed)
+            self._codes[rows] = self.pq.encode(raw)
+            self._raw.clear()
+
+    def upsert_many(self, items: Iterable[tuple]) -> None:
+        items = list(items)
+        if not items:
+            return
+        vecs = normalize_rows(np.asarray([v for _, v, _ in items], dtype=np.float32).reshape(len(items), self.dim))
+        codes = self.pq.encode(vecs) if self.trained else None
+        with self._lock:
+            if codes is None and self.trained:
+                codes = self.pq.encode(vecs)
+            self._grow(len(self._ids) + len(items))
+            for i, (point_id, _, payload) in enumerate(items):
+                point_id = str(point_id)
+                old = self._node.get(point_id)
+                if old is not None:
+                    self._deleted[old] = True
+                    self._raw.pop(old, None)
+                meta = {k: v for k, v in (payload or {}).items() if k != 'embedding'}
+                row = len(self._ids)
+                if codes is not None:
+                    self._codes[row] = codes[i]
+                else:
+                    self._raw[row] = vecs[i]
+                self._ymd[row] = ymd_bound(meta.get('shot_ymd')) or 0
+                self._deleted[row] = False
+                self._building[row] = self._labels.code(meta.get('building'))
+                self._ids.append(point_id)
+                self._payloads.append(meta)
+                self._node[point_id] = row
+            if not self.trained and len(self._raw) >= self.train_size:
+                self.train()
+
+    def delete(self, ids: Iterable[str]) -> None:
+        with self._lock:
+            for point_id in ids:
+                row = self._node.pop(str(point_id), None)
+                if row is not None:
+                    self._deleted[row] = True
+                    self._raw.pop(row, None)
+
+    def search(
+        self,
+        query_vector: List[float],
+        top_k: int = 10,
+        building: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        rerank: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        q = normalize_rows(np.asarray(query_vector, dtype=np.float32).reshape(self.dim))
+        k = max(1, int(top_k))
+        rerank = self.rerank if rerank is None else max(0, int(rerank))
+        with self._lock:
+            n = len(self._ids)
+            if not self._node:
+                return []
+            mask = ~self._deleted[:n]
+            if building:
+                mask &= self._building[:n] == self._labels.find(building)
+            ymd_from, ymd_to = ymd_bound(date_from), ymd_bound(date_to)
+            if ymd_from is not None:
+                mask &= self._ymd[:n] >= ymd_from
+            if ymd_to is not None:
+                mask &= self._ymd[:n] <= ymd_to
+            rows = np.flatnonzero(mask)
+            if not self.trained:
+                scores = np.stack([self._raw[r] for r in rows.tolist()]) @ q if rows.size else np.zeros(0, dtype=np.float32)
+                return [{"id": self._ids[rows[i]], "score": float(scores[i]), **self._payloads[rows[i]]} for i in top_k_indices(scores, k)]
+            table = self.pq.tables(q).astype(np.float32)
+            scores = np.empty(rows.size, dtype=np.float32)
+            for start in range(0, rows.size, ADC_CHUNK):
+                chunk = rows[start:start + ADC_CHUNK]
+                scores[start:start + chunk.size] = self.pq.adc(table, self._codes[chunk])
+            fetch = self.fetch if rerank else None
+            best = top_k_indices(scores, k * rerank if fetch else k)
+            cand = rows[best]
+            cand_scores = scores[best].astype(np.float32)
+            cand_ids = [self._ids[r] for r in cand.tolist()]
+            payloads = [self._payloads[r] for r in cand.tolist()]
+        if fetch is not None and len(cand_ids):
+            # Candidates the backing store cannot return keep their approximate score
+            full = fetch(cand_ids)
+            for i, point_id in enumerate(cand_ids):
+                vec = full.get(point_id)
+                if vec is not None and len(vec) == self.dim:
+                    cand_scores[i] = float(normalize_rows(np.asarray(vec, dtype=np.float32)) @ q)
+            order = top_k_indices(cand_scores, k)
+        else:
+            order = np.arange(len(cand_ids))
+        return [{"id": cand_ids[i], "score": float(cand_scores[i]), **payloads[i]} for i in order]
+
+    @classmethod
+    def from_blocks(cls, dim: int, blocks: Iterable[tuple], m: Optional[int] = None, rerank: int = 4, train_size: int = 20000) -> 'PQIndex':
+        """Codebooks are trained on the first `train_size` rows (or all of a smaller
+        store); rows after that are encoded on arrival, so memory stays bounded."""
+        idx = cls(dim, m=m, rerank=rerank, train_size=train_size)
+        for ids, vectors, payloads in blocks:
+            idx.upsert_many(zip(ids, vectors, payloads))
+        idx.train()
+        return idx
+
+    def save(self, path: str) -> None:
+        with self._lock:
+            n = len(self._ids)
+            raw_rows = np.fromiter(self._raw.keys(), dtype=np.int64, count=len(self._raw))
+            meta = zlib.compress(json.dumps({
+                "ids": self._ids,
+                "building": self._labels.decode(self._building[:n]),
+                "payloads": self._payloads,
+                "m": self.m,
+                "rerank": self.rerank,
+                "train_size": self.train_size,
+            }, default=str).encode('utf-8'))
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, 'wb') as fh:
+                np.savez(
+                    fh,
+                    codes=self._codes[:n],
+                    ymd=self._ymd[:n],
+                    deleted=self._deleted[:n],
+                    codebooks=self.pq.codebooks if self.trained else np.zeros((0, KSUB, self.pq.dsub), dtype=np.float32),
+                    raw_rows=raw_rows,
+                    raw=np.stack([self._raw[r] for r in raw_rows.tolist()]) if raw_rows.size else np.zeros((0, self.dim), dtype=np.float32),
+                    meta=np.frombuffer(meta, dtype=np.uint8),
+                )
+            os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'PQIndex':
+        with np.load(path) as data:
+            meta = json.loads(zlib.decompress(data['meta'].tobytes()))
+            codebooks = data['codebooks']
+            m = int(meta['m'])
+            dim = int(codebooks.shape[2]) * m if len(codebooks) else int(data['raw'].shape[1])
+            idx = cls(dim, rerank=meta['rerank'], train_size=meta['train_size'], quantizer=ProductQuantizer(dim, m, codebooks if len(codebooks) else None))
+            n = data['codes'].shape[0]
+            idx._grow(n)
+            idx._codes[:n] = data['codes']
+            idx._ymd[:n] = data['ymd']
+            idx._deleted[:n] = data['deleted']
+            idx._raw = {int(r): v for r, v in zip(data['raw_rows'], data['raw'])}
+        idx._ids = meta['ids']
+        idx._building[:len(idx._ids)] = idx._labels.encode(meta['building'])
+        idx._payloads = meta['payloads']
+        idx._node = {pid: row for row, pid in enumerate(idx._ids) if not idx._deleted[row]}
+        return idx
+
+
+class PQVectorStore(LocalIndexStore):
+    """LocalIndexStore backed by a PQIndex; candidates are reranked with full vectors
+    from source.fetch_vectors when the source provides it. search(..., rerank=0)
+    skips the rerank for one call."""
+
+    index_cls = PQIndex
+
+    def __init__(self, path: str, dim: int = 1536, source=None, m: Optional[int] = None, rerank: int = 4, save_every: int = 500):
+        self.rerank = int(rerank)
+        super().__init__(path, dim=dim, source=source, save_every=save_every, m=m, rerank=rerank)
+
+    def _configure(self, index: PQIndex) -> PQIndex:
+        index.rerank = self.rerank
+        source = self.__dict__.get('source')
+        index.fetch = getattr(source, 'fetch_vectors', None) if source is not None else None
+        return index
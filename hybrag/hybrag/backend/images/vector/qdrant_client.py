@@ -1,9 +1,13 @@
 from __future__ import annotations
 from typing import List, Optional, Dict, Any
 from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, Filter, FieldCondition, MatchValue, Range
+from qdrant_client.models import Distance, VectorParams, Filter, FieldCondition, MatchValue, Range, SearchRequest
+from .fusion import finish_batch
 
 class VectorStore:
+	"""Qdrant collection store. `namespace` is accepted for parity with the other
+	stores and ignored: Qdrant separates data by collection."""
+
 	def __init__(self, host: str, port: int, collection: str, dim: int, url: Optional[str] = None, api_key: Optional[str] = None):
 		if url:
 			self.client = QdrantClient(url=url, api_key=api_key)
@@ -21,7 +25,7 @@ class VectorStore:
 				vectors_config=VectorParams(size=self.dim, distance=Distance.COSINE),
 			)
 
-	def upsert(self, point_id: str, vector: List[float], payload: Dict[str, Any]) -> None:
+	def upsert(self, point_id: str, vector: List[float], payload: Dict[str, Any], namespace: Optional[str] = None) -> None:
 		self.client.upsert(
 			collection_name=self.collection,
 			points=[{"id": point_id, "vector": vector, "payload": payload}],
@@ -34,7 +38,45 @@ class VectorStore:
 		building: Optional[str] = None,
 		date_from: Optional[str] = None,
 		date_to: Optional[str] = None,
+		namespace: Optional[str] = None,
 	) -> List[Dict[str, Any]]:
+		res = self.client.search(
+			collection_name=self.collection,
+			query_vector=query_vector,
+			limit=top_k,
+			query_filter=self._filter(building, date_from, date_to),
+		)
+		return [
+			{"id": str(p.id), "score": float(p.score), **(p.payload or {})}
+			for p in res
+		]
+
+	def search_batch(
+		self,
+		query_vectors: List[List[float]],
+		top_k: int = 10,
+		building: Optional[str] = None,
+		date_from: Optional[str] = None,
+		date_to: Optional[str] = None,
+		namespace: Optional[str] = None,
+		fuse: Optional[str] = None,
+	):
+		"""All queries in one search_batch request; one result list per query, or a
+		single list fused by 'max' or 'rrf' when `fuse` is given."""
+		if not query_vectors:
+			return finish_batch([], top_k, fuse)
+		flt = self._filter(building, date_from, date_to)
+		res = self.client.search_batch(
+			collection_name=self.collection,
+			requests=[SearchRequest(vector=q, filter=flt, limit=top_k, with_payload=True) for q in query_vectors],
+		)
+		results = [
+			[{"id": str(p.id), "score": float(p.score), **(p.payload or {})} for p in points]
+			for points in res
+		]
+		return finish_batch(results, top_k, fuse)
+
+	def _filter(self, building: Optional[str], date_from: Optional[str], date_to: Optional[str]) -> Optional[Filter]:
 		conditions: List[Any] = []
 		if building:
 			conditions.append(FieldCondition(key="building", match=MatchValue(value=building)))
@@ -49,14 +91,4 @@ class VectorStore:
 			except Exception:
 				pass
 
-		flt = Filter(must=conditions) if conditions else None
-		res = self.client.search(
-			collection_name=self.collection,
-			query_vector=query_vector,
-			limit=top_k,
-			query_filter=flt,
-		)
-		return [
-			{"id": str(p.id), "score": float(p.score), **(p.payload or {})}
-			for p in res
-		]
+		return Filter(must=conditions) if conditions else None
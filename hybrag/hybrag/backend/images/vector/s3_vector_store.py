@@ -1,28 +1,30 @@
 from __future__ import annotations
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Callable, Iterable, Iterator, Set, Tuple
 import os
 import json
-import math
+import heapq
+import queue
+import random
+import threading
+import time
+import uuid
 import boto3
+import numpy as np
 from botocore.config import Config
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
 from botocore.exceptions import ClientError
+from .exact_index import ExactVectorIndex, normalize_rows, top_k_indices, ymd_bound
+from .fusion import finish_batch
+from .mmap_index import MmapVectorIndex
+from .segments import decode_meta, decode_vectors, encode_segment, row_runs, DTYPES
 
-
-def _cosine(a: List[float], b: List[float]) -> float:
-    if not a or not b or len(a) != len(b):
-        return -1.0
-    dot = 0.0
-    na = 0.0
-    nb = 0.0
-    for i in range(len(a)):
-        va = float(a[i])
-        vb = float(b[i])
-        dot += va * vb
-        na += va * va
-        nb += vb * vb
-    if na == 0 or nb == 0:
-        return -1.0
-    return dot / (math.sqrt(na) * math.sqrt(nb))
+# Error codes that mean "slow down", retried with backoff by bulk writers
+THROTTLE_CODES = {
+    'ThrottlingException', 'TooManyRequestsException', 'SlowDown', 'RequestLimitExceeded',
+    'ServiceUnavailableException', 'ServiceUnavailable', 'RequestTimeout', 'InternalError',
+}
 
 
 class S3VectorStore:
@@ -33,11 +35,15 @@ class S3VectorStore:
         self.index = index_name or os.getenv('VECTOR_S3_INDEX', 'images')
         self.dim = int(dim)
         self.prefix = (prefix or os.getenv('VECTOR_S3_PREFIX') or 'vectors/').strip('/')
+        # Concurrent GETs for legacy scans; also sizes the client's connection pool
+        self.scan_concurrency = max(1, int(os.getenv('VECTOR_S3_SCAN_CONCURRENCY', '32')))
+        self._scan_pool: Optional[ThreadPoolExecutor] = None
+        self._scan_pool_lock = threading.Lock()
         # Enable strict vector-bucket behavior when set
         self.vector_mode = os.getenv('VECTOR_S3_IS_VECTOR_BUCKET', '0') == '1'
         # Prefer explicit vector bucket region override, then fall back to general AWS region
         region_name = region or os.getenv('VECTOR_S3_REGION') or os.getenv('AWS_REGION') or 'eu-north-1'
-        self.s3 = boto3.client('s3', config=Config(region_name=region_name, retries={"max_attempts": 3, "mode": "standard"}))
+        self.s3 = boto3.client('s3', config=Config(region_name=region_name, retries={"max_attempts": 3, "mode": "standard"}, max_pool_connections=self.scan_concurrency + 4))
         # Detect actual bucket region and reinitialize client if needed
         bucket_region = None
         try:
@@ -48,7 +54,7 @@ class S3VectorStore:
             if not bucket_region:
                 bucket_region = 'us-east-1'
             if bucket_region and bucket_region != region_name:
-                self.s3 = boto3.client('s3', config=Config(region_name=bucket_region, retries={"max_attempts": 3, "mode": "standard"}))
+                self.s3 = boto3.client('s3', config=Config(region_name=bucket_region, retries={"max_attempts": 3, "mode": "standard"}, max_pool_connections=self.scan_concurrency + 4))
         except ClientError as e:
             code = (e.response or {}).get('Error', {}).get('Code')
             if code == 'NoSuchBucket' and os.getenv('VECTOR_S3_CREATE', '0') == '1':
@@ -67,10 +73,448 @@ class S3VectorStore:
                     f"s3vectors client unavailable. Ensure boto3/botocore support S3 Vectors and region is correct. Original: {e}"
                 ) from e
             self.s3vectors = None
+        # When set, the legacy fallback index lives on disk here and is memory-mapped by
+        # every worker on the host, so writes made by any of them are visible at once
+        self.local_index_path = os.getenv('VECTOR_S3_LOCAL_INDEX_PATH', '')
+        # Exact index over the legacy JSON layout, loaded on first fallback search. On by
+        # default only when shared: a per-process copy misses other workers' writes until
+        # the TTL, and the search cache would keep serving what it returned
+        self.local_index_enabled = os.getenv('VECTOR_S3_LOCAL_INDEX', '1' if self.local_index_path else '0') == '1'
+        # Reload interval so writes made by other hosts/processes become visible (0 = never)
+        self.local_index_ttl = float(os.getenv('VECTOR_S3_LOCAL_INDEX_TTL', '300'))
+        self._local_index = None
+        self._local_index_lock = threading.RLock()
+        # Push the shot_ymd range into query_vectors filters (cleared if the index rejects it)
+        self.date_pushdown = os.getenv('VECTOR_S3_DATE_PUSHDOWN', '1') == '1'
+        # Budget for the adaptive overfetch loop that tops up filtered queries
+        self.max_query_top_k = max(1, int(os.getenv('VECTOR_S3_MAX_TOP_K', '100')))
+        # Bulk writes: chunks in flight, vectors per put_vectors call, throttling retries
+        self.write_concurrency = max(1, int(os.getenv('VECTOR_S3_WRITE_CONCURRENCY', '8')))
+        self.put_batch_size = min(500, max(1, int(os.getenv('VECTOR_S3_PUT_BATCH', '200'))))
+        self.write_retries = max(1, int(os.getenv('VECTOR_S3_WRITE_RETRIES', '8')))
+        self.write_backoff = 0.1
+        self.write_backoff_max = 20.0
+        self._write_pause_until = 0.0
+        self._write_throttles = 0
+        self._write_lock = threading.Lock()
+        self._last_query = threading.local()
+        self._query_stats: Dict[str, Any] = {"queries": 0, "requested": 0, "fetched": 0, "rounds": 0, "short": 0, "max_overfetch_ratio": 0.0}
+        self._query_stats_lock = threading.Lock()
+        # (manifest created_at, {id: (segment entry, row)}) for fetch_vectors
+        self._segment_rows: Optional[Tuple[Any, Dict[str, Tuple[Dict[str, Any], int]]]] = None
 
     def _key_for_id(self, point_id: str) -> str:
         return f"{self.prefix}/{self.index}/{point_id}.json"
 
+    def _segment_root(self) -> str:
+        # Sibling of the per-id prefix so listing per-id objects never returns segments
+        return f"{self.prefix}/_segments/{self.index}"
+
+    def _list_keys(self, prefix: str) -> Iterator[Dict[str, Any]]:
+        token = None
+        while True:
+            try:
+                res = self.s3.list_objects_v2(Bucket=self.bucket, Prefix=prefix, ContinuationToken=token) if token else self.s3.list_objects_v2(Bucket=self.bucket, Prefix=prefix)
+            except ClientError as e:
+                code = (e.response or {}).get('Error', {}).get('Code')
+                if code == 'NoSuchBucket':
+                    return
+                raise
+            for obj in res.get('Contents') or []:
+                yield obj
+            if not res.get('IsTruncated'):
+                break
+            token = res.get('NextContinuationToken')
+
+    def _get_range(self, key: str, start: int, length: int) -> bytes:
+        return self.s3.get_object(Bucket=self.bucket, Key=key, Range=f"bytes={start}-{start + length - 1}")['Body'].read()
+
+    def segment_manifest(self) -> Optional[Dict[str, Any]]:
+        try:
+            raw = self.s3.get_object(Bucket=self.bucket, Key=f"{self._segment_root()}/manifest.json")['Body'].read()
+        except ClientError as e:
+            code = (e.response or {}).get('Error', {}).get('Code')
+            if code in ('NoSuchKey', '404', 'NoSuchBucket'):
+                return None
+            raise
+        return json.loads(raw)
+
+    def _tombstones(self) -> Set[str]:
+        """Ids deleted since their segment was written."""
+        prefix = f"{self._segment_root()}/deleted/"
+        return {obj['Key'][len(prefix):] for obj in self._list_keys(prefix)}
+
+    def _read_segment(self, entry: Dict[str, Any], skip: Set[str], building: Optional[str], ymd_from: Optional[int], ymd_to: Optional[int]):
+        key = f"{self._segment_root()}/{entry['name']}"
+        meta = decode_meta(self._get_range(key, entry['meta_offset'], entry['meta_length']))
+        ids = meta['id']
+        mask = np.fromiter((i not in skip for i in ids), dtype=bool, count=len(ids))
+        if building:
+            mask &= np.asarray(meta['building'], dtype=object) == building
+        ymd = np.asarray(meta['shot_ymd'], dtype=np.int64)
+        if ymd_from is not None:
+            mask &= ymd >= ymd_from
+        if ymd_to is not None:
+            mask &= ymd <= ymd_to
+        rows = np.flatnonzero(mask)
+        if not rows.size:
+            return None
+        payloads = meta['payload']
+        return [ids[r] for r in rows], self._read_rows(entry, rows), [payloads[r] for r in rows]
+
+    def _read_rows(self, entry: Dict[str, Any], rows: np.ndarray) -> np.ndarray:
+        """Vectors of the given (sorted) segment rows, fetched in coalesced ranges."""
+        key = f"{self._segment_root()}/{entry['name']}"
+        dim, dtype = int(entry['dim']), entry['dtype']
+        row_bytes = dim * np.dtype(DTYPES[dtype]).itemsize
+        parts = []
+        for start, stop in row_runs(rows, max_gap=max(1, (256 * 1024) // row_bytes)):
+            block = decode_vectors(self._get_range(key, entry['vectors_offset'] + start * row_bytes, (stop - start) * row_bytes), dtype, dim)
+            wanted = rows[(rows >= start) & (rows < stop)]
+            parts.append(block[wanted - start])
+        return np.concatenate(parts)
+
+    def _segment_locator(self, manifest: Dict[str, Any]) -> Dict[str, Tuple[Dict[str, Any], int]]:
+        cached = self._segment_rows
+        if cached is not None and cached[0] == manifest.get('created_at'):
+            return cached[1]
+        root = self._segment_root()
+        locator: Dict[str, Tuple[Dict[str, Any], int]] = {}
+        metas = self._pool().map(lambda e: decode_meta(self._get_range(f"{root}/{e['name']}", e['meta_offset'], e['meta_length'])), manifest.get('segments') or [])
+        for entry, meta in zip(manifest.get('segments') or [], metas):
+            for row, point_id in enumerate(meta['id']):
+                locator[str(point_id)] = (entry, row)
+        self._segment_rows = (manifest.get('created_at'), locator)
+        return locator
+
+    def fetch_vectors(self, ids: List[str]) -> Dict[str, np.ndarray]:
+        """Full-precision vectors by id (e.g. to rerank compressed-index candidates).
+
+        Ids that are not stored are left out of the result.
+        """
+        ids = [str(i) for i in ids]
+        out: Dict[str, np.ndarray] = {}
+        if self.vector_mode or self.s3vectors is not None:
+            try:
+                for i in range(0, len(ids), 100):
+                    res = self.s3vectors.get_vectors(vectorBucketName=self.bucket, indexName=self.index, keys=ids[i:i+100], returnData=True)
+                    for v in res.get('vectors') or []:
+                        data = (v.get('data') or {}).get('float32')
+                        if v.get('key') is not None and data:
+                            out[str(v['key'])] = np.asarray(data, dtype=np.float32)
+            except Exception:
+                if self.vector_mode:
+                    raise
+            if self.vector_mode:
+                return out
+        missing = [i for i in ids if i not in out]
+        if not missing:
+            return out
+
+        def one(point_id: str):
+            try:
+                doc = json.loads(self.s3.get_object(Bucket=self.bucket, Key=self._key_for_id(point_id))['Body'].read())
+            except ClientError as e:
+                if (e.response or {}).get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                    return None
+                raise
+            emb = doc.get('embedding')
+            return np.asarray(emb, dtype=np.float32) if isinstance(emb, list) and len(emb) == self.dim else None
+
+        for point_id, vec in zip(missing, self._pool().map(one, missing)):
+            if vec is not None:
+                out[point_id] = vec
+        missing = [i for i in missing if i not in out]
+        manifest = self.segment_manifest() if missing else None
+        if manifest and manifest.get('segments'):
+            locator = self._segment_locator(manifest)
+            by_segment: Dict[str, Tuple[Dict[str, Any], List[Tuple[int, str]]]] = {}
+            for point_id in missing:
+                hit = locator.get(point_id)
+                if hit is not None:
+                    by_segment.setdefault(hit[0]['name'], (hit[0], []))[1].append((hit[1], point_id))
+            jobs = [(entry, sorted(pairs)) for entry, pairs in by_segment.values()]
+            blocks = self._pool().map(lambda job: self._read_rows(job[0], np.asarray([r for r, _ in job[1]], dtype=np.int64)), jobs)
+            for (entry, pairs), block in zip(jobs, blocks):
+                for (_, point_id), vec in zip(pairs, block):
+                    out[point_id] = np.asarray(vec, dtype=np.float32)
+        return out
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._scan_pool is None:
+            with self._scan_pool_lock:
+                if self._scan_pool is None:
+                    self._scan_pool = ThreadPoolExecutor(max_workers=self.scan_concurrency, thread_name_prefix='s3-vector-scan')
+        return self._scan_pool
+
+    def _list_pages(self, prefix: str, out: queue.Queue, stop: threading.Event) -> None:
+        """Producer for scan_blocks: pushes each page of per-id keys, then None."""
+        def offer(item) -> None:
+            while not stop.is_set():
+                try:
+                    out.put(item, timeout=0.5)
+                    return
+                except queue.Full:
+                    continue
+        try:
+            page: List[str] = []
+            for obj in self._list_keys(prefix):
+                if obj['Key'].endswith('.json'):
+                    page.append(obj['Key'])
+                if len(page) >= 1000:
+                    offer(page)
+                    page = []
+                if stop.is_set():
+                    return
+            if page:
+                offer(page)
+        except Exception as e:
+            offer(e)
+        offer(None)
+
+    def _fetch_doc(self, key: str, building: Optional[str], ymd_from: Optional[int], ymd_to: Optional[int]):
+        b = self.s3.get_object(Bucket=self.bucket, Key=key)
+        try:
+            doc = json.loads(b['Body'].read())
+        except Exception:
+            return None
+        emb = doc.pop('embedding', None)
+        if not isinstance(emb, list) or len(emb) != self.dim:
+            return None
+        if building and doc.get('building') != building:
+            return None
+        ymd = ymd_bound(doc.get('shot_ymd')) or 0
+        if (ymd_from is not None and ymd < ymd_from) or (ymd_to is not None and ymd > ymd_to):
+            return None
+        return str(doc.get('id')), emb, doc
+
+    def scan_blocks(self, building: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None, block_size: int = 256) -> Iterator[Tuple[List[str], np.ndarray, List[Dict[str, Any]]]]:
+        """Yield (ids, float32 matrix, payloads) blocks of the legacy layout, in no
+        particular order. A per-id JSON object overrides the same id in a packed
+        segment; tombstoned segment rows are skipped.
+
+        Streaming: the next list page is fetched while the current one's objects are
+        downloaded on the shared pool, and segments are read once listing has
+        finished. Keys and segments are handed to the pool one at a time, so at most
+        2x scan_concurrency reads are outstanding.
+        """
+        ymd_from, ymd_to = ymd_bound(date_from), ymd_bound(date_to)
+        pool = self._pool()
+        manifest_f = pool.submit(self.segment_manifest)
+        tombstones_f = pool.submit(self._tombstones)
+        pages: queue.Queue = queue.Queue(maxsize=2)
+        stop = threading.Event()
+        threading.Thread(target=self._list_pages, args=(f"{self.prefix}/{self.index}/", pages, stop), name='s3-vector-list', daemon=True).start()
+        legacy_ids: Set[str] = set()
+        pending: Set[Any] = set()
+        segment_futures: Set[Any] = set()
+        # Listed keys (str) and manifest entries (dict) not yet submitted
+        todo: deque = deque()
+        skip: Set[str] = set()
+        limit = self.scan_concurrency * 2
+        listing = True
+        ids: List[str] = []
+        vecs: List[List[float]] = []
+        payloads: List[Dict[str, Any]] = []
+        try:
+            while listing or todo or pending:
+                while todo and len(pending) < limit:
+                    item = todo.popleft()
+                    if isinstance(item, dict):
+                        f = pool.submit(self._read_segment, item, skip, building, ymd_from, ymd_to)
+                        segment_futures.add(f)
+                    else:
+                        f = pool.submit(self._fetch_doc, item, building, ymd_from, ymd_to)
+                    pending.add(f)
+                if listing and not todo and len(pending) < limit:
+                    page = pages.get()
+                    if isinstance(page, Exception):
+                        raise page
+                    if page is None:
+                        listing = False
+                        manifest = manifest_f.result()
+                        if manifest and manifest.get('segments'):
+                            skip = tombstones_f.result() | legacy_ids
+                            todo.extend(manifest['segments'])
+                        continue
+                    for key in page:
+                        legacy_ids.add(key.rsplit('/', 1)[-1][:-len('.json')])
+                    todo.extend(page)
+                    continue
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for f in done:
+                    result = f.result()
+                    if result is None:
+                        continue
+                    if f in segment_futures:
+                        yield result
+                        continue
+                    point_id, emb, doc = result
+                    ids.append(point_id)
+                    vecs.append(emb)
+                    payloads.append(doc)
+                    if len(ids) >= block_size:
+                        yield ids, np.asarray(vecs, dtype=np.float32), payloads
+                        ids, vecs, payloads = [], [], []
+            if ids:
+                yield ids, np.asarray(vecs, dtype=np.float32), payloads
+        finally:
+            stop.set()
+            for f in pending:
+                f.cancel()
+
+    def scan(self) -> Iterator[Dict[str, Any]]:
+        """Yield every document of the legacy layout ({"id", ...payload, "embedding"})."""
+        for ids, vectors, payloads in self.scan_blocks():
+            for point_id, vec, payload in zip(ids, vectors, payloads):
+                yield {**payload, "id": point_id, "embedding": vec.tolist()}
+
+    def export_blocks(self, block_size: int = 500) -> Iterator[Tuple[List[str], np.ndarray, List[Dict[str, Any]]]]:
+        """Yield (ids, float32 matrix, payloads) blocks of every stored vector from the
+        backend searches are answered by: S3 Vectors (list_vectors with data and
+        metadata) when it is active, else the legacy layout via scan_blocks()."""
+        if self.vector_mode or self.s3vectors is not None:
+            pages = self._export_vector_pages(block_size)
+            try:
+                first = next(pages, None)
+            except Exception:
+                # Same rule as search(): only legacy mode may fall back
+                if self.vector_mode:
+                    raise
+            else:
+                if first is not None:
+                    yield first
+                    yield from pages
+                return
+        yield from self.scan_blocks(block_size=block_size)
+
+    def _export_vector_pages(self, block_size: int) -> Iterator[Tuple[List[str], np.ndarray, List[Dict[str, Any]]]]:
+        token: Optional[str] = None
+        while True:
+            kwargs: Dict[str, Any] = {"nextToken": token} if token else {}
+            resp = self.s3vectors.list_vectors(
+                vectorBucketName=self.bucket,
+                indexName=self.index,
+                maxResults=max(1, min(500, int(block_size))),
+                returnData=True,
+                returnMetadata=True,
+                **kwargs,
+            )
+            ids: List[str] = []
+            vecs: List[List[float]] = []
+            payloads: List[Dict[str, Any]] = []
+            for v in resp.get('vectors', []) or []:
+                if not isinstance(v, dict):
+                    continue
+                data = (v.get('data') or {}).get('float32')
+                if v.get('key') is None or data is None:
+                    continue
+                ids.append(str(v['key']))
+                vecs.append(data)
+                payloads.append(dict(v.get('metadata') or {}))
+            if ids:
+                yield ids, np.asarray(vecs, dtype=np.float32), payloads
+            token = resp.get('nextToken')
+            if not token:
+                return
+
+    def compact_segments(self, rows_per_segment: int = 4096, dtype: str = 'float32', delete_source: bool = False, grace_seconds: float = 3600) -> Dict[str, Any]:
+        """Rewrite the legacy layout (segments + per-id objects - tombstones) as a fresh
+        set of packed segments and publish a new manifest.
+
+        Segments the new manifest replaces are listed in it as retired rather than
+        deleted, since scans started from the old manifest still read them; a later
+        compaction deletes those retired more than grace_seconds earlier. With
+        delete_source, a per-id object is deleted only if its ETag and LastModified
+        still match the listing taken before the scan, so overwrites made while
+        compacting survive.
+        """
+        root = self._segment_root()
+        old = self.segment_manifest() or {}
+        legacy = {obj['Key']: obj for obj in self._list_keys(f"{self.prefix}/{self.index}/") if obj['Key'].endswith('.json')}
+        tombstones = self._tombstones()
+        run = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        entries: List[Dict[str, Any]] = []
+        buf_ids: List[str] = []
+        buf_vecs: List[np.ndarray] = []
+        buf_payloads: List[Dict[str, Any]] = []
+
+        def flush() -> None:
+            if not buf_ids:
+                return
+            body, layout = encode_segment(buf_ids, np.concatenate(buf_vecs), buf_payloads, dtype=dtype)
+            name = f"seg-{run}-{len(entries):05d}.vseg"
+            self.s3.put_object(Bucket=self.bucket, Key=f"{root}/{name}", Body=body, ContentType='application/octet-stream')
+            entries.append({"name": name, **layout})
+            buf_ids.clear()
+            buf_vecs.clear()
+            buf_payloads.clear()
+
+        for ids, vectors, payloads in self.scan_blocks():
+            pos = 0
+            while pos < len(ids):
+                take = min(rows_per_segment - len(buf_ids), len(ids) - pos)
+                buf_ids.extend(ids[pos:pos + take])
+                buf_vecs.append(vectors[pos:pos + take])
+                buf_payloads.extend(payloads[pos:pos + take])
+                pos += take
+                if len(buf_ids) >= rows_per_segment:
+                    flush()
+        flush()
+        now = time.time()
+        current = {e['name'] for e in entries}
+        retired = [{"name": e['name'], "retired_at": now} for e in old.get('segments') or [] if e['name'] not in current]
+        expired = []
+        for e in old.get('retired') or []:
+            if e['name'] in current:
+                continue
+            if now - float(e.get('retired_at') or 0) >= grace_seconds:
+                expired.append(e['name'])
+            else:
+                retired.append(e)
+        manifest = {"version": 1, "dim": self.dim, "created_at": now, "segments": entries, "retired": retired}
+        self.s3.put_object(Bucket=self.bucket, Key=f"{root}/manifest.json", Body=json.dumps(manifest).encode('utf-8'), ContentType='application/json')
+        stale = [f"{root}/{name}" for name in expired]
+        stale += [f"{root}/deleted/{i}" for i in tombstones]
+        if delete_source:
+            for obj in self._list_keys(f"{self.prefix}/{self.index}/"):
+                seen = legacy.get(obj['Key'])
+                if seen is not None and obj.get('ETag') == seen.get('ETag') and obj.get('LastModified') == seen.get('LastModified'):
+                    stale.append(obj['Key'])
+        for i in range(0, len(stale), 1000):
+            self.s3.delete_objects(Bucket=self.bucket, Delete={"Objects": [{"Key": k} for k in stale[i:i+1000]]})
+        return {
+            "segments": len(entries),
+            "vectors": sum(e['rows'] for e in entries),
+            "bytes": sum(e['bytes'] for e in entries),
+            "source_objects": len(legacy),
+            "tombstones_applied": len(tombstones),
+            "retired_segments": len(retired),
+            "deleted_segments": len(expired),
+        }
+
+    def _tracked_index(self):
+        """Local index that writes must keep current: the loaded one, or the shared on-disk one."""
+        if self._local_index is None and self.local_index_enabled and self.local_index_path:
+            with self._local_index_lock:
+                if self._local_index is None:
+                    self._local_index = MmapVectorIndex(os.path.join(self.local_index_path, self.index), self.dim)
+        return self._local_index
+
+    def local_index(self):
+        """Exact index over the legacy layout, (re)built via scan() when missing or stale."""
+        with self._local_index_lock:
+            idx = self._tracked_index()
+            if idx is None:
+                idx = self._local_index = ExactVectorIndex(self.dim)
+            stale_before = time.time() - self.local_index_ttl if self.local_index_ttl > 0 else None
+            built_at = idx.built_at
+            if not built_at or (stale_before is not None and built_at < stale_before):
+                # The on-disk index re-checks under its file lock, so one worker per host rebuilds
+                rows = ((pid, vec, payload) for ids, vectors, payloads in self.scan_blocks() for pid, vec, payload in zip(ids, vectors, payloads))
+                idx.rebuild(rows, stale_before=stale_before)
+            return idx
+
     def upsert(self, point_id: str, vector: List[float], payload: Dict[str, Any], namespace: Optional[str] = None) -> None:
         if len(vector) != self.dim:
             raise ValueError(f"Vector length {len(vector)} != dim {self.dim}")
@@ -104,182 +548,407 @@ class S3VectorStore:
         doc = {"id": point_id, **(payload or {}), "embedding": vector}
         body = json.dumps(doc).encode('utf-8')
         self.s3.put_object(Bucket=self.bucket, Key=self._key_for_id(point_id), Body=body, ContentType='application/json')
+        idx = self._tracked_index()
+        if idx is not None:
+            idx.upsert(point_id, vector, doc)
+
+    def upsert_batch(self, items: List[Dict[str, Any]], namespace: Optional[str] = None, progress: Optional[Callable[[int, Optional[int]], None]] = None) -> None:
+        """Write items ({id, values|vector, metadata}) through a pipelined writer.
+
+        Chunks are validated and serialized on the calling thread while earlier
+        chunks are in flight on the worker pool (at most write_concurrency at a
+        time). Throttled writes back off and retry. progress(done, total) is
+        called as chunks complete.
 
-    def upsert_batch(self, items: List[Dict[str, Any]], namespace: Optional[str] = None) -> None:
+        Every item is checked before anything is written. The legacy layout is
+        used only if S3 Vectors fails before storing any chunk; after that the
+        error is raised rather than splitting the batch across backends.
+        """
+        items = list(items or [])
         if not items:
             return
+        for it in items:
+            self._item_values(it)
+        total = len(items)
         # Strict vector mode: no fallback
         if self.vector_mode:
-            batch: List[Dict[str, Any]] = []
-            def flush() -> None:
-                if not batch:
-                    return
-                self.s3vectors.put_vectors(
-                    vectorBucketName=self.bucket,
-                    indexName=self.index,
-                    vectors=batch,
-                )
-                batch.clear()
-            for it in items:
-                vals = it.get('values') or it.get('vector')
-                if vals is None:
-                    raise ValueError('Missing values for upsert item')
-                if len(vals) != int(self.dim):
-                    raise ValueError(f"Vector length {len(vals)} != dim {self.dim}")
-                batch.append({
-                    "key": str(it.get('id')),
-                    "data": {"float32": vals},
-                    "metadata": dict((it.get('metadata') or {})),
-                })
-                if len(batch) >= 200:
-                    flush()
-            flush()
+            self._run_pipelined(self._put_vector_jobs(items), progress, total)
             return
         # Prefer S3 Vectors API with batching (legacy mode allows fallback)
         if self.s3vectors is not None:
+            state = {"done": 0}
             try:
-                batch: List[Dict[str, Any]] = []
-                def flush() -> None:
-                    if not batch:
-                        return
-                    self.s3vectors.put_vectors(
-                        vectorBucketName=self.bucket,
-                        indexName=self.index,
-                        vectors=batch,
-                    )
-                    batch.clear()
-                for it in items:
-                    vals = it.get('values') or it.get('vector')
-                    if vals is None:
-                        raise ValueError('Missing values for upsert item')
-                    if len(vals) != int(self.dim):
-                        raise ValueError(f"Vector length {len(vals)} != dim {self.dim}")
-                    batch.append({
-                        "key": str(it.get('id')),
-                        "data": {"float32": vals},
-                        "metadata": dict((it.get('metadata') or {})),
-                    })
-                    if len(batch) >= 200:
-                        flush()
-                flush()
+                self._run_pipelined(self._put_vector_jobs(items), progress, total, state)
                 return
             except Exception:
-                pass
+                if state["done"]:
+                    raise
+        written: List[Tuple[str, Any, Dict[str, Any]]] = []
+
+        def jobs() -> Iterator[Tuple[int, Callable[[], Any]]]:
+            for it in items:
+                vals = self._checked_values(it)
+                doc = {"id": it.get('id'), **(it.get('metadata') or {}), "embedding": vals}
+                body = json.dumps(doc).encode('utf-8')
+                written.append((str(it.get('id')), vals, doc))
+                yield 1, partial(self._write_call, self.s3.put_object, Bucket=self.bucket, Key=self._key_for_id(str(it.get('id'))), Body=body, ContentType='application/json')
+
+        self._run_pipelined(jobs(), progress, total)
+        idx = self._tracked_index()
+        if idx is not None:
+            idx.upsert_many(written)
+
+    def _item_values(self, it: Dict[str, Any]) -> Any:
+        vals = it.get('values')
+        if vals is None:
+            vals = it.get('vector')
+        if vals is None:
+            raise ValueError('Missing values for upsert item')
+        if len(vals) != int(self.dim):
+            raise ValueError(f"Vector length {len(vals)} != dim {self.dim}")
+        return vals
+
+    def _checked_values(self, it: Dict[str, Any]) -> List[float]:
+        # One C-level conversion; also accepts NumPy rows, which the JSON/boto serializers reject
+        return np.asarray(self._item_values(it), dtype=np.float32).tolist()
+
+    def _put_vector_jobs(self, items: Iterable[Dict[str, Any]]) -> Iterator[Tuple[int, Callable[[], Any]]]:
+        batch: List[Dict[str, Any]] = []
         for it in items:
-            vals = it.get('values') or it.get('vector')
-            if vals is None:
-                raise ValueError('Missing values for upsert item')
-            if len(vals) != int(self.dim):
-                raise ValueError(f"Vector length {len(vals)} != dim {self.dim}")
-            doc = {"id": it.get('id'), **(it.get('metadata') or {}), "embedding": vals}
-            body = json.dumps(doc).encode('utf-8')
-            self.s3.put_object(Bucket=self.bucket, Key=self._key_for_id(str(it.get('id'))), Body=body, ContentType='application/json')
+            batch.append({
+                "key": str(it.get('id')),
+                "data": {"float32": self._checked_values(it)},
+                "metadata": dict((it.get('metadata') or {})),
+            })
+            if len(batch) >= self.put_batch_size:
+                yield len(batch), partial(self._write_call, self.s3vectors.put_vectors, vectorBucketName=self.bucket, indexName=self.index, vectors=batch)
+                batch = []
+        if batch:
+            yield len(batch), partial(self._write_call, self.s3vectors.put_vectors, vectorBucketName=self.bucket, indexName=self.index, vectors=batch)
+
+    def _write_call(self, call: Callable[..., Any], **kwargs) -> Any:
+        """Run one S3 / S3 Vectors write, retrying throttling errors with jittered
+        exponential backoff. A throttle pauses every writer of this store, so the
+        pool slows down as a whole instead of each worker hammering on."""
+        attempt = 0
+        while True:
+            pause = self._write_pause_until - time.time()
+            if pause > 0:
+                time.sleep(pause)
+            try:
+                return call(**kwargs)
+            except ClientError as e:
+                code = (e.response or {}).get('Error', {}).get('Code')
+                attempt += 1
+                if code not in THROTTLE_CODES or attempt >= self.write_retries:
+                    raise
+                delay = min(self.write_backoff_max, self.write_backoff * (2 ** attempt)) * random.uniform(0.5, 1.0)
+                with self._write_lock:
+                    self._write_pause_until = max(self._write_pause_until, time.time() + delay)
+                    self._write_throttles += 1
+
+    def _run_pipelined(self, jobs: Iterator[Tuple[int, Callable[[], Any]]], progress: Optional[Callable[[int, Optional[int]], None]], total: Optional[int], state: Optional[Dict[str, int]] = None) -> None:
+        """Submit (count, fn) jobs as the iterator produces them, keeping at most
+        write_concurrency in flight. The first failure stops production and is
+        re-raised once the jobs already running have finished; state["done"]
+        then says how many items were written."""
+        pool = self._pool()
+        limit = max(1, min(self.write_concurrency, self.scan_concurrency))
+        in_flight: Dict[Any, int] = {}
+        done = 0
+        error: Optional[BaseException] = None
+
+        def collect(finished) -> None:
+            nonlocal done, error
+            for fut in finished:
+                count = in_flight.pop(fut)
+                exc = fut.exception()
+                if exc is not None:
+                    error = error or exc
+                    continue
+                done += count
+                if state is not None:
+                    state["done"] = done
+                if progress is not None:
+                    progress(done, total)
+
+        try:
+            for count, fn in jobs:
+                while len(in_flight) >= limit:
+                    finished, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                    collect(finished)
+                if error is not None:
+                    break
+                in_flight[pool.submit(fn)] = count
+        finally:
+            if in_flight:
+                finished, _ = wait(list(in_flight))
+                collect(finished)
+        if error is not None:
+            raise error
 
     def delete_ids(self, ids: List[str], namespace: Optional[str] = None) -> None:
         if not ids:
             return
+        ids = [str(i) for i in ids]
         # Strict vector mode: no fallback
         if self.vector_mode:
-            for i in range(0, len(ids), 500):
-                chunk = ids[i:i+500]
-                self.s3vectors.delete_vectors(
-                    vectorBucketName=self.bucket,
-                    indexName=self.index,
-                    keys=[str(k) for k in chunk],
-                )
+            self._run_pipelined(((len(chunk), partial(self._delete_vector_keys, chunk)) for chunk in _chunks(ids, 500)), None, len(ids))
             return
         # Prefer S3 Vectors API (legacy mode allows fallback)
         if self.s3vectors is not None:
             try:
-                for i in range(0, len(ids), 500):
-                    chunk = ids[i:i+500]
-                    self.s3vectors.delete_vectors(
-                        vectorBucketName=self.bucket,
-                        indexName=self.index,
-                        keys=[str(k) for k in chunk],
-                    )
+                self._run_pipelined(((len(chunk), partial(self._delete_vector_keys, chunk)) for chunk in _chunks(ids, 500)), None, len(ids))
                 return
             except Exception:
                 pass
-        objs = [{"Key": self._key_for_id(i)} for i in ids]
-        # Delete in chunks of 1000 (S3 limit)
-        for i in range(0, len(objs), 1000):
-            self.s3.delete_objects(Bucket=self.bucket, Delete={"Objects": objs[i:i+1000]})
+        keys = [self._key_for_id(i) for i in ids]
+        self._run_pipelined(((len(chunk), partial(self._delete_objects, chunk)) for chunk in _chunks(keys, 1000)), None, len(keys))
+        # Packed segments are immutable; hide their rows until the next compaction
+        if self.segment_manifest():
+            root = self._segment_root()
+            self._run_pipelined(((1, partial(self._write_call, self.s3.put_object, Bucket=self.bucket, Key=f"{root}/deleted/{i}", Body=b'')) for i in ids), None, len(ids))
+        idx = self._tracked_index()
+        if idx is not None:
+            idx.delete(ids)
 
-    def delete_all(self, namespace: Optional[str] = None) -> None:
-        # Strict vector mode: list then delete with no fallback
-        if self.vector_mode:
-            next_token = None
-            keys: List[str] = []
-            while True:
-                if next_token:
-                    resp = self.s3vectors.list_vectors(
-                        vectorBucketName=self.bucket,
-                        indexName=self.index,
-                        nextToken=next_token,
-                    )
-                else:
-                    resp = self.s3vectors.list_vectors(
-                        vectorBucketName=self.bucket,
-                        indexName=self.index,
-                    )
-                for v in resp.get('vectors', []) or []:
-                    k = v.get('key') if isinstance(v, dict) else None
-                    if k is not None:
-                        keys.append(str(k))
-                next_token = resp.get('nextToken')
-                if not next_token:
-                    break
+    def _delete_vector_keys(self, keys: List[str]) -> None:
+        self._write_call(self.s3vectors.delete_vectors, vectorBucketName=self.bucket, indexName=self.index, keys=keys)
+
+    def _delete_objects(self, keys: List[str]) -> None:
+        """delete_objects for up to 1000 keys; per-key throttling errors are retried."""
+        attempt = 0
+        while keys:
+            res = self._write_call(self.s3.delete_objects, Bucket=self.bucket, Delete={"Objects": [{"Key": k} for k in keys], "Quiet": True})
+            errors = res.get('Errors') or []
+            fatal = [e for e in errors if e.get('Code') not in THROTTLE_CODES]
+            if fatal:
+                raise RuntimeError(f"delete_objects failed for {len(fatal)} keys (first: {fatal[0].get('Key')}: {fatal[0].get('Code')})")
+            keys = [e['Key'] for e in errors]
             if keys:
-                self.delete_ids(keys, namespace=namespace)
+                attempt += 1
+                if attempt >= self.write_retries:
+                    raise RuntimeError(f"delete_objects still throttled for {len(keys)} keys after {attempt} attempts")
+                time.sleep(min(self.write_backoff_max, self.write_backoff * (2 ** attempt)) * random.uniform(0.5, 1.0))
+
+    def delete_all(self, namespace: Optional[str] = None, checkpoint: Optional[str] = None, progress: Optional[Callable[[int, Optional[int]], None]] = None) -> None:
+        """Delete every vector without materializing the key list.
+
+        Each listed page is deleted as soon as it arrives, with up to
+        write_concurrency pages in flight while listing continues. With
+        `checkpoint` (a local JSON file), the listing token is saved once all
+        earlier pages are deleted, and a later call resumes from it; the file is
+        removed when the run completes. progress(deleted, None) reports keys deleted.
+        """
+        resume = self._load_checkpoint(checkpoint)
+        counter = {"deleted": 0}
+        # Strict vector mode: no fallback
+        if self.vector_mode:
+            self._stream_delete('vectors', self._vector_pages, self._delete_vector_keys, resume, checkpoint, progress, counter)
+            _remove_checkpoint(checkpoint)
             return
-        # Prefer S3 Vectors API: list then delete (legacy mode allows fallback)
+        # Prefer S3 Vectors API (legacy mode allows fallback)
         if self.s3vectors is not None:
             try:
-                next_token = None
-                keys: List[str] = []
-                while True:
-                    if next_token:
-                        resp = self.s3vectors.list_vectors(
-                            vectorBucketName=self.bucket,
-                            indexName=self.index,
-                            nextToken=next_token,
-                        )
-                    else:
-                        resp = self.s3vectors.list_vectors(
-                            vectorBucketName=self.bucket,
-                            indexName=self.index,
-                        )
-                    for v in resp.get('vectors', []) or []:
-                        k = v.get('key') if isinstance(v, dict) else None
-                        if k is not None:
-                            keys.append(str(k))
-                    next_token = resp.get('nextToken')
-                    if not next_token:
-                        break
-                if keys:
-                    self.delete_ids(keys, namespace=namespace)
-                return
+                if resume is None or resume['stage'] == 'vectors':
+                    self._stream_delete('vectors', self._vector_pages, self._delete_vector_keys, resume, checkpoint, progress, counter)
+                    _remove_checkpoint(checkpoint)
+                    return
             except Exception:
                 pass
-        prefix = f"{self.prefix}/{self.index}/"
-        token = None
+        idx = self._tracked_index()
+        if idx is not None:
+            idx.clear()
+        stages = [f"legacy:{self.prefix}/{self.index}/", f"legacy:{self._segment_root()}/"]
+        if resume is not None and resume['stage'] in stages:
+            stages = stages[stages.index(resume['stage']):]
+        else:
+            resume = None
+        for stage in stages:
+            self._stream_delete(stage, self._object_pages, self._delete_objects, resume, checkpoint, progress, counter)
+            resume = None
+        _remove_checkpoint(checkpoint)
+
+    def _vector_pages(self, stage: str, token: Optional[str]) -> Iterator[Tuple[List[str], Optional[str]]]:
+        while True:
+            kwargs: Dict[str, Any] = {"nextToken": token} if token else {}
+            try:
+                resp = self.s3vectors.list_vectors(vectorBucketName=self.bucket, indexName=self.index, maxResults=500, **kwargs)
+            except ClientError as e:
+                # Resume tokens expire; deletes are idempotent, so start the listing over
+                if token and (e.response or {}).get('Error', {}).get('Code') == 'ValidationException':
+                    token = None
+                    continue
+                raise
+            keys = [str(v['key']) for v in resp.get('vectors', []) or [] if isinstance(v, dict) and v.get('key') is not None]
+            token = resp.get('nextToken')
+            yield keys, token
+            if not token:
+                return
+
+    def _object_pages(self, stage: str, token: Optional[str]) -> Iterator[Tuple[List[str], Optional[str]]]:
+        prefix = stage[len('legacy:'):]
         while True:
             try:
                 res = self.s3.list_objects_v2(Bucket=self.bucket, Prefix=prefix, ContinuationToken=token) if token else self.s3.list_objects_v2(Bucket=self.bucket, Prefix=prefix)
             except ClientError as e:
                 code = (e.response or {}).get('Error', {}).get('Code')
                 if code == 'NoSuchBucket':
-                    return []
+                    return
+                if token and code == 'InvalidArgument':
+                    token = None
+                    continue
                 raise
-            contents = res.get('Contents') or []
-            if contents:
-                objs = [{"Key": it['Key']} for it in contents]
-                for i in range(0, len(objs), 1000):
-                    self.s3.delete_objects(Bucket=self.bucket, Delete={"Objects": objs[i:i+1000]})
-            if not res.get('IsTruncated'):
+            token = res.get('NextContinuationToken') if res.get('IsTruncated') else None
+            yield [it['Key'] for it in res.get('Contents') or []], token
+            if not token:
+                return
+
+    def _stream_delete(self, stage: str, pages, delete: Callable[[List[str]], None], resume: Optional[Dict[str, Any]], checkpoint: Optional[str], progress, counter: Dict[str, int]) -> None:
+        token = resume.get('token') if resume is not None and resume['stage'] == stage else None
+        marks = _PageWatermark(checkpoint, stage, self.bucket, self.index)
+        lock = threading.Lock()
+
+        def job(seq: int, keys: List[str], next_token: Optional[str]) -> None:
+            if keys:
+                delete(keys)
+            marks.done(seq, next_token)
+            if keys and progress is not None:
+                with lock:
+                    counter["deleted"] += len(keys)
+                    progress(counter["deleted"], None)
+
+        # Listing runs on this thread, one page ahead of the pool at most write_concurrency deep
+        jobs = ((len(keys), partial(job, seq, keys, next_token)) for seq, (keys, next_token) in enumerate(pages(stage, token)))
+        self._run_pipelined(jobs, None, None)
+
+    def _load_checkpoint(self, path: Optional[str]) -> Optional[Dict[str, Any]]:
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path) as fh:
+                state = json.load(fh)
+        except Exception:
+            return None
+        # A checkpoint from another bucket/index is ignored rather than trusted
+        if state.get('bucket') != self.bucket or state.get('index') != self.index or not state.get('stage'):
+            return None
+        return state
+
+    def _query_filter(self, building: Optional[str], ymd_from: Optional[int], ymd_to: Optional[int], with_dates: bool) -> Optional[Dict[str, Any]]:
+        clauses: List[Dict[str, Any]] = []
+        if building:
+            clauses.append({"building": {"$eq": building}})
+        if with_dates and ymd_from is not None:
+            clauses.append({"shot_ymd": {"$gte": ymd_from}})
+        if with_dates and ymd_to is not None:
+            clauses.append({"shot_ymd": {"$lte": ymd_to}})
+        if not clauses:
+            return None
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+    def _query_s3vectors(self, query_vector: List[float], top_k: int, building: Optional[str], date_from: Optional[str], date_to: Optional[str]) -> List[Dict[str, Any]]:
+        """query_vectors with building and the shot_ymd range filtered server-side.
+
+        If the index rejects the range filter (shot_ymd not filterable), dates are
+        filtered here instead: for the rest of the process when the error names
+        shot_ymd or a range operator, else for this query only. Either way, topK grows until k rows survive the
+        filters, the index runs out of matches, or max_query_top_k is reached.
+        """
+        k = max(1, int(top_k))
+        ymd_from, ymd_to = ymd_bound(date_from), ymd_bound(date_to)
+        dated = ymd_from is not None or ymd_to is not None
+        limit = max(k, self.max_query_top_k)
+        fetch, fetched, rounds = k, 0, 0
+        try_pushdown = True
+        while True:
+            pushdown = dated and try_pushdown and self.date_pushdown
+            kwargs: Dict[str, Any] = {}
+            filt = self._query_filter(building, ymd_from, ymd_to, pushdown)
+            if filt:
+                kwargs['filter'] = filt
+            try:
+                resp = self.s3vectors.query_vectors(
+                    vectorBucketName=self.bucket,
+                    indexName=self.index,
+                    queryVector={"float32": query_vector},
+                    topK=fetch,
+                    returnDistance=True,
+                    returnMetadata=True,
+                    **kwargs,
+                )
+            except ClientError as e:
+                err = (e.response or {}).get('Error', {})
+                if pushdown and err.get('Code') == 'ValidationException':
+                    message = str(err.get('Message') or '')
+                    if any(term in message for term in ('shot_ymd', '$gte', '$lte')):
+                        # Remembered for the process: later queries go straight to overfetching
+                        self.date_pushdown = False
+                    # Otherwise it may be unrelated (bad vector, topK): one retry without the range
+                    try_pushdown = False
+                    continue
+                raise
+            vectors = resp.get('vectors', []) or []
+            rounds += 1
+            fetched += len(vectors)
+            out: List[Dict[str, Any]] = []
+            for v in vectors:
+                if not isinstance(v, dict):
+                    continue
+                key, meta, dist = v.get('key'), v.get('metadata'), v.get('distance')
+                row: Dict[str, Any] = {"id": str(key) if key is not None else None}
+                if isinstance(dist, (int, float)):
+                    row["score"] = 1.0 - float(dist)
+                if isinstance(meta, dict):
+                    row.update(meta)
+                # Still checked when pushed down; cheap, and rows without shot_ymd never match
+                try:
+                    ymd = int(row.get('shot_ymd') or 0)
+                except Exception:
+                    ymd = 0
+                if (ymd_from is not None and ymd < ymd_from) or (ymd_to is not None and ymd > ymd_to):
+                    continue
+                out.append(row)
+            if len(out) >= k or len(vectors) < fetch or fetch >= limit:
                 break
-            token = res.get('NextContinuationToken')
+            # Size the next round from the survival rate seen so far, at least doubling
+            survival = len(out) / max(1, len(vectors))
+            fetch = min(limit, max(fetch * 2, int(k / survival) + 1 if survival else limit))
+        out.sort(key=lambda x: float(x.get('score') or 0.0), reverse=True)
+        self._record_query(k, fetched, rounds, len(out), dated and try_pushdown and self.date_pushdown)
+        return out[:k]
+
+    def _record_query(self, k: int, fetched: int, rounds: int, returned: int, pushed_down: bool) -> None:
+        last = {
+            "top_k": k,
+            "fetched": fetched,
+            "rounds": rounds,
+            "returned": min(returned, k),
+            "overfetch_ratio": fetched / k,
+            "date_pushdown": pushed_down,
+        }
+        self._last_query.stats = last
+        with self._query_stats_lock:
+            totals = self._query_stats
+            totals["queries"] += 1
+            totals["requested"] += k
+            totals["fetched"] += fetched
+            totals["rounds"] += rounds
+            totals["short"] += int(returned < k)
+            totals["max_overfetch_ratio"] = max(totals["max_overfetch_ratio"], last["overfetch_ratio"])
+
+    def last_query_stats(self) -> Optional[Dict[str, Any]]:
+        """Overfetch report for the calling thread's most recent S3 Vectors query."""
+        return getattr(self._last_query, 'stats', None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._query_stats_lock:
+            totals = dict(self._query_stats)
+        totals["overfetch_ratio"] = totals["fetched"] / totals["requested"] if totals["requested"] else 0.0
+        totals["date_pushdown"] = self.date_pushdown
+        totals["write_throttles"] = self._write_throttles
+        totals["max_query_top_k"] = self.max_query_top_k
+        return totals
 
     def search(
         self,
@@ -295,142 +964,115 @@ class S3VectorStore:
             raise ValueError(f"Query vector length {len(query_vector)} != dim {self.dim}")
         # Strict vector mode: no fallback
         if self.vector_mode:
-            filt: Dict[str, Any] = {}
-            if building:
-                filt["building"] = building
-            resp = self.s3vectors.query_vectors(
-                vectorBucketName=self.bucket,
-                indexName=self.index,
-                queryVector={"float32": query_vector},
-                topK=int(max(1, top_k)),
-                filter=filt or None,
-                returnDistance=True,
-                returnMetadata=True,
-            )
-            vectors = resp.get('vectors', []) or []
-            results: List[Dict[str, Any]] = []
-            for v in vectors:
-                key = v.get('key') if isinstance(v, dict) else None
-                meta = v.get('metadata') if isinstance(v, dict) else {}
-                dist = v.get('distance') if isinstance(v, dict) else None
-                row: Dict[str, Any] = {"id": str(key) if key is not None else None}
-                if isinstance(dist, (int, float)):
-                    try:
-                        row["score"] = 1.0 - float(dist)
-                    except Exception:
-                        row["score"] = float(0.0)
-                if isinstance(meta, dict):
-                    row.update(meta)
-                results.append(row)
-            out: List[Dict[str, Any]] = []
-            for r in results:
-                if date_from:
-                    try:
-                        ymd_from = int(str(date_from).replace('-', ''))
-                        if int(r.get('shot_ymd') or 0) < ymd_from:
-                            continue
-                    except Exception:
-                        pass
-                if date_to:
-                    try:
-                        ymd_to = int(str(date_to).replace('-', ''))
-                        if int(r.get('shot_ymd') or 0) > ymd_to:
-                            continue
-                    except Exception:
-                        pass
-                out.append(r)
-            out.sort(key=lambda x: float(x.get('score') or 0.0), reverse=True)
-            return out[:max(1, int(top_k))]
+            return self._query_s3vectors(query_vector, top_k, building, date_from, date_to)
         # Prefer S3 Vectors API (legacy mode allows fallback)
         if self.s3vectors is not None:
             try:
-                filt: Dict[str, Any] = {}
-                if building:
-                    filt["building"] = building
-                resp = self.s3vectors.query_vectors(
-                    vectorBucketName=self.bucket,
-                    indexName=self.index,
-                    queryVector={"float32": query_vector},
-                    topK=int(max(1, top_k)),
-                    filter=filt or None,
-                    returnDistance=True,
-                    returnMetadata=True,
-                )
-                vectors = resp.get('vectors', []) or []
-                results: List[Dict[str, Any]] = []
-                for v in vectors:
-                    key = v.get('key') if isinstance(v, dict) else None
-                    meta = v.get('metadata') if isinstance(v, dict) else {}
-                    dist = v.get('distance') if isinstance(v, dict) else None
-                    row: Dict[str, Any] = {"id": str(key) if key is not None else None}
-                    if isinstance(dist, (int, float)):
-                        try:
-                            row["score"] = 1.0 - float(dist)
-                        except Exception:
-                            row["score"] = float(0.0)
-                    if isinstance(meta, dict):
-                        row.update(meta)
-                    results.append(row)
-                out: List[Dict[str, Any]] = []
-                for r in results:
-                    if date_from:
-                        try:
-                            ymd_from = int(str(date_from).replace('-', ''))
-                            if int(r.get('shot_ymd') or 0) < ymd_from:
-                                continue
-                        except Exception:
-                            pass
-                    if date_to:
-                        try:
-                            ymd_to = int(str(date_to).replace('-', ''))
-                            if int(r.get('shot_ymd') or 0) > ymd_to:
-                                continue
-                        except Exception:
-                            pass
-                    out.append(r)
-                out.sort(key=lambda x: float(x.get('score') or 0.0), reverse=True)
-                return out[:max(1, int(top_k))]
+                return self._query_s3vectors(query_vector, top_k, building, date_from, date_to)
             except Exception:
                 pass
-        # Fallback: legacy JSON scan in S3
-        prefix = f"{self.prefix}/{self.index}/"
-        token = None
-        best: List[Dict[str, Any]] = []
-        while True:
-            res = self.s3.list_objects_v2(Bucket=self.bucket, Prefix=prefix, ContinuationToken=token) if token else self.s3.list_objects_v2(Bucket=self.bucket, Prefix=prefix)
-            contents = res.get('Contents') or []
-            for obj in contents:
-                b = self.s3.get_object(Bucket=self.bucket, Key=obj['Key'])
-                try:
-                    doc = json.loads(b['Body'].read())
-                except Exception:
-                    continue
-                if building and doc.get('building') != building:
-                    continue
-                if date_from:
-                    try:
-                        ymd_from = int(date_from.replace('-', ''))
-                        if int(doc.get('shot_ymd') or 0) < ymd_from:
-                            continue
-                    except Exception:
-                        pass
-                if date_to:
-                    try:
-                        ymd_to = int(date_to.replace('-', ''))
-                        if int(doc.get('shot_ymd') or 0) > ymd_to:
-                            continue
-                    except Exception:
-                        pass
-                emb = doc.get('embedding')
-                if not isinstance(emb, list) or len(emb) != self.dim:
-                    continue
-                score = _cosine(query_vector, emb)
-                row = {"id": doc.get('id'), "score": score, **{k: v for k, v in doc.items() if k != 'embedding'}}
-                best.append(row)
-            if not res.get('IsTruncated'):
-                break
-            token = res.get('NextContinuationToken')
-        best.sort(key=lambda x: float(x.get('score') or 0.0), reverse=True)
-        return best[:max(1, int(top_k))]
+        # Fallback: legacy JSON layout, answered from the in-memory exact index
+        if self.local_index_enabled:
+            return self.local_index().search(query_vector, top_k=top_k, building=building, date_from=date_from, date_to=date_to)
+        return self._scan_search([query_vector], top_k, building, date_from, date_to)[0]
+
+    def search_batch(
+        self,
+        query_vectors: List[List[float]],
+        top_k: int = 10,
+        building: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        namespace: Optional[str] = None,
+        fuse: Optional[str] = None,
+    ):
+        """search() for several query vectors at about the latency of one.
+
+        S3 Vectors queries run concurrently; the legacy layout is scored with one
+        matrix product per block. Returns one result list per query, or a single
+        list fused by 'max' (max-sim) or 'rrf' when `fuse` is given.
+        """
+        for q in query_vectors:
+            if len(q) != self.dim:
+                raise ValueError(f"Query vector length {len(q)} != dim {self.dim}")
+        if not query_vectors:
+            return finish_batch([], top_k, fuse)
+        if self.vector_mode or self.s3vectors is not None:
+            try:
+                results = list(self._pool().map(lambda q: self._query_s3vectors(q, top_k, building, date_from, date_to), query_vectors))
+                return finish_batch(results, top_k, fuse)
+            except Exception:
+                if self.vector_mode:
+                    raise
+        if self.local_index_enabled:
+            results = self.local_index().search_batch(query_vectors, top_k=top_k, building=building, date_from=date_from, date_to=date_to)
+        else:
+            results = self._scan_search(query_vectors, top_k, building, date_from, date_to)
+        return finish_batch(results, top_k, fuse)
+
+    def _scan_search(self, query_vectors: List[List[float]], top_k: int, building: Optional[str], date_from: Optional[str], date_to: Optional[str]) -> List[List[Dict[str, Any]]]:
+        # Scan with filters pushed into the segment reads; blocks are scored with NumPy
+        # and only a k-sized heap of the best rows per query is kept
+        queries = normalize_rows(np.asarray(query_vectors, dtype=np.float32).reshape(-1, self.dim))
+        k = max(1, int(top_k))
+        heaps: List[List[tuple]] = [[] for _ in range(queries.shape[0])]
+        seq = 0
+        for ids, vectors, payloads in self.scan_blocks(building=building, date_from=date_from, date_to=date_to):
+            block_scores = queries @ normalize_rows(vectors).T
+            for heap, scores in zip(heaps, block_scores):
+                for row in top_k_indices(scores, k):
+                    item = (float(scores[row]), seq, ids[row], payloads[row])
+                    seq += 1
+                    if len(heap) < k:
+                        heapq.heappush(heap, item)
+                    elif item[0] > heap[0][0]:
+                        heapq.heapreplace(heap, item)
+        out = []
+        for heap in heaps:
+            heap.sort(key=lambda x: (-x[0], x[1]))
+            out.append([{**payload, "id": point_id, "score": score} for score, _, point_id, payload in heap])
+        return out
 
 
+def _chunks(items: List[Any], size: int) -> Iterator[List[Any]]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _remove_checkpoint(path: Optional[str]) -> None:
+    if path:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class _PageWatermark:
+    """Checkpoint for a paged listing whose pages are deleted out of order: the
+    saved token is the one after the last page that, together with every page
+    before it, has been deleted, so resuming never skips undeleted keys."""
+
+    def __init__(self, path: Optional[str], stage: str, bucket: str, index: str):
+        self.path = path
+        self.state = {"bucket": bucket, "index": index, "stage": stage}
+        self._finished: Dict[int, Optional[str]] = {}
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def done(self, seq: int, next_token: Optional[str]) -> None:
+        if not self.path:
+            return
+        with self._lock:
+            self._finished[seq] = next_token
+            advanced = False
+            while self._next in self._finished:
+                token = self._finished.pop(self._next)
+                self._next += 1
+                advanced = True
+            # The final page has no token; the caller removes the file once the whole run is done
+            if not advanced or not token:
+                return
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, 'w') as fh:
+                json.dump({**self.state, "token": token, "updated_at": time.time()}, fh)
+            os.replace(tmp, self.path)
@@ -0,0 +1,62 @@
+from __future__ import annotations
+from typing import Any, Dict, List, Sequence, Tuple
+import json
+import struct
+import zlib
+import numpy as np
+
+# Packed vector segment, one S3 object holding thousands of vectors:
+#   header | vectors (rows x dim, float32 or float16, row-major) | zlib(JSON columns)
+# The manifest records each block's offset and length so readers fetch the
+# metadata and only the vector rows they need with ranged GETs.
+MAGIC = b'VSEG'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIIQ')  # magic, version, dtype code, rows, dim, meta length
+DTYPE_CODES = {'float32': 0, 'float16': 1}
+DTYPES = {'float32': np.float32, 'float16': np.float16}
+
+
+def encode_segment(ids: Sequence[str], vectors: np.ndarray, payloads: Sequence[Dict[str, Any]], dtype: str = 'float32') -> Tuple[bytes, Dict[str, Any]]:
+    """Return (object body, layout entry for the manifest)."""
+    if dtype not in DTYPES:
+        raise ValueError(f"Unsupported segment dtype {dtype!r}")
+    arr = np.ascontiguousarray(np.asarray(vectors, dtype=np.float32).astype(DTYPES[dtype]))
+    rows, dim = arr.shape
+    columns = {
+        "id": [str(i) for i in ids],
+        "building": [p.get('building') for p in payloads],
+        "shot_ymd": [int(p.get('shot_ymd') or 0) for p in payloads],
+        "payload": [{k: v for k, v in p.items() if k not in ('id', 'embedding')} for p in payloads],
+    }
+    meta = zlib.compress(json.dumps(columns, default=str).encode('utf-8'))
+    body = HEADER.pack(MAGIC, VERSION, DTYPE_CODES[dtype], rows, dim, len(meta)) + arr.tobytes() + meta
+    layout = {
+        "rows": rows,
+        "dim": dim,
+        "dtype": dtype,
+        "vectors_offset": HEADER.size,
+        "vectors_length": arr.nbytes,
+        "meta_offset": HEADER.size + arr.nbytes,
+        "meta_length": len(meta),
+        "bytes": len(body),
+    }
+    return body, layout
+
+
+def decode_meta(raw: bytes) -> Dict[str, List[Any]]:
+    return json.loads(zlib.decompress(raw))
+
+
+def decode_vectors(raw: bytes, dtype: str, dim: int) -> np.ndarray:
+    return np.frombuffer(raw, dtype=DTYPES[dtype]).reshape(-1, dim).astype(np.float32)
+
+
+def row_runs(rows: np.ndarray, max_gap: int) -> List[Tuple[int, int]]:
+    """Coalesce sorted row indices into [start, stop) runs, reading through gaps of
+    up to max_gap unwanted rows rather than paying for another request."""
+    if len(rows) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(rows) > max_gap + 1)
+    starts = rows[np.concatenate(([0], breaks + 1))]
+    stops = rows[np.concatenate((breaks, [len(rows) - 1]))] + 1
+    return list(zip(starts.tolist(), stops.tolist()))
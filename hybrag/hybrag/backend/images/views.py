@@ -6,13 +6,21 @@ from django.conf import settings
 from django.shortcuts import get_object_or_404
 from django.views.generic import TemplateView
 from urllib.parse import urlparse, unquote
+import math
 from .models import ImageItem
+from .ingest import embed_s3_image, get_content_store, s3_key_for_item
+from .embeddings.readiness import EndpointNotReady
+from .embeddings.resilience import CircuitOpenError
+from .vector.fusion import FUSIONS
+from .search_cache import GenerationTrackingStore, SearchResultCache, normalize_query_text
 
 # S3 helpers
-from storage.s3 import presign_put, presign_get
+from storage.s3 import presign_put, presign_get, put_bytes
 
 _siglip = None
 _vectors = None
+_base_vectors = None
+_search_cache = None
 _spell = None
 
 DOMAIN_SYNONYMS = {
@@ -32,12 +40,13 @@ def get_siglip():
 	return _siglip
 
 
-def get_vectors():
-	global _vectors
-	if _vectors is None:
+def get_base_vectors():
+	"""The backing vector store, without any local index in front of it."""
+	global _base_vectors
+	if _base_vectors is None:
 		try:
 			from .vector.s3_vector_store import S3VectorStore
-			_vectors = S3VectorStore(
+			_base_vectors = S3VectorStore(
 				bucket=getattr(settings, 'VECTOR_S3_BUCKET', None),
 				index_name=getattr(settings, 'VECTOR_S3_INDEX', 'images'),
 				dim=getattr(settings, 'OS_EMB_DIM', 1536),
@@ -47,12 +56,79 @@ def get_vectors():
 		except Exception:
 			# Fallback: try OpenSearch if S3 setup fails
 			from .vector.pinecone_store import VectorStore
-			_vectors = VectorStore(
+			_base_vectors = VectorStore(
 				api_key='', environment=None, index_name=getattr(settings, 'OS_INDEX', 'media-embeddings'), dim=getattr(settings, 'OS_EMB_DIM', 1536), host=getattr(settings, 'OS_HOST', None),
 			)
+	return _base_vectors
+
+
+def get_search_cache():
+	global _search_cache
+	if _search_cache is None:
+		_search_cache = SearchResultCache(
+			ttl=getattr(settings, 'SEARCH_CACHE_TTL_SECONDS', 60),
+			max_entries=getattr(settings, 'SEARCH_CACHE_ENTRIES', 512),
+			path=getattr(settings, 'SEARCH_CACHE_PATH', '') or None,
+			max_bytes=int(getattr(settings, 'SEARCH_CACHE_MAX_MB', 64)) * 1024 * 1024,
+		)
+	return _search_cache
+
+
+def get_vectors():
+	global _vectors
+	if _vectors is None:
+		base = get_base_vectors()
+		kind = (getattr(settings, 'VECTOR_INDEX', '') or '').lower()
+		if kind == 'hnsw':
+			from .vector.hnsw import HNSWVectorStore
+			_vectors = HNSWVectorStore(
+				getattr(settings, 'VECTOR_HNSW_PATH', '/tmp/hybrag/hnsw-images.bin'),
+				dim=getattr(settings, 'OS_EMB_DIM', 1536),
+				source=base,
+				M=getattr(settings, 'VECTOR_HNSW_M', 16),
+				ef_construction=getattr(settings, 'VECTOR_HNSW_EF_CONSTRUCTION', 200),
+				ef_search=getattr(settings, 'VECTOR_HNSW_EF_SEARCH', 64),
+			)
+		elif kind == 'ivf':
+			from .vector.ivf import IVFVectorStore
+			_vectors = IVFVectorStore(
+				getattr(settings, 'VECTOR_IVF_PATH', '/tmp/hybrag/ivf-images.npz'),
+				dim=getattr(settings, 'OS_EMB_DIM', 1536),
+				source=base,
+				nlist=getattr(settings, 'VECTOR_IVF_NLIST', 0) or None,
+				nprobe=getattr(settings, 'VECTOR_IVF_NPROBE', 8),
+			)
+		elif kind == 'pq':
+			from .vector.pq import PQVectorStore
+			_vectors = PQVectorStore(
+				getattr(settings, 'VECTOR_PQ_PATH', '/tmp/hybrag/pq-images.npz'),
+				dim=getattr(settings, 'OS_EMB_DIM', 1536),
+				source=base,
+				m=getattr(settings, 'VECTOR_PQ_M', 0) or None,
+				rerank=getattr(settings, 'VECTOR_PQ_RERANK', 4),
+			)
+		else:
+			_vectors = base
+		# Every write path goes through here, so this is where search results are invalidated
+		_vectors = GenerationTrackingStore(_vectors, get_search_cache())
 	return _vectors
 
 
+def endpoint_not_ready_response(e: EndpointNotReady) -> Response:
+	return Response(
+		{"detail": str(e), "state": e.state, "eta_seconds": e.eta_seconds},
+		status=status.HTTP_503_SERVICE_UNAVAILABLE,
+	)
+
+
+def circuit_open_response(e: CircuitOpenError) -> Response:
+	return Response(
+		{"detail": str(e), "retry_after": e.retry_after},
+		status=status.HTTP_503_SERVICE_UNAVAILABLE,
+		headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))},
+	)
+
+
 def absolute_media_url(rel_url: str) -> str:
 	base = getattr(settings, 'BACKEND_BASE_URL', '')
 	if rel_url.startswith('http://') or rel_url.startswith('https://'):
@@ -120,18 +196,19 @@ class ImageIngestView(APIView):
 		item = ImageItem(file=uploaded, building=building, shot_date=shot_date, notes=notes or "")
 		item.save()
 		# 2) Upload the saved file to S3 under a stable key
-		from django.utils.text import slugify
-		import os as _os
-		ext = _os.path.splitext(getattr(uploaded, 'name', '') or '')[1] or '.jpg'
-		s3_key = f"images/{slugify(str(item.building))}/{str(item.id)}{ext}"
-		s3 = boto3.client('s3', config=Config(region_name=getattr(settings, 'AWS_REGION', None)))
+		s3_key = s3_key_for_item(item, getattr(uploaded, 'name', ''))
 		with item.file.open('rb') as fh:
-			s3.put_object(Bucket=getattr(settings, 'S3_BUCKET', ''), Key=s3_key, Body=fh.read(), ContentType=getattr(uploaded, 'content_type', 'image/jpeg'))
-		# 3) Generate a presigned GET URL for embedding
+			data = fh.read()
+		put = put_bytes(s3_key, data, content_type=getattr(uploaded, 'content_type', 'image/jpeg'))
 		img_url = presign_get(s3_key)
-		# 4) Embed via async image endpoint (SiglipService selects async for image_url)
-		vec = get_siglip()._invoke({"image_url": img_url, "normalize": True})
-		# 5) Upsert into vector store with S3 key metadata for retrieval
+		# 3) Embed (content-hash dedupe, then model-sized derivative inline or via async S3)
+		try:
+			vec = embed_s3_image(get_siglip(), s3_key, data=data, etag=put.get('ETag'))
+		except EndpointNotReady as e:
+			return endpoint_not_ready_response(e)
+		except CircuitOpenError as e:
+			return circuit_open_response(e)
+		# 4) Upsert into vector store with S3 key metadata for retrieval
 		payload = {
 			"id": str(item.id),
 			"building": building,
@@ -163,9 +240,14 @@ class UpsertViaS3View(APIView):
 		if not (item_id and s3_key and building and shot_date):
 			return Response({"detail": "id, s3_key, building, shot_date required"}, status=400)
 
-		# Generate embedding using a fresh presigned URL, but store only stable s3_key in the index
+		# Embed from the model-sized derivative (or a stored vector for identical bytes), but store only stable s3_key in the index
 		img_url = presign_get(s3_key)
-		vec = get_siglip()._invoke({"image_url": img_url, "normalize": True})
+		try:
+			vec = embed_s3_image(get_siglip(), s3_key)
+		except EndpointNotReady as e:
+			return endpoint_not_ready_response(e)
+		except CircuitOpenError as e:
+			return circuit_open_response(e)
 		payload = {
 			"id": str(item_id),
 			"building": building,
@@ -193,22 +275,55 @@ class ImageSearchView(APIView):
 		except Exception:
 			top_k = 10
 
-		if q:
-			q_norm = normalize_text_query(q)
-			terms = DOMAIN_SYNONYMS.get(q_norm, [q_norm])
-			import numpy as np
-			# Sequential to reduce contention/timeouts with async endpoint
-			embs = [get_siglip().text_embed(t) for t in terms]
-			query_vec = np.mean(np.array(embs, dtype=float), axis=0).tolist()
-		elif query_image_id:
-			return Response({"detail": "Provide a query image via S3 key flow; local files not supported"}, status=400)
-		else:
+		if not q:
+			if query_image_id:
+				return Response({"detail": "Provide a query image via S3 key flow; local files not supported"}, status=400)
 			return Response({"detail": "provide q or query_image_id"}, status=status.HTTP_400_BAD_REQUEST)
 
-		results = get_vectors().search(
-			query_vec, top_k=top_k, building=building, date_from=date_from, date_to=date_to, namespace=namespace
+		options = {}
+		if request.query_params.get('nprobe') and (getattr(settings, 'VECTOR_INDEX', '') or '').lower() == 'ivf':
+			# Per-request recall/latency trade-off for the IVF index
+			try:
+				options['nprobe'] = max(1, int(request.query_params['nprobe']))
+			except Exception:
+				pass
+		if request.query_params.get('rerank') and (getattr(settings, 'VECTOR_INDEX', '') or '').lower() == 'pq':
+			# Candidates per result rescored exactly; 0 answers from the PQ codes alone
+			try:
+				options['rerank'] = max(0, int(request.query_params['rerank']))
+			except Exception:
+				pass
+		fuse = request.query_params.get('fuse') or getattr(settings, 'VECTOR_MULTI_QUERY_FUSION', 'max')
+		if fuse not in FUSIONS:
+			return Response({"detail": f"fuse must be one of {', '.join(FUSIONS)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+		# A hit skips spellcheck, embedding and the vector query; URLs are presigned below either way
+		cache = get_search_cache()
+		cache_key = cache.make_key(
+			q=normalize_query_text(q), building=building, date_from=date_from, date_to=date_to,
+			k=top_k, namespace=namespace, fuse=fuse, options=options,
 		)
-		results = rerank_with_metadata_boost(results, building)
+		generation = cache.generation()
+		results = cache.get(cache_key)
+		if results is None:
+			q_norm = normalize_text_query(q)
+			terms = DOMAIN_SYNONYMS.get(q_norm, [q_norm])
+			try:
+				embs = get_siglip().text_embed_batch(terms)
+			except CircuitOpenError as e:
+				return circuit_open_response(e)
+			query_vecs = [list(e) for e in embs]
+			if len(query_vecs) > 1:
+				# Each synonym is searched on its own and the lists fused, instead of averaging the embeddings
+				results = get_vectors().search_batch(
+					query_vecs, top_k=top_k, building=building, date_from=date_from, date_to=date_to, namespace=namespace, fuse=fuse, **options
+				)
+			else:
+				results = get_vectors().search(
+					query_vecs[0], top_k=top_k, building=building, date_from=date_from, date_to=date_to, namespace=namespace, **options
+				)
+			results = rerank_with_metadata_boost(results, building)
+			cache.set(cache_key, results, generation)
 		# Attach fresh presigned URLs for any result that has s3_key
 		for r in results:
 			try:
@@ -233,5 +348,20 @@ class ImageSearchView(APIView):
 		return Response({"results": results, "namespace": namespace or ''})
 
 
+class StatsView(APIView):
+	permission_classes = [permissions.AllowAny]
+
+	def get(self, request):
+		store = get_content_store()
+		# Only report a vector store that is already up; stats should not connect one
+		vectors = _base_vectors
+		return Response({
+			"siglip": get_siglip().stats(),
+			"content_store": store.stats() if store is not None else None,
+			"vector_store": vectors.stats() if vectors is not None and hasattr(vectors, 'stats') else None,
+			"search_cache": get_search_cache().stats(),
+		})
+
+
 class UIIndexView(TemplateView):
 	template_name = 'images/ui.html'
@@ -1,4 +1,5 @@
 import os
+import json
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -110,11 +111,43 @@ SAGEMAKER_ENDPOINT_NAME = os.getenv('SAGEMAKER_ENDPOINT_NAME')
 SAGEMAKER_TEXT_ENDPOINT_NAME = os.getenv('SAGEMAKER_TEXT_ENDPOINT_NAME', SAGEMAKER_ENDPOINT_NAME)
 SAGEMAKER_IMAGE_ENDPOINT_NAME = os.getenv('SAGEMAKER_IMAGE_ENDPOINT_NAME', SAGEMAKER_ENDPOINT_NAME)
 SAGEMAKER_RUNTIME_REGION = os.getenv('SAGEMAKER_RUNTIME_REGION') or os.getenv('AWS_REGION')
+# Realtime endpoint for small interactive images sent inline as base64; larger images use async.
+# Empty (the default) disables it: the handler must accept {"image_b64": ...}, which the text one does not
+SAGEMAKER_REALTIME_IMAGE_ENDPOINT_NAME = os.getenv('SAGEMAKER_REALTIME_IMAGE_ENDPOINT_NAME', '')
+INLINE_IMAGE_MAX_BYTES = int(os.getenv('INLINE_IMAGE_MAX_BYTES', str(256 * 1024)))
+# Realtime client limits; a hedged duplicate covers slow instances instead of retries, so the
+# worst case is about hedge_max_delay + one read timeout rather than attempts x timeout
+SAGEMAKER_REALTIME_READ_TIMEOUT = float(os.getenv('SAGEMAKER_REALTIME_READ_TIMEOUT', '3'))
+SAGEMAKER_REALTIME_MAX_ATTEMPTS = int(os.getenv('SAGEMAKER_REALTIME_MAX_ATTEMPTS', '1'))
+# Per-endpoint hedging/circuit breaker config as JSON, keyed by endpoint name or "default", e.g.
+# {"default": {"hedge_percentile": 95, "hedge_max_delay": 2, "hedge_max_rate": 0.05, "breaker_error_rate": 0.5, "breaker_open_seconds": 15}}
+SAGEMAKER_ENDPOINT_RESILIENCE = json.loads(os.getenv('SAGEMAKER_ENDPOINT_RESILIENCE', '{}') or '{}')
 EMBEDDINGS_PROVIDER = os.getenv('SIGLIP_PROVIDER', 'local')  # 'local' or 'sagemaker'
 AWS_REGION = os.getenv('AWS_REGION', SAGEMAKER_RUNTIME_REGION or 'eu-north-1')
 SAGEMAKER_ASYNC = os.getenv('SAGEMAKER_ASYNC', '1') == '1'
+# Accept header for embedding responses; binary formats (application/x-npy, application/x-embedding-f32) skip JSON parsing
+SAGEMAKER_EMBEDDING_ACCEPT = os.getenv('SAGEMAKER_EMBEDDING_ACCEPT', 'application/json')
 # Async polling timeout (seconds)
 SAGEMAKER_ASYNC_TIMEOUT = int(os.getenv('SAGEMAKER_ASYNC_TIMEOUT', '150'))
+# Cached endpoint readiness: describe_endpoint refresh interval and assumed cold-start time for ETAs
+ENDPOINT_READINESS_TTL = float(os.getenv('ENDPOINT_READINESS_TTL', '30'))
+ENDPOINT_WARMUP_SECONDS = float(os.getenv('ENDPOINT_WARMUP_SECONDS', '600'))
+# Async output polling: first probes follow observed completion times, then geometric backoff with jitter
+ASYNC_POLL_MIN_DELAY = float(os.getenv('ASYNC_POLL_MIN_DELAY', '0.25'))
+ASYNC_POLL_MAX_DELAY = float(os.getenv('ASYNC_POLL_MAX_DELAY', '15'))
+ASYNC_POLL_INITIAL_DELAY = float(os.getenv('ASYNC_POLL_INITIAL_DELAY', '1.0'))
+ASYNC_POLL_BACKOFF = float(os.getenv('ASYNC_POLL_BACKOFF', '1.6'))
+# Micro-batching of async image jobs into one image_urls invocation (max 1 disables)
+ASYNC_IMAGE_BATCH_MAX = int(os.getenv('ASYNC_IMAGE_BATCH_MAX', '16'))
+ASYNC_IMAGE_BATCH_WINDOW_MS = float(os.getenv('ASYNC_IMAGE_BATCH_WINDOW_MS', '50'))
+# Upper bound on outstanding async image jobs per worker process
+SAGEMAKER_ASYNC_MAX_IN_FLIGHT = int(os.getenv('SAGEMAKER_ASYNC_MAX_IN_FLIGHT', '256'))
+# Text embedding cache: in-process LRU + SQLite file shared by workers (empty path disables disk tier)
+TEXT_EMBED_CACHE_ENTRIES = int(os.getenv('TEXT_EMBED_CACHE_ENTRIES', '2048'))
+TEXT_EMBED_CACHE_PATH = os.getenv('TEXT_EMBED_CACHE_PATH', '/tmp/hybrag/text-embeddings.sqlite3')
+TEXT_EMBED_CACHE_MAX_MB = int(os.getenv('TEXT_EMBED_CACHE_MAX_MB', '256'))
+# Parallel single-text calls when the text endpoint does not accept list payloads
+TEXT_EMBED_CONCURRENCY = int(os.getenv('TEXT_EMBED_CONCURRENCY', '4'))
 
 # S3 (presigned URLs)
 S3_BUCKET = os.getenv('S3_BUCKET', '')
@@ -123,6 +156,21 @@ ASYNC_S3_INPUT_BUCKET = os.getenv('ASYNC_S3_INPUT_BUCKET', S3_BUCKET)
 ASYNC_S3_INPUT_PREFIX = os.getenv('ASYNC_S3_INPUT_PREFIX', 'siglip2-async-inputs/')
 ASYNC_S3_OUTPUT_BUCKET = os.getenv('ASYNC_S3_OUTPUT_BUCKET', ASYNC_S3_INPUT_BUCKET)
 ASYNC_S3_OUTPUT_PREFIX = os.getenv('ASYNC_S3_OUTPUT_PREFIX', 'siglip2-async-outputs/')
+# SQS queue subscribed to the async endpoint's success/error SNS topics; polling becomes a slow fallback
+ASYNC_NOTIFICATION_QUEUE_URL = os.getenv('ASYNC_NOTIFICATION_QUEUE_URL', '')
+ASYNC_NOTIFICATION_SQS_ENDPOINT_URL = os.getenv('ASYNC_NOTIFICATION_SQS_ENDPOINT_URL', '')  # e.g. local ElasticMQ
+ASYNC_NOTIFICATION_FALLBACK_POLL = float(os.getenv('ASYNC_NOTIFICATION_FALLBACK_POLL', '15'))
+
+# Ingest preprocessing: embed from a model-sized JPEG derivative instead of the full-resolution original
+EMBED_DOWNSCALE = os.getenv('EMBED_DOWNSCALE', '1') == '1'
+EMBED_IMAGE_SIZE = int(os.getenv('EMBED_IMAGE_SIZE', '384'))
+EMBED_DERIVATIVE_QUALITY = int(os.getenv('EMBED_DERIVATIVE_QUALITY', '90'))
+EMBED_DERIVATIVE_PREFIX = os.getenv('EMBED_DERIVATIVE_PREFIX', 'derived/siglip2/')
+# Content-addressed image embedding store: 's3' (S3_BUCKET), 'local' (SQLite on this host) or '' to disable
+EMBED_CONTENT_STORE = os.getenv('EMBED_CONTENT_STORE', 's3')
+EMBED_CONTENT_STORE_PREFIX = os.getenv('EMBED_CONTENT_STORE_PREFIX', 'embeddings/by-content/')
+EMBED_CONTENT_STORE_PATH = os.getenv('EMBED_CONTENT_STORE_PATH', '/tmp/hybrag/image-embeddings.sqlite3')
+EMBED_CONTENT_STORE_MAX_MB = int(os.getenv('EMBED_CONTENT_STORE_MAX_MB', '1024'))
 
 # OpenSearch
 OS_HOST = os.getenv('OS_HOST', '')  # e.g., https://search-... or https://<vpce>...
@@ -136,4 +184,26 @@ OS_K = int(os.getenv('OS_K', '10'))
 # S3 Vector DB
 VECTOR_S3_BUCKET = os.getenv('VECTOR_S3_BUCKET', 'google-siglip2-giant-opt-patch16-384-vector-db')
 VECTOR_S3_INDEX = os.getenv('VECTOR_S3_INDEX', 'images')
-VECTOR_S3_PREFIX = os.getenv('VECTOR_S3_PREFIX', 'vectors/')
\ No newline at end of file
+VECTOR_S3_PREFIX = os.getenv('VECTOR_S3_PREFIX', 'vectors/')
+# Local ANN index answering searches in front of the vector store: '' (none), 'hnsw', 'ivf' or 'pq'
+VECTOR_INDEX = os.getenv('VECTOR_INDEX', '')
+VECTOR_HNSW_PATH = os.getenv('VECTOR_HNSW_PATH', '/tmp/hybrag/hnsw-images.bin')
+VECTOR_HNSW_M = int(os.getenv('VECTOR_HNSW_M', '16'))
+VECTOR_HNSW_EF_CONSTRUCTION = int(os.getenv('VECTOR_HNSW_EF_CONSTRUCTION', '200'))
+VECTOR_HNSW_EF_SEARCH = int(os.getenv('VECTOR_HNSW_EF_SEARCH', '64'))
+VECTOR_IVF_PATH = os.getenv('VECTOR_IVF_PATH', '/tmp/hybrag/ivf-images.npz')
+# 0 picks ~4*sqrt(n) lists at build time
+VECTOR_IVF_NLIST = int(os.getenv('VECTOR_IVF_NLIST', '0'))
+VECTOR_IVF_NPROBE = int(os.getenv('VECTOR_IVF_NPROBE', '8'))
+VECTOR_PQ_PATH = os.getenv('VECTOR_PQ_PATH', '/tmp/hybrag/pq-images.npz')
+# Bytes per vector (0 = dim/8, i.e. 192 for 1536 dims); must divide the dimension
+VECTOR_PQ_M = int(os.getenv('VECTOR_PQ_M', '0'))
+# Candidates per result rescored with full vectors from the store (0 = ADC scores only)
+VECTOR_PQ_RERANK = int(os.getenv('VECTOR_PQ_RERANK', '4'))
+# How per-synonym search results are merged: 'max' (best similarity per image) or 'rrf' (reciprocal rank fusion)
+VECTOR_MULTI_QUERY_FUSION = os.getenv('VECTOR_MULTI_QUERY_FUSION', 'max')
+# Search result cache: in-process LRU + SQLite file shared by workers; writes invalidate it (TTL 0 disables)
+SEARCH_CACHE_TTL_SECONDS = float(os.getenv('SEARCH_CACHE_TTL_SECONDS', '60'))
+SEARCH_CACHE_ENTRIES = int(os.getenv('SEARCH_CACHE_ENTRIES', '512'))
+SEARCH_CACHE_PATH = os.getenv('SEARCH_CACHE_PATH', '/tmp/hybrag/search-results.sqlite3')
+SEARCH_CACHE_MAX_MB = int(os.getenv('SEARCH_CACHE_MAX_MB', '64'))
\ No newline at end of file
@@ -2,6 +2,7 @@ from __future__ import annotations
 from typing import Dict
 import boto3
 from botocore.config import Config
+from botocore.exceptions import ClientError
 from django.conf import settings
 
 _region = getattr(settings, 'AWS_REGION', 'eu-north-1')
@@ -19,6 +20,10 @@ _s3 = boto3.client(
 )
 
 
+def client():
+	return _s3
+
+
 def presign_put(key: str, content_type: str = 'image/jpeg') -> Dict:
 	if not _bucket:
 		raise ValueError('S3_BUCKET not configured')
@@ -39,3 +44,31 @@ def presign_get(key: str) -> str:
         ExpiresIn=min(_expire, 900),
 	)
 
+
+
+def put_bytes(key: str, body: bytes, content_type: str = 'application/octet-stream', metadata: Dict[str, str] | None = None) -> Dict:
+	if not _bucket:
+		raise ValueError('S3_BUCKET not configured')
+	params = {'Bucket': _bucket, 'Key': key, 'Body': body, 'ContentType': content_type}
+	if metadata:
+		params['Metadata'] = metadata
+	return _s3.put_object(**params)
+
+
+def get_bytes(key: str) -> bytes:
+	if not _bucket:
+		raise ValueError('S3_BUCKET not configured')
+	return _s3.get_object(Bucket=_bucket, Key=key)['Body'].read()
+
+
+def head(key: str) -> Dict | None:
+	"""Object metadata, or None when the key does not exist."""
+	if not _bucket:
+		raise ValueError('S3_BUCKET not configured')
+	try:
+		return _s3.head_object(Bucket=_bucket, Key=key)
+	except ClientError as e:
+		code = (e.response or {}).get('Error', {}).get('Code')
+		if code in ('404', 'NoSuchKey', 'NotFound'):
+			return None
+		raise